@@ -1,18 +1,69 @@
 import azure.functions as func
 # from compare_multiple_edi_files import process_all_files
-from azure.storage.blob import BlobServiceClient
+import asyncio
 import os
 import uuid
 import datetime
+import io
 import json
 import logging
-import difflib
+import tempfile
+import threading
+import time
+import zipfile
+
+# the compare core is the comparecore package (package_function_app.py);
+# azure.storage.blob is imported by the functions that talk to storage, not
+# at cold start
+from comparecore.diff_budget import DEFAULT_MAX_BYTES, DEFAULT_MAX_SECONDS, DiffBudget
+from comparecore.diff_engine import DEFAULT_ENGINE
+from comparecore.diff_report import SegmentHtmlDiff
+from comparecore.diff_summary import (DEFAULT_MAX_DIFFERENCES, RESULTS_FILE_NAME, SUMMARY_FILE_NAME, batch_summary,
+                                      empty_counts)
+from comparecore.edi_archive import list_members, member_path
+from comparecore.edi_compare import compare_segment_streams, shared_separator, text_element_separator
+from comparecore.edi_normalize import Normalizer, iter_normalized_segments, iter_normalized_text_segments
+from comparecore.edi_pairing import DEFAULT_FROM_PATTERN, DEFAULT_TO_PATTERN, index_names, pair_indexes
+from comparecore.edi_tokenizer import (HEADER_PROBE_SIZE, detect_delimiters, iter_segments_from_stream,
+                                       read_delimiters)
+from comparecore.fan_out import (DEFAULT_SHARD_SIZE, QUEUE_SEND_CONCURRENCY, aggregate, failed_shard_records,
+                                 fan_out_enabled, is_complete, jsonl, mark_shard, new_progress, new_run, parse_message,
+                                 progress_blob_name, results_blob_name, run_blob_name, shard_blob_name,
+                                 summary_blob_name)
+from comparecore.report_writer import DEFAULT_CHUNK_SIZE, iter_byte_blocks, iter_file_blocks, upload_blocks_async
+
+# concurrency limits, overridable through app settings of the same name
+DEFAULT_MAX_CONCURRENT_PAIRS = 8
+DEFAULT_MAX_CONCURRENT_UPLOADS = 4
+DEFAULT_BLOB_MAX_CONCURRENCY = 4
+DEFAULT_DIFF_WORKERS = os.cpu_count() or 1
+
+# report upload: staged block size and optional gzip Content-Encoding
+DEFAULT_REPORT_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
+
+# zip blobs are read in place, member data in ranges of this size
+ARCHIVE_SUFFIX = ".zip"
+ARCHIVE_RANGE_SIZE = 4 * 1024 * 1024
+
+# fan-out mode (app setting FanOut): shards of pairs go through this queue of the storage account
+SHARD_QUEUE_NAME = "edicompare-shards"
+# messages the Functions host gave up on after maxDequeueCount attempts
+POISON_QUEUE_NAME = f"{SHARD_QUEUE_NAME}-poison"
 
 app = func.FunctionApp()
 
+
+def _int_setting(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _bool_setting(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ("1", "true", "yes")
+
+
 @app.function_name(name="EdiCompare")
 @app.route(route="compare", auth_level=func.AuthLevel.ANONYMOUS)
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
     connect_str = os.environ.get("BlobStorageConnectionString")
     if not connect_str:
@@ -21,66 +72,758 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500
         )
 
-    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-    # container setup
-    from_container = blob_service_client.get_container_client("fromdata")
-    to_container = blob_service_client.get_container_client("todata")
-    results_container = blob_service_client.get_container_client("edicompareresults")
+    engine = os.environ.get("DiffEngine", DEFAULT_ENGINE)
+    # e.g. "ISA09,ISA10,ISA13,GS04,GS05,GS06,ST02,SE02", see edi_normalize
+    normalize = os.environ.get("NormalizeRules") or None
 
     try:
-        process_all_files_azure(from_container, to_container, results_container)
-        return func.HttpResponse("Processing completed", status_code=200)
+        if fan_out_enabled():
+            # the batch is compared by the EdiCompareShard instances; the caller polls the summary blob
+            run = await start_edi_fan_out(connect_str, engine=engine, normalize=normalize)
+            return func.HttpResponse(
+                json.dumps({key: run[key] for key in ("run_id", "items", "shards", "summary")}),
+                status_code=202,
+                mimetype="application/json"
+            )
+        results = await run_edi_compare(connect_str, engine=engine, normalize=normalize)
+        failed = sum(1 for result in results if result["status"] == "error")
+        return func.HttpResponse(
+            f"Processing completed: {len(results)} pairs, {failed} failed",
+            status_code=200
+        )
     except Exception as e:
         return func.HttpResponse(f"Error processing files : {str(e)}", status_code=500)
 
 
-def download_and_decode(blob_client):
+async def run_edi_compare(connect_str, engine=DEFAULT_ENGINE, normalize=None):
+    """ Compare every fromdata/todata pair of the storage account in connect_str.
+
+    One BlobServiceClient (and so one HTTP connection pool) serves the whole
+    run. Works against Azurite with connect_str "UseDevelopmentStorage=true".
+    """
+    from azure.storage.blob.aio import BlobServiceClient
+    from concurrent.futures import ProcessPoolExecutor
+
+    diff_workers = _int_setting("DiffWorkers", DEFAULT_DIFF_WORKERS)
+    executor = ProcessPoolExecutor(max_workers=diff_workers) if diff_workers > 1 else None
     try:
-        download_stream = blob_client.download_blob(max_consurrency=4)
-        content = download_stream.readall()
-        return content.decode('utf-8')
-    except Exception as e:
-        print(f"Download failed for {blob_client.blob_name}: {str(e)}")
+        async with BlobServiceClient.from_connection_string(connect_str) as blob_service_client:
+            # container setup
+            from_container = blob_service_client.get_container_client("fromdata")
+            to_container = blob_service_client.get_container_client("todata")
+            results_container = blob_service_client.get_container_client("edicompareresults")
 
+            return await process_all_files_azure(
+                from_container, to_container, results_container,
+                engine=engine,
+                connect_str=connect_str,
+                normalize=normalize,
+                max_concurrent_pairs=_int_setting("MaxConcurrentPairs", DEFAULT_MAX_CONCURRENT_PAIRS),
+                executor=executor,
+                **_compare_settings()
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
 
-def process_all_files_azure(from_container, to_container, results_container):
-    # list all blobs in from container
-    from_blobs = list(from_container.list_blobs(name_starts_with="edi"))
-    for blob in from_blobs:
-        # Extract UUID from filename       
-        parts_from = blob.name.split('_')
-        uuid_part = parts_from[1].split('.')[0]
-
-
-        # # get matching toData blob
-        to_blob_name = f"{parts_from[0]}bla_{uuid_part}.txt"
-        to_blob = to_container.get_blob_client(to_blob_name)
-        print(f" to_blob_name: {to_blob_name}")   
-        print(f" blob.name: {blob.name}")
-
-        if to_blob.exists():
-            # download files
-            from_blob_client = from_container.get_blob_client(blob.name)
-
-            from_content = from_blob_client.download_blob().readall().decode()
-            to_content = to_blob.download_blob().readall().decode()
-            # from_content = download_and_decode(from_container.download_blob(blob.name))
-            # to_content = download_and_decode(to_container.download_blob(to_blob_name))            
-            print(f" from_content: {from_content}")   
-            print(f" to_content : {to_content}")
-            # Generate diff
-            html_diff = difflib.HtmlDiff().make_file(
-                from_content.splitlines(),
-                to_content.splitlines(),
-                fromdesc=blob,
-                todesc=to_blob_name
+def _compare_settings():
+    # per pair limits and report upload settings, shared by batch runs and shards
+    return dict(
+        max_seconds=float(os.environ.get("DiffMaxSeconds", DEFAULT_MAX_SECONDS)),
+        max_bytes=_int_setting("DiffMaxBytes", DEFAULT_MAX_BYTES),
+        max_concurrent_uploads=_int_setting("MaxConcurrentUploads", DEFAULT_MAX_CONCURRENT_UPLOADS),
+        blob_max_concurrency=_int_setting("BlobMaxConcurrency", DEFAULT_BLOB_MAX_CONCURRENCY),
+        report_chunk_size=_int_setting("ReportChunkSize", DEFAULT_REPORT_CHUNK_SIZE),
+        gzip_reports=_bool_setting("GzipReports"),
+    )
+
+
+async def send_queue_messages(connect_str, queue_name, messages):
+    """ Enqueue messages, base64 encoded as the queue trigger expects, QUEUE_SEND_CONCURRENCY at a time. """
+    from azure.core.exceptions import ResourceExistsError
+    from azure.storage.queue import TextBase64EncodePolicy
+    from azure.storage.queue.aio import QueueClient
+
+    async with QueueClient.from_connection_string(connect_str, queue_name,
+                                                  message_encode_policy=TextBase64EncodePolicy()) as queue_client:
+        try:
+            await queue_client.create_queue()
+        except ResourceExistsError:
+            pass
+        for start in range(0, len(messages), QUEUE_SEND_CONCURRENCY):
+            await asyncio.gather(*(queue_client.send_message(message)
+                                   for message in messages[start:start + QUEUE_SEND_CONCURRENCY]))
+
+
+async def start_edi_fan_out(connect_str, engine=DEFAULT_ENGINE, normalize=None):
+    """ List the batch, record a fan-out run and enqueue its shards; returns the run record.
+
+    Only the listing (and the central directories of archives) is read
+    here. Every shard of FanOutShardSize work items becomes one message of
+    SHARD_QUEUE_NAME for EdiCompareShard; the completion record is written
+    to the run's summary.json in edicompareresults (see fan_out).
+    """
+    from azure.storage.blob.aio import BlobServiceClient
+
+    async with BlobServiceClient.from_connection_string(connect_str) as blob_service_client:
+        from_container = blob_service_client.get_container_client("fromdata")
+        to_container = blob_service_client.get_container_client("todata")
+        results_container = blob_service_client.get_container_client("edicompareresults")
+
+        items = []
+        records = []
+        async for item in list_work_items(from_container, to_container, connect_str):
+            (records if "status" in item else items).append(item)
+        run, messages = new_run("edi", items, records, shard_size=_int_setting("FanOutShardSize", DEFAULT_SHARD_SIZE),
+                                options={"engine": engine, "normalize": normalize})
+        await results_container.upload_blob(run_blob_name(run["run_id"]), json.dumps(run, indent=2),
+                                            overwrite=True)
+        await results_container.upload_blob(progress_blob_name(run["run_id"]), new_progress(run["shards"]),
+                                            overwrite=True)
+        logging.info(f"Fan-out run {run['run_id']}: {len(items)} pairs in {len(messages)} shards")
+        if messages:
+            await send_queue_messages(connect_str, SHARD_QUEUE_NAME, messages)
+        else:
+            await complete_edi_run(results_container, run["run_id"])
+    return run
+
+
+@app.function_name(name="EdiCompareShard")
+@app.queue_trigger(arg_name="msg", queue_name=SHARD_QUEUE_NAME, connection="BlobStorageConnectionString")
+async def compare_shard(msg: func.QueueMessage) -> None:
+    message = parse_message(msg.get_body())
+    logging.info(f"Run {message['run_id']} shard {message['shard']}: {len(message['items'])} pairs "
+                 f"(attempt {msg.dequeue_count})")
+    await run_edi_shard(os.environ["BlobStorageConnectionString"], message)
+
+
+@app.function_name(name="EdiCompareShardFailed")
+@app.queue_trigger(arg_name="msg", queue_name=POISON_QUEUE_NAME, connection="BlobStorageConnectionString")
+async def record_failed_shard(msg: func.QueueMessage) -> None:
+    # the shard kept failing (e.g. timed out), record its pairs so the run still completes
+    message = parse_message(msg.get_body())
+    logging.error(f"Run {message['run_id']} shard {message['shard']} failed, recording its pairs as errors")
+    await finish_edi_shard(os.environ["BlobStorageConnectionString"], message,
+                           failed_shard_records(message, "shard failed after the queue's retries"))
+
+
+async def run_edi_shard(connect_str, message):
+    """ Compare the work items of one shard message and record their results.
+
+    Up to MaxConcurrentPairs items run at once, with the settings of a
+    batch run and the engine / normalize rules the run was started with.
+    """
+    from azure.storage.blob.aio import BlobServiceClient
+    from concurrent.futures import ProcessPoolExecutor
+
+    options = message["options"]
+    items = message["items"]
+    diff_workers = _int_setting("DiffWorkers", DEFAULT_DIFF_WORKERS)
+    executor = ProcessPoolExecutor(max_workers=diff_workers) if diff_workers > 1 and len(items) > 1 else None
+    pair_slots = asyncio.Semaphore(_int_setting("MaxConcurrentPairs", DEFAULT_MAX_CONCURRENT_PAIRS))
+    try:
+        async with BlobServiceClient.from_connection_string(connect_str) as blob_service_client:
+            comparer = EdiPairComparer(
+                blob_service_client.get_container_client("fromdata"),
+                blob_service_client.get_container_client("todata"),
+                blob_service_client.get_container_client("edicompareresults"),
+                engine=options.get("engine", DEFAULT_ENGINE),
+                connect_str=connect_str,
+                normalize=options.get("normalize"),
+                executor=executor,
+                **_compare_settings()
             )
-            print(html_diff) 
-            # upload results
-            report_name = f"{parts_from[0]}_{uuid_part}_report.html"
-            results_container.upload_blob(
-                name=report_name,
-                data=html_diff
-                # overrite=True
+
+            async def compare(item):
+                async with pair_slots:
+                    return await comparer.compare(item)
+
+            results = await asyncio.gather(*(compare(item) for item in items))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    await finish_edi_shard(connect_str, message, results)
+
+
+async def finish_edi_shard(connect_str, message, results):
+    """ Write the result records of a shard; the shard completing the run writes the completion record. """
+    from azure.storage.blob.aio import BlobServiceClient
+
+    run_id = message["run_id"]
+    async with BlobServiceClient.from_connection_string(connect_str) as blob_service_client:
+        results_container = blob_service_client.get_container_client("edicompareresults")
+        await results_container.upload_blob(shard_blob_name(run_id, message["shard"]), jsonl(results),
+                                            overwrite=True)
+        if await mark_edi_shard_done(results_container, message):
+            await complete_edi_run(results_container, run_id)
+
+
+async def mark_edi_shard_done(results_container, message):
+    """ Set the bit of a shard in its run's progress blob; True for the one shard that is to complete the run.
+
+    The write is conditional on the etag read (If-Match), so shards finishing
+    together never drop each other's bit and only one sees the last bit set.
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceModifiedError
+
+    run_id = message["run_id"]
+    progress_blob = results_container.get_blob_client(progress_blob_name(run_id))
+    while True:
+        download = await progress_blob.download_blob()
+        progress, marked = mark_shard(await download.readall(), message["shard"])
+        if not marked:
+            # a retried message: complete the run only if the shard completing it failed to
+            return (is_complete(message["shards"], progress)
+                    and not await results_container.get_blob_client(summary_blob_name(run_id)).exists())
+        try:
+            await progress_blob.upload_blob(progress, overwrite=True, etag=download.properties.etag,
+                                            match_condition=MatchConditions.IfNotModified)
+        except ResourceModifiedError:
+            # another shard wrote in between, read its bit too
+            continue
+        return is_complete(message["shards"], progress)
+
+
+async def complete_edi_run(results_container, run_id):
+    """ Aggregate the shards of a run into results.jsonl and summary.json (see mark_edi_shard_done). """
+    run = json.loads(await (await results_container.download_blob(run_blob_name(run_id))).readall())
+    shard_texts = []
+    for shard in range(run["shards"]):
+        download = await results_container.download_blob(shard_blob_name(run_id, shard))
+        shard_texts.append((await download.readall()).decode("utf-8"))
+    results, summary = aggregate(run, shard_texts)
+    await results_container.upload_blob(results_blob_name(run_id), jsonl(results), overwrite=True)
+    await results_container.upload_blob(summary_blob_name(run_id), json.dumps(summary, indent=2), overwrite=True)
+    logging.info(f"Fan-out run {run_id} completed: {summary['pairs']} pairs, {summary['failed']} failed")
+
+
+async def drain_shard_queue(connect_str):
+    """ Compare the queued shards in this process, as EdiCompareShard does (local runs against Azurite). """
+    from azure.storage.queue import TextBase64DecodePolicy
+    from azure.storage.queue.aio import QueueClient
+
+    async with QueueClient.from_connection_string(connect_str, SHARD_QUEUE_NAME,
+                                                  message_decode_policy=TextBase64DecodePolicy()) as queue_client:
+        async for queue_message in queue_client.receive_messages():
+            await run_edi_shard(connect_str, parse_message(queue_message.content))
+            await queue_client.delete_message(queue_message)
+
+
+async def run_local_fan_out(connect_str, engine=DEFAULT_ENGINE, normalize=None):
+    run = await start_edi_fan_out(connect_str, engine=engine, normalize=normalize)
+    await drain_shard_queue(connect_str)
+    return run
+
+
+async def download_blob_bytes(container_client, blob_name, max_concurrency=DEFAULT_BLOB_MAX_CONCURRENCY):
+    """ Download a blob, fetching large blobs in max_concurrency parallel ranges. """
+    download_stream = await container_client.download_blob(blob_name, max_concurrency=max_concurrency)
+    return await download_stream.readall()
+
+
+async def download_blob_to_file(container_client, blob_name, file, max_concurrency=DEFAULT_BLOB_MAX_CONCURRENCY):
+    """ Download a blob into an open binary file, range by range, never holding it whole. """
+    download_stream = await container_client.download_blob(blob_name, max_concurrency=max_concurrency)
+    return await download_stream.readinto(file)
+
+
+def blobs_identical_by_properties(from_props, to_props):
+    """ True when listing metadata proves two blobs hold the same bytes.
+
+    Only Content-MD5 (with matching size) is trusted: ETags are per blob and
+    never match across containers. Blobs without a stored MD5 are downloaded.
+    """
+    if from_props.size != to_props.size:
+        return False
+    from_md5 = from_props.content_settings.content_md5
+    to_md5 = to_props.content_settings.content_md5
+    return bool(from_md5) and from_md5 == to_md5
+
+
+def identical_report(fromdesc, todesc):
+    """ "No Differences Found" report for pairs that were not downloaded. """
+    return SegmentHtmlDiff().make_file([], [], fromdesc=fromdesc, todesc=todesc, context=True)
+
+
+class BlobRangeFile(io.RawIOBase):
+    """ Seekable read only view of a blob, downloaded range by range.
+
+    zipfile reads the central directory from the end of the archive and then
+    only the members it opens, so a zip blob is read range by range instead
+    of being downloaded whole. Reads are not buffered: every read is one
+    range of the size asked for, so the small reads of the end of central
+    directory, local file headers and the delimiter probe stay small, and
+    member data comes in the chunks the tokenizer reads.
+    """
+
+    def __init__(self, blob_client, size):
+        self._blob_client = blob_client
+        self._size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self._size - self._position)
+        if length <= 0:
+            return 0
+        data = self._blob_client.download_blob(offset=self._position, length=length).readall()
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def open_blob_archive(connect_str, container_name, blob_name):
+    """ Open a zip blob in place as a zipfile.ZipFile. """
+    from azure.storage.blob import BlobClient
+
+    blob_client = BlobClient.from_connection_string(connect_str, container_name, blob_name)
+    size = blob_client.get_blob_properties().size
+    return zipfile.ZipFile(BlobRangeFile(blob_client, size))
+
+
+# archives opened by the executor thread (or process) running diff_archive_members
+_worker_archives = threading.local()
+
+
+def open_worker_archive(connect_str, container_name, blob_name, etag=None):
+    """ open_blob_archive, kept open for the next member pairs the same worker diffs.
+
+    Pairs of an archive are listed one after another, so a worker keeps the
+    last archive of each container: its properties and central directory
+    are read once per worker, not once per pair. A worker never shares it
+    with another thread, which would interleave reads on one ZipFile. The
+    listed etag is part of the key, so a blob replaced between runs is
+    opened afresh.
+    """
+    archives = _worker_archives.__dict__.setdefault("archives", {})
+    key = (connect_str, container_name)
+    opened = archives.get(key)
+    if opened is not None and opened[0] == (blob_name, etag):
+        return opened[1]
+    archive = open_blob_archive(connect_str, container_name, blob_name)
+    archives[key] = ((blob_name, etag), archive)
+    if opened is not None:
+        opened[1].close()
+    return archive
+
+
+def pair_archive_blobs(connect_str, from_container_name, to_container_name, archive_name):
+    """ Pair the members of a fromdata / todata archive by UUID (see edi_pairing).
+
+    Runs in the executor; only the central directories are downloaded.
+    """
+    with open_blob_archive(connect_str, from_container_name, archive_name) as from_archive, \
+            open_blob_archive(connect_str, to_container_name, archive_name) as to_archive:
+        from_index, from_unmatched = index_names(list_members(from_archive), DEFAULT_FROM_PATTERN)
+        to_index, to_unmatched = index_names(list_members(to_archive), DEFAULT_TO_PATTERN)
+    return pair_indexes(from_index, to_index, from_unmatched, to_unmatched)
+
+
+def diff_archive_members(connect_str, from_container_name, to_container_name, archive_name, from_member,
+                         to_member, engine=DEFAULT_ENGINE, max_differences=DEFAULT_MAX_DIFFERENCES,
+                         normalize=None, max_seconds=DEFAULT_MAX_SECONDS, max_bytes=DEFAULT_MAX_BYTES,
+                         from_etag=None, to_etag=None):
+    """ Diff one member pair of a fromdata / todata archive into a temporary report.
+
+    Runs in the executor, on the archives this worker already has open
+    (open_worker_archive). Both members are streamed from the blobs into the
+    tokenizer, nothing is extracted. Returns (report path, summary, input
+    bytes), the report and summary as diff_edi_contents.
+    """
+    normalizer = Normalizer(normalize) if normalize else None
+    from_archive = open_worker_archive(connect_str, from_container_name, archive_name, from_etag)
+    to_archive = open_worker_archive(connect_str, to_container_name, archive_name, to_etag)
+    streams = []
+    sides = []
+    try:
+        for archive, member in ((from_archive, from_member), (to_archive, to_member)):
+            stream = archive.open(member)
+            streams.append(stream)
+            # the delimiters are peeked from the stream that is then tokenized
+            delimiters = detect_delimiters(stream.peek(HEADER_PROBE_SIZE)[:HEADER_PROBE_SIZE]
+                                           .decode(errors="replace"))
+            segments = iter_segments_from_stream(stream, delimiters=delimiters, chunk_size=ARCHIVE_RANGE_SIZE)
+            if normalizer is not None:
+                segments = normalizer.iter_normalized(segments, delimiters.element)
+            sides.append((segments, delimiters.element))
+        (from_segments, from_separator), (to_segments, to_separator) = sides
+        input_bytes = from_archive.getinfo(from_member).file_size + to_archive.getinfo(to_member).file_size
+        report_path, summary = diff_edi_segments(
+            from_segments, to_segments, shared_separator(from_separator, to_separator),
+            input_bytes, member_path(archive_name, from_member), member_path(archive_name, to_member),
+            engine, max_differences, max_seconds, max_bytes)
+    finally:
+        for stream in streams:
+            stream.close()
+    return report_path, summary, input_bytes
+
+
+def diff_edi_contents(from_content, to_content, fromdesc, todesc, engine=DEFAULT_ENGINE,
+                      max_differences=DEFAULT_MAX_DIFFERENCES, normalize=None,
+                      max_seconds=DEFAULT_MAX_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+    """ Decode both blobs and stream the HTML report to a temporary file.
+
+    Runs in the executor; returns the path of the report, which the caller
+    uploads and removes, and the diff summary of the pair. normalize is a
+    list of edi_normalize rules applied to both sides before diffing.
+    A pair over max_seconds / max_bytes falls back to a coarser diff or a
+    summary only report and is marked degraded (see diff_budget), so one
+    pathological pair cannot run into the function timeout.
+    """
+    normalizer = Normalizer(normalize) if normalize else None
+    from_text = from_content.decode()
+    to_text = to_content.decode()
+    # changed segments are highlighted element by element
+    return diff_edi_segments(iter_normalized_text_segments(from_text, normalizer),
+                             iter_normalized_text_segments(to_text, normalizer),
+                             text_element_separator(from_text, to_text),
+                             len(from_content) + len(to_content), fromdesc, todesc, engine,
+                             max_differences, max_seconds, max_bytes)
+
+
+def diff_edi_files(from_path, to_path, fromdesc, todesc, engine=DEFAULT_ENGINE,
+                   max_differences=DEFAULT_MAX_DIFFERENCES, normalize=None,
+                   max_seconds=DEFAULT_MAX_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+    """ diff_edi_contents of two blobs spooled to local files, streamed from disk.
+
+    Runs in the executor, for pairs whose listed sizes are over max_bytes:
+    their segments are only counted (see diff_edi_segments), so neither
+    blob is ever read into memory.
+    """
+    normalizer = Normalizer(normalize) if normalize else None
+    return diff_edi_segments(iter_normalized_segments(from_path, normalizer),
+                             iter_normalized_segments(to_path, normalizer),
+                             shared_separator(read_delimiters(from_path).element, read_delimiters(to_path).element),
+                             os.path.getsize(from_path) + os.path.getsize(to_path), fromdesc, todesc, engine,
+                             max_differences, max_seconds, max_bytes)
+
+
+def diff_edi_segments(from_segments, to_segments, separator, input_bytes, fromdesc, todesc,
+                      engine=DEFAULT_ENGINE, max_differences=DEFAULT_MAX_DIFFERENCES,
+                      max_seconds=DEFAULT_MAX_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+    """ Diff two segment streams within budget into a temporary report.
+
+    Returns (report path, summary). Streams of more than max_bytes input
+    bytes are only counted, never held in memory.
+    """
+    started = time.monotonic()
+    with tempfile.NamedTemporaryFile(suffix=".html", delete=False) as report_file:
+        report_path = report_file.name
+    # full report: no folding and difflib's default tab size and line width
+    summary = compare_segment_streams(from_segments, to_segments, input_bytes, report_path, fromdesc, todesc,
+                                      engine=engine, budget=DiffBudget(max_seconds, max_bytes), started=started,
+                                      separator=separator, max_differences=max_differences,
+                                      tabsize=8, wrapcolumn=None)
+    return report_path, summary
+
+
+def blob_work_item(from_blob, to_blobs):
+    """ Work item of a listed fromdata blob, or its result record when todata has no match.
+
+    The todata blob and the report are named after the UUID in the blob
+    name. Pairs whose listed size and Content-MD5 match are flagged
+    identical, so neither blob is downloaded.
+    """
+    from_blob_name = from_blob.name
+    # Extract UUID from filename
+    parts_from = from_blob_name.split('_')
+    uuid_part = parts_from[1].split('.')[0]
+
+    # get matching toData blob
+    to_blob_name = f"{parts_from[0]}bla_{uuid_part}.txt"
+    to_blob = to_blobs.get(to_blob_name)
+    if to_blob is None:
+        logging.warning(f"No matching blob {to_blob_name} in todata for {from_blob_name}")
+        return {"from_blob": from_blob_name, "status": "unmatched"}
+    return {"from_blob": from_blob_name, "to_blob": to_blob_name,
+            "report": f"{parts_from[0]}_{uuid_part}_report.html",
+            "bytes": from_blob.size + to_blob.size,
+            "identical": blobs_identical_by_properties(from_blob, to_blob)}
+
+
+async def archive_work_items(archive_blob, to_blobs, from_container, to_container, connect_str=None, executor=None):
+    """ Work items of the member pairs of a fromdata archive and its todata namesake. """
+    if archive_blob.name not in to_blobs:
+        logging.warning(f"No matching archive {archive_blob.name} in todata")
+        return [{"from_blob": archive_blob.name, "status": "unmatched"}]
+    if connect_str is None:
+        raise ValueError("comparing archives needs the storage connection string")
+    manifest = await asyncio.get_running_loop().run_in_executor(
+        executor, pair_archive_blobs, connect_str, from_container.container_name,
+        to_container.container_name, archive_blob.name)
+    items = []
+    for name in manifest["orphans_from"]:
+        logging.warning(f"No matching member in todata {archive_blob.name} for {name}")
+        items.append({"from_blob": member_path(archive_blob.name, name), "status": "unmatched"})
+    # the etags tell a worker's open archive (open_worker_archive) from a newer upload of the same name
+    items.extend(dict(pair, archive=archive_blob.name, from_etag=archive_blob.etag,
+                      to_etag=to_blobs[archive_blob.name].etag) for pair in manifest["pairs"])
+    return items
+
+
+async def list_work_items(from_container, to_container, connect_str=None, executor=None):
+    """ Yield the work items of the fromdata / todata containers, in listing order.
+
+    A work item is a JSON serializable dict: a blob pair (blob_work_item)
+    or a member pair of a zip archive (an edi_pairing pair plus "archive").
+    Blobs that cannot be compared (no match in todata, unreadable archive)
+    are yielded as their result record, which has "status" set.
+    The todata container is listed once into a name index, so pairing costs
+    no request per blob.
+    """
+    # index of the to container: blob name -> listed properties
+    to_blobs = {}
+    async for blob in to_container.list_blobs():
+        to_blobs[blob.name] = blob
+
+    # list all blobs in from container
+    async for blob in from_container.list_blobs(name_starts_with="edi"):
+        if not blob.name.lower().endswith(ARCHIVE_SUFFIX):
+            try:
+                item = blob_work_item(blob, to_blobs)
+            except Exception as e:
+                logging.error(f"Error comparing {blob.name}: {str(e)}")
+                item = {"from_blob": blob.name, "status": "error", "error": str(e)}
+            yield item
+            continue
+        # member pairs of an archive are work items like blob pairs
+        try:
+            items = await archive_work_items(blob, to_blobs, from_container, to_container, connect_str, executor)
+        except Exception as e:
+            logging.error(f"Error reading archive {blob.name}: {str(e)}")
+            items = [{"from_blob": blob.name, "status": "error", "error": str(e)}]
+        for item in items:
+            yield item
+
+
+class EdiPairComparer:
+    """ Compares work items (see list_work_items) and uploads their reports.
+
+    Shared by a batch run and the shards of a fan-out run. Each pair is
+    downloaded (both blobs concurrently), diffed in executor (the default
+    thread pool when None) within max_seconds / max_bytes and its report
+    uploaded as staged blocks of report_chunk_size bytes (gzip encoded when
+    gzip_reports is set), with at most max_concurrent_uploads uploads
+    running at once. A pair whose listed sizes are over max_bytes is not
+    downloaded into memory: both blobs are spooled to temporary files and
+    only its segments counted. Archive members are streamed from the blobs
+    through range reads (this needs connect_str), never extracted; their
+    reports go under the archive name.
+    """
+
+    def __init__(self, from_container, to_container, results_container, engine=DEFAULT_ENGINE, connect_str=None,
+                 normalize=None, max_seconds=DEFAULT_MAX_SECONDS, max_bytes=DEFAULT_MAX_BYTES,
+                 max_concurrent_uploads=DEFAULT_MAX_CONCURRENT_UPLOADS,
+                 blob_max_concurrency=DEFAULT_BLOB_MAX_CONCURRENCY, report_chunk_size=DEFAULT_REPORT_CHUNK_SIZE,
+                 gzip_reports=False, executor=None):
+        self.from_container = from_container
+        self.to_container = to_container
+        self.results_container = results_container
+        self.engine = engine
+        self.connect_str = connect_str
+        self.normalize = normalize
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.blob_max_concurrency = blob_max_concurrency
+        self.report_chunk_size = report_chunk_size
+        self.gzip_reports = gzip_reports
+        self.executor = executor
+        self.upload_slots = asyncio.Semaphore(max_concurrent_uploads)
+
+    async def upload_report(self, report_name, chunks, content_type="text/html"):
+        async with self.upload_slots:
+            await upload_blocks_async(
+                self.results_container.get_blob_client(report_name),
+                iter_byte_blocks(chunks, self.report_chunk_size, gzip_encode=self.gzip_reports),
+                content_type=content_type,
+                gzip_encode=self.gzip_reports
             )
+
+    async def compare(self, item):
+        """ Compare one work item and return its result record; a failure is recorded, not raised. """
+        # a blob pair, or a member pair of an archive
+        is_member_pair = "archive" in item
+        name = member_path(item["archive"], item["from_file"]) if is_member_pair else item["from_blob"]
+        try:
+            if is_member_pair:
+                return await self.compare_archive_pair(item)
+            return await self.compare_pair(item)
+        except Exception as e:
+            logging.error(f"Error comparing {name}: {str(e)}")
+            return {"from_blob": name, "status": "error", "error": str(e)}
+
+    async def compare_pair(self, item):
+        from_blob_name = item["from_blob"]
+        to_blob_name = item["to_blob"]
+        report_name = item["report"]
+        if item["identical"]:
+            await self.upload_report(report_name, [identical_report(from_blob_name, to_blob_name)])
+            logging.info(f"{from_blob_name} and {to_blob_name} have the same Content-MD5, skipped download")
+            return {"from_blob": from_blob_name, "to_blob": to_blob_name, "report": report_name,
+                    "status": "identical", "bytes": item["bytes"],
+                    "diff": dict(empty_counts(), differences=[])}
+
+        if DiffBudget(self.max_seconds, self.max_bytes).too_large(item["bytes"]):
+            # the listed sizes are over budget: summary only, without downloading into memory
+            return await self.compare_large_pair(item)
+
+        # download files
+        from_content, to_content = await asyncio.gather(
+            download_blob_bytes(self.from_container, from_blob_name, self.blob_max_concurrency),
+            download_blob_bytes(self.to_container, to_blob_name, self.blob_max_concurrency)
+        )
+
+        # Generate diff on EDI segments rather than physical lines
+        pair_started = time.perf_counter()
+        report_path, summary = await asyncio.get_running_loop().run_in_executor(
+            self.executor, diff_edi_contents, from_content, to_content, from_blob_name, to_blob_name, self.engine,
+            DEFAULT_MAX_DIFFERENCES, self.normalize, self.max_seconds, self.max_bytes)
+        seconds = round(time.perf_counter() - pair_started, 3)
+        del from_content, to_content
+        return await self.upload_pair_report(from_blob_name, to_blob_name, report_name, report_path, summary,
+                                             item["bytes"], seconds)
+
+    async def compare_large_pair(self, item):
+        # both blobs are spooled to temporary files and their segments counted from there
+        from_blob_name = item["from_blob"]
+        to_blob_name = item["to_blob"]
+        spool_files = [tempfile.NamedTemporaryFile(suffix=".edi", delete=False) for _ in range(2)]
+        try:
+            with spool_files[0] as from_file, spool_files[1] as to_file:
+                await asyncio.gather(
+                    download_blob_to_file(self.from_container, from_blob_name, from_file, self.blob_max_concurrency),
+                    download_blob_to_file(self.to_container, to_blob_name, to_file, self.blob_max_concurrency)
+                )
+            pair_started = time.perf_counter()
+            report_path, summary = await asyncio.get_running_loop().run_in_executor(
+                self.executor, diff_edi_files, from_file.name, to_file.name, from_blob_name, to_blob_name,
+                self.engine, DEFAULT_MAX_DIFFERENCES, self.normalize, self.max_seconds, self.max_bytes)
+            seconds = round(time.perf_counter() - pair_started, 3)
+        finally:
+            for spool_file in spool_files:
+                os.remove(spool_file.name)
+        return await self.upload_pair_report(from_blob_name, to_blob_name, item["report"], report_path, summary,
+                                             item["bytes"], seconds)
+
+    async def compare_archive_pair(self, pair):
+        archive_name = pair["archive"]
+        from_name = member_path(archive_name, pair["from_file"])
+        to_name = member_path(archive_name, pair["to_file"])
+        report_name = f"{os.path.splitext(archive_name)[0]}/{pair['prefix']}_{pair['uuid']}_report.html"
+        pair_started = time.perf_counter()
+        report_path, summary, input_bytes = await asyncio.get_running_loop().run_in_executor(
+            self.executor, diff_archive_members, self.connect_str, self.from_container.container_name,
+            self.to_container.container_name, archive_name, pair["from_file"], pair["to_file"], self.engine,
+            DEFAULT_MAX_DIFFERENCES, self.normalize, self.max_seconds, self.max_bytes, pair.get("from_etag"),
+            pair.get("to_etag"))
+        seconds = round(time.perf_counter() - pair_started, 3)
+        return await self.upload_pair_report(from_name, to_name, report_name, report_path, summary, input_bytes,
+                                             seconds)
+
+    async def upload_pair_report(self, from_name, to_name, report_name, report_path, summary, input_bytes, seconds):
+        # upload results
+        try:
+            await self.upload_report(report_name, iter_file_blocks(report_path, self.report_chunk_size))
+        finally:
+            os.remove(report_path)
+        logging.info(f"Compared {from_name} and {to_name} -> {report_name}")
+        if summary["degraded"]:
+            logging.warning(f"{from_name} and {to_name} degraded to {summary['strategy']}: "
+                            f"{summary['degraded_reason']}")
+        return {"from_blob": from_name, "to_blob": to_name, "report": report_name, "status": "ok",
+                "bytes": input_bytes, "seconds": seconds, "diff": summary,
+                "degraded": summary["degraded"]}
+
+
+async def process_all_files_azure(from_container, to_container, results_container, engine=DEFAULT_ENGINE,
+                                  connect_str=None,
+                                  normalize=None,
+                                  max_seconds=DEFAULT_MAX_SECONDS,
+                                  max_bytes=DEFAULT_MAX_BYTES,
+                                  max_concurrent_pairs=DEFAULT_MAX_CONCURRENT_PAIRS,
+                                  max_concurrent_uploads=DEFAULT_MAX_CONCURRENT_UPLOADS,
+                                  blob_max_concurrency=DEFAULT_BLOB_MAX_CONCURRENCY,
+                                  report_chunk_size=DEFAULT_REPORT_CHUNK_SIZE,
+                                  gzip_reports=False,
+                                  executor=None):
+    """ Compare matching EDI blobs and upload one HTML report per pair.
+
+    Listing (list_work_items) feeds a bounded queue that
+    max_concurrent_pairs workers drain, each comparing one work item at a
+    time (EdiPairComparer, which takes the remaining arguments). A failing
+    pair is logged and recorded, the rest of the batch carries on.
+    With normalize (edi_normalize rules) the masked envelope fields are
+    ignored by the diff. Each pair is diffed within max_seconds and
+    max_bytes; pairs over budget are recorded with "degraded" set.
+    A fromdata blob ending in .zip is compared with the todata zip of the
+    same name: members are paired by UUID from the central directories and
+    streamed from the blobs.
+    Returns one result dict per from blob; they are also uploaded as
+    results.jsonl, with the batch totals in summary.json.
+    """
+    started = time.perf_counter()
+    comparer = EdiPairComparer(from_container, to_container, results_container, engine=engine,
+                               connect_str=connect_str, normalize=normalize, max_seconds=max_seconds,
+                               max_bytes=max_bytes, max_concurrent_uploads=max_concurrent_uploads,
+                               blob_max_concurrency=blob_max_concurrency, report_chunk_size=report_chunk_size,
+                               gzip_reports=gzip_reports, executor=executor)
+    queue = asyncio.Queue(maxsize=max_concurrent_pairs * 2)
+    results = []
+
+    async def list_items():
+        try:
+            async for item in list_work_items(from_container, to_container, connect_str, executor):
+                if "status" in item:
+                    results.append(item)
+                else:
+                    await queue.put(item)
+        finally:
+            for _ in range(max_concurrent_pairs):
+                await queue.put(None)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            results.append(await comparer.compare(item))
+
+    await asyncio.gather(list_items(), *(worker() for _ in range(max_concurrent_pairs)))
+
+    # machine readable results next to the reports
+    summary = batch_summary(results, time.perf_counter() - started)
+    await comparer.upload_report(RESULTS_FILE_NAME, (json.dumps(result, default=str) + "\n" for result in results),
+                                 content_type="application/x-ndjson")
+    await comparer.upload_report(SUMMARY_FILE_NAME, [json.dumps(summary, indent=2)], content_type="application/json")
+    return results
+
+
+if __name__ == "__main__":
+    # local run, e.g. against Azurite: BlobStorageConnectionString=UseDevelopmentStorage=true
+    # with FanOut=true the run is enqueued on the Azurite queue and drained here
+    logging.basicConfig(level=logging.INFO)
+    local_run = run_local_fan_out if fan_out_enabled() else run_edi_compare
+    local_results = asyncio.run(local_run(
+        os.environ.get("BlobStorageConnectionString", "UseDevelopmentStorage=true"),
+        engine=os.environ.get("DiffEngine", DEFAULT_ENGINE),
+        normalize=os.environ.get("NormalizeRules") or None
+    ))
+    print(json.dumps(local_results, indent=2))
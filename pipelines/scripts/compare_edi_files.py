@@ -1,42 +1,67 @@
-import difflib
-import sys
-import os
+import argparse
 
-def compare_edi_files(file1_path, file2_path, output_html_path):
+from comparecore.diff_budget import DEFAULT_MAX_BYTES, DEFAULT_MAX_SECONDS, DiffBudget
+from comparecore.diff_engine import DEFAULT_ENGINE, ENGINES
+from comparecore.diff_report import PAGE_ROWS
+from comparecore.edi_compare import compare_edi_paths
+from comparecore.edi_loops import DEFAULT_LOOPS
+from comparecore.edi_normalize import DEFAULT_RULES, Normalizer
+from comparecore.edi_transactions import DEFAULT_TRANSACTION_KEY
 
+def compare_edi_files(file1_path, file2_path, output_html_path, engine=DEFAULT_ENGINE,
+                      collapse=False, context_lines=5, page_rows=None, normalize=None,
+                      transaction_key=None, transaction_workers=1, loops=None,
+                      max_seconds=DEFAULT_MAX_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+    """ Compare 2 edi files and generate side by side HTML report """
     print(f"received parameters:*" )
     print(f"file_path : {file1_path}")
     print(f"file_path : {file2_path}")
     print(f"file_path : {output_html_path}")
-  
-    # if not os.path.exist(file1_path):
-    #   raise FileNotFoundError(f"File file1_path not found: {file1_path})
-    # if not os.path.exist(file2_path):
-    #   raise FileNotFoundError(f"File file2_path not found: {file1_path})
-
-
-   
-
-    """ Compare 2 edi files and generate side by side HTML report """
-    with open(file1_path, 'r') as file1, open(file2_path, 'r') as file2:
-        file1_lines = file1.readlines()
-        file2_lines = file2.readlines()
 
-        html_diff = difflib.HtmlDiff(tabsize=4, wrapcolumn=80)
-        diff_html = html_diff.make_file(
-          file1_lines,
-          file2_lines,
-          fromdesc="File1 ",
-          todesc="File 2"
-        )
+    # mask volatile envelope fields (control numbers, dates) before diffing
+    normalizer = Normalizer(normalize) if normalize else None
+    # changed segments are highlighted element by element; with page_rows an
+    # index page plus one lazily loaded page per page_rows rows
+    summary = compare_edi_paths(file1_path, file2_path, output_html_path, "File1 ", "File 2", engine=engine,
+                                budget=DiffBudget(max_seconds, max_bytes), normalizer=normalizer,
+                                transaction_key=transaction_key, transaction_workers=transaction_workers,
+                                loops=loops, collapse=collapse, context_lines=context_lines, page_rows=page_rows)
+    if "loops" in summary:
+      print(f"Loops: {summary['loops']}")
+    if "transactions" in summary:
+      print(f"Transactions: {summary['transactions']}")
+    if summary.get("degraded"):
+      print(f"DEGRADED to {summary['strategy']} ({summary['degraded_reason']})")
+    print(f"Differences: {summary['added']} added, {summary['removed']} removed, {summary['changed']} changed segments")
+    return summary
 
-        with open (output_html_path, 'w') as output_file:
-          output_file.write(diff_html)
 if __name__ == "__main__":
-    if (len(sys.argv) != 4):
-        print("Usage: python compare_edi_files.py <file1> <file2> <output_html>")
-        sys.exit(1)
-    file1_path = sys.argv[1]
-    file2_path = sys.argv[2]
-    output_html_path = sys.argv[3]
-    compare_edi_files(file1_path, file2_path, output_html_path)
+    parser = argparse.ArgumentParser(description="Compare 2 EDI files and generate a side by side HTML report")
+    parser.add_argument("file1")
+    parser.add_argument("file2")
+    parser.add_argument("output_html")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=DEFAULT_ENGINE,
+                        help=f"diff algorithm (default: {DEFAULT_ENGINE})")
+    parser.add_argument("--collapse", action="store_true",
+                        help="fold unchanged runs into expandable rows")
+    parser.add_argument("--context-lines", type=int, default=5,
+                        help="unchanged segments kept around each change with --collapse")
+    parser.add_argument("--page-rows", type=int, nargs="?", const=PAGE_ROWS, default=None,
+                        help=f"split the report into pages of this many rows behind an index page (default: {PAGE_ROWS})")
+    parser.add_argument("--normalize", nargs="?", const=DEFAULT_RULES, default=None,
+                        help=f"mask volatile envelope fields before comparing (default rules: {DEFAULT_RULES})")
+    parser.add_argument("--transaction-key", nargs="?", const=DEFAULT_TRANSACTION_KEY, default=None,
+                        help=f"compare ST/SE transaction sets matched by this element (default: {DEFAULT_TRANSACTION_KEY})")
+    parser.add_argument("--transaction-workers", type=int, default=1)
+    parser.add_argument("--unordered-loops", nargs="?", const=DEFAULT_LOOPS, default=None,
+                        help=f"compare these repeated loops regardless of order (default: {DEFAULT_LOOPS})")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS,
+                        help="time budget before falling back to a coarser diff (0: unlimited)")
+    parser.add_argument("--max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="input size above which only a summary is produced (0: unlimited)")
+    args = parser.parse_args()
+    compare_edi_files(args.file1, args.file2, args.output_html, engine=args.engine,
+                      collapse=args.collapse, context_lines=args.context_lines, page_rows=args.page_rows,
+                      normalize=args.normalize, transaction_key=args.transaction_key,
+                      transaction_workers=args.transaction_workers, loops=args.unordered_loops,
+                      max_seconds=args.max_seconds, max_bytes=args.max_mb * 1024 * 1024)
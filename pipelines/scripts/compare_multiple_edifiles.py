@@ -1,67 +1,378 @@
+import argparse
 import os
-import difflib
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 
+from comparecore.diff_budget import DEFAULT_MAX_BYTES, DEFAULT_MAX_SECONDS, DiffBudget
+from comparecore.diff_engine import DEFAULT_ENGINE, ENGINES
+from comparecore.diff_report import PAGE_ROWS, SegmentHtmlDiff
+from comparecore.edi_compare import compare_edi_paths
+from comparecore.edi_pairing import (DEFAULT_FROM_PATTERN, DEFAULT_TO_PATTERN, build_manifest,
+                                     print_manifest_summary, write_manifest)
+from comparecore.diff_summary import (DEFAULT_MAX_DIFFERENCES, RESULTS_FILE_NAME, SUMMARY_FILE_NAME, JsonlWriter,
+                                      batch_summary, empty_counts, has_differences, write_summary)
+from comparecore.edi_archive import input_size
+from comparecore.edi_loops import DEFAULT_LOOPS
+from comparecore.edi_normalize import DEFAULT_RULES, Normalizer, hash_segments, iter_normalized_segments
+from comparecore.edi_transactions import DEFAULT_TRANSACTION_KEY
+from comparecore.result_cache import DEFAULT_CACHE_MAX_BYTES, ResultCache, cache_key, hash_file
 
 
+def compare_edi_files(file1_path, file2_path, output_html_path, engine=DEFAULT_ENGINE,
+                      collapse=False, context_lines=5, page_rows=None,
+                      max_differences=DEFAULT_MAX_DIFFERENCES, normalizer=None, segments=None,
+                      transaction_key=None, transaction_workers=1, loops=None, budget=None):
+    """Compare two EDI files and generate a side by side HTML report
 
-def compare_edi_files(file1_path, file2_path, output_html_path):
-    """Compare two EDI files and generate a side by side HTML report """
-    try:        
-      with open(file1_path, 'r') as file1, open(file2_path, 'r') as file2:
-        file1_lines = file1.readlines()
-        file2_lines = file2.readlines()
+    collapse folds unchanged runs (beyond context_lines around each change)
+    into expandable rows; page_rows splits the report into pages behind an
+    index page at output_html_path. Returns the diff summary of the pair
+    (see diff_summary.summarize_opcodes).
 
-        html_diff = difflib.HtmlDiff(tabsize=4, wrapcolumn=80)
-        diff_html = html_diff.make_file(
-          file1_lines,
-          file2_lines,
-          fromdesc=os.path.basename(file1_path),
-          todesc=os.path.basename(file2_path)
-        )
+    With a normalizer (edi_normalize.Normalizer) the masked envelope fields
+    are diffed in their normalized form. segments is an optional pair of
+    segment lists the caller has already read.
 
-        with open (output_html_path, 'w') as output_file:
-          output_file.write(diff_html)
-          print(f"Successfully wrote output to : {output_html_path}")
+    With transaction_key (e.g. "BEG03" or "ST02") the interchanges are split
+    into ST/SE transaction sets matched by that key, and only matched sets
+    are diffed, in transaction_workers processes (see edi_transactions).
+
+    loops (e.g. "N1:N2|N3|N4,PO1") lists repeated loops whose order does
+    not matter: the file2 side of each loop block is shown in file1 order
+    (see edi_loops), so only loops missing from one side are reported.
+
+    budget (diff_budget.DiffBudget) bounds the time and input size of the
+    compare. A pair over budget falls back to a block-hash diff or to a
+    summary only report; the summary then has "degraded" set and says which
+    "strategy" was used.
+    """
+    try:
+      summary = compare_edi_paths(file1_path, file2_path, output_html_path, engine=engine, budget=budget,
+                                  normalizer=normalizer, segments=segments, transaction_key=transaction_key,
+                                  transaction_workers=transaction_workers, loops=loops,
+                                  max_differences=max_differences, collapse=collapse,
+                                  context_lines=context_lines, page_rows=page_rows)
+      print(f"Successfully wrote output to : {output_html_path}")
+      return summary
     except Exception as e:
         print(f"Error in comparing EDI files: {str(e)}")
         raise
 
 
-def process_all_files(from_dir, to_dir, output_dir):
-    """ Compare all EDI files in fromData with matching UUIDs in toData. """
+def write_identical_report(file1_path, file2_path, output_html_path):
+    """ Write the "No Differences Found" report without diffing the files. """
+    diff_html = SegmentHtmlDiff(tabsize=4, wrapcolumn=80).make_file(
+      [],
+      [],
+      fromdesc=os.path.basename(file1_path),
+      todesc=os.path.basename(file2_path),
+      context=True
+    )
+    with open (output_html_path, 'w') as output_file:
+      output_file.write(diff_html)
+
+
+def _compare_with_cache(from_file_path, to_file_path, output_html_path, options):
+    """ Compare a pair, skipping the diff for identical inputs and cached results.
+
+    Returns (outcome, diff summary); outcome is "identical", "cached" or "compared".
+    """
+    engine = options["engine"]
+    normalizer = Normalizer(options["normalize"]) if options.get("normalize") else None
+    budget = DiffBudget(options.get("max_seconds", DEFAULT_MAX_SECONDS), options.get("max_bytes", DEFAULT_MAX_BYTES))
+    segments = None
+    if normalizer is None:
+        from_hash = hash_file(from_file_path)
+        to_hash = hash_file(to_file_path)
+    elif budget.too_large(input_size(from_file_path) + input_size(to_file_path)):
+        # hashed while streaming, the pair is too big to keep in memory
+        from_hash = hash_segments(iter_normalized_segments(from_file_path, normalizer))
+        to_hash = hash_segments(iter_normalized_segments(to_file_path, normalizer))
+    else:
+        # hash the normalized segments, so pairs differing only in masked
+        # envelope fields take the identical shortcut; the diff reuses them
+        segments = (list(iter_normalized_segments(from_file_path, normalizer)),
+                    list(iter_normalized_segments(to_file_path, normalizer)))
+        from_hash = hash_segments(segments[0])
+        to_hash = hash_segments(segments[1])
+    if from_hash == to_hash:
+        write_identical_report(from_file_path, to_file_path, output_html_path)
+        return "identical", dict(empty_counts(), differences=[])
+
+    # paged reports are several files, the cache only holds single reports
+    use_cache = options.get("cache_dir") and not options.get("page_rows")
+    cache = ResultCache(options["cache_dir"]) if use_cache else None
+    # the report header shows the file names, so they are part of the key
+    key = cache_key(from_hash, to_hash, {
+        "engine": engine,
+        "collapse": options.get("collapse", False),
+        "context_lines": options.get("context_lines", 5),
+        "max_differences": options.get("max_differences", DEFAULT_MAX_DIFFERENCES),
+        "normalize": normalizer.spec if normalizer else None,
+        "transaction_key": options.get("transaction_key"),
+        "loops": options.get("loops"),
+        "max_seconds": budget.max_seconds,
+        "max_bytes": budget.max_bytes,
+        "from_name": os.path.basename(from_file_path),
+        "to_name": os.path.basename(to_file_path),
+    })
+    if cache and cache.fetch(key, output_html_path):
+        return "cached", cache.fetch_summary(key)
+
+    summary = compare_edi_files(from_file_path, to_file_path, output_html_path, engine=engine,
+                                collapse=options.get("collapse", False),
+                                context_lines=options.get("context_lines", 5),
+                                page_rows=options.get("page_rows"),
+                                max_differences=options.get("max_differences", DEFAULT_MAX_DIFFERENCES),
+                                normalizer=normalizer, segments=segments,
+                                transaction_key=options.get("transaction_key"),
+                                transaction_workers=options.get("transaction_workers", 1),
+                                loops=options.get("loops"), budget=budget)
+    if cache and not summary.get("degraded"):
+        cache.store(key, output_html_path, summary)
+    return "compared", summary
+
+
+def _compare_pair(task):
+    """ Compare one pair and return a result record.
+
+    Never raises, so one bad file is recorded instead of stopping the batch.
+    Runs in a worker process when process_all_files is given more than one worker.
+    """
+    uuid, from_file_path, to_file_path, output_html_path, options = task
+    result = {
+        "uuid": uuid,
+        "from_file": from_file_path,
+        "to_file": to_file_path,
+        "report": output_html_path,
+        "status": "ok",
+        "outcome": None,
+        "error": None,
+        "bytes": 0,
+        "diff": None,
+        "degraded": False,
+    }
+    started = time.perf_counter()
+    try:
+        result["bytes"] = input_size(from_file_path) + input_size(to_file_path)
+        result["outcome"], result["diff"] = _compare_with_cache(from_file_path, to_file_path, output_html_path, options)
+        # degraded pairs are flagged for an offline deep comparison
+        result["degraded"] = bool(result["diff"] and result["diff"].get("degraded"))
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {str(e)}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _failed_result(task, error):
+    uuid, from_file_path, to_file_path, output_html_path, _ = task
+    return {
+        "uuid": uuid,
+        "from_file": from_file_path,
+        "to_file": to_file_path,
+        "report": output_html_path,
+        "status": "error",
+        "outcome": None,
+        "error": f"{type(error).__name__}: {str(error)}",
+        "bytes": 0,
+        "diff": None,
+        "degraded": False,
+        "seconds": 0,
+    }
+
+
+def _run_tasks(tasks, workers, max_in_flight):
+    """ Yield pair results in completion order, keeping at most max_in_flight pairs queued. """
+    if workers <= 1:
+        for task in tasks:
+            yield _compare_pair(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+
+        def collect(futures):
+            for future in futures:
+                task = in_flight.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # the worker process itself died (e.g. killed for memory)
+                    yield _failed_result(task, e)
+
+        for task in tasks:
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from collect(done)
+            in_flight[executor.submit(_compare_pair, task)] = task
+        yield from collect(as_completed(list(in_flight)))
+
+
+def process_all_files(from_dir, to_dir, output_dir, engine=DEFAULT_ENGINE, workers=1, max_in_flight=None,
+                      from_pattern=DEFAULT_FROM_PATTERN, to_pattern=DEFAULT_TO_PATTERN,
+                      cache_dir=None, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES,
+                      collapse=False, context_lines=5, page_rows=None,
+                      max_differences=DEFAULT_MAX_DIFFERENCES, normalize=None,
+                      transaction_key=None, transaction_workers=1, loops=None,
+                      max_seconds=DEFAULT_MAX_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+    """ Compare all EDI files in fromData with matching UUIDs in toData.
+
+    from_dir and to_dir are directories or zip archives; archive members
+    are paired from the central directory and streamed into the diff
+    without being extracted.
+
+    Files are paired by the uuid group of from_pattern / to_pattern and the
+    pairing manifest (pairs, orphans, duplicates) is written to
+    pairing_manifest.json in output_dir. With workers > 1 the pairs are compared in a process pool. At most
+    max_in_flight pairs (default 2 per worker) are submitted at a time, and
+    results are reported as each pair completes. Returns the list of result
+    records; failed pairs have status "error".
+
+    Byte-identical pairs get a "No Differences Found" report without being
+    diffed. With cache_dir, reports are also cached by content hash and
+    reused on later runs; the cache is trimmed to cache_max_bytes at the end.
+
+    collapse, context_lines and page_rows are passed to compare_edi_files
+    for collapsed and paged reports (paged reports are not cached).
+
+    Every result record is appended to results.jsonl in output_dir as the
+    pair completes (with the diff counts and the first max_differences
+    differences), and the batch totals are written to summary.json.
+
+    normalize is a list of edi_normalize rules (e.g. DEFAULT_RULES); the
+    matching envelope fields are masked before hashing and diffing.
+    transaction_key switches to the transaction level compare, with
+    transaction_workers processes per pair. loops lists the repeated
+    loops compared without regard to their order.
+
+    Each pair gets max_seconds and max_bytes (0 for no limit); a pair over
+    budget falls back to a coarser compare and is recorded as degraded.
+    """
     try :
-        print(f"Processing files in directories:")
+        print(f"Processing files in directories (or archives):")
         print(f"From directory: {from_dir}")
         print(f"To directory: {to_dir}")
-        print(f"Output directory: {output_dir}")    
+        print(f"Output directory: {output_dir}")
+        print(f"Workers: {workers}")
+        if normalize:
+            print(f"Normalizing: {Normalizer(normalize).spec}")
 
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
             print(f"Created output directory: {output_dir}")
-        
-            # Iterate through files in fromData
-            for from_file in os.listdir(from_dir):
-                if "_" in from_file and from_file.endswith(".txt"):
-                    uuid = from_file.split("_")[1].split(".")[0] # Extract UUID
-                    matching_to_file = f"{from_file.split('_')[0]}bla_{uuid}.txt"
-                    
-                    from_file_path = os.path.join(from_dir, from_file)
-                    to_file_path = os.path.join(to_dir, matching_to_file)
-
-                    if os.path.exists(to_file_path):
-                        output_html_name = f"{from_file.split('_')[0]}_{uuid}_report.html"
-                        output_html_path = os.path.join(output_dir, output_html_name)
-                        # compare files and genereate report 
-                        compare_edi_files(from_file_path, to_file_path, output_html_path)
-                    else:
-                        print(f"No matching files found for UUID '{uuid}' in toData.")
+
+        manifest = build_manifest(from_dir, to_dir, from_pattern, to_pattern)
+        write_manifest(manifest, os.path.join(output_dir, "pairing_manifest.json"))
+        print_manifest_summary(manifest)
+
+        max_in_flight = max_in_flight or workers * 2
+        options = {"engine": engine, "cache_dir": cache_dir, "collapse": collapse,
+                   "context_lines": context_lines, "page_rows": page_rows,
+                   "max_differences": max_differences, "normalize": normalize,
+                   "transaction_key": transaction_key, "transaction_workers": transaction_workers,
+                   "loops": loops, "max_seconds": max_seconds, "max_bytes": max_bytes}
+        tasks = ((pair["uuid"], pair["from_file"], pair["to_file"],
+                  os.path.join(output_dir, f"{pair['prefix']}_{pair['uuid']}_report.html"), options)
+                 for pair in manifest["pairs"])
+
+        started = time.perf_counter()
+        results = []
+        with JsonlWriter(os.path.join(output_dir, RESULTS_FILE_NAME)) as results_writer:
+            for result in _run_tasks(tasks, workers, max_in_flight):
+                results.append(result)
+                results_writer.write(result)
+                if result["status"] == "ok" and result["degraded"]:
+                    print(f"[{len(results)}] {result['uuid']}: DEGRADED to {result['diff']['strategy']} "
+                          f"({result['diff']['degraded_reason']}) in {result['seconds']}s -> {result['report']}")
+                elif result["status"] == "ok":
+                    print(f"[{len(results)}] {result['uuid']}: {result['outcome']} in {result['seconds']}s -> {result['report']}")
+                else:
+                    print(f"[{len(results)}] {result['uuid']}: FAILED {result['error']}")
+        elapsed = time.perf_counter() - started
+
+        if cache_dir:
+            evicted = ResultCache(cache_dir, cache_max_bytes).evict()
+            if evicted:
+                print(f"Evicted {evicted} entries from result cache {cache_dir}")
+
+        summary = batch_summary(results, elapsed)
+        write_summary(summary, os.path.join(output_dir, SUMMARY_FILE_NAME))
+
+        failed = sum(1 for result in results if result["status"] != "ok")
+        identical = sum(1 for result in results if result["outcome"] == "identical")
+        cached = sum(1 for result in results if result["outcome"] == "cached")
+        total_mb = sum(result["bytes"] for result in results) / (1024 * 1024)
+        print(f"Compared {len(results)} pairs ({identical} identical, {cached} from cache, {failed} failed) in {elapsed:.2f}s: "
+              f"{len(results) / elapsed if elapsed else 0:.2f} pairs/s, "
+              f"{total_mb / elapsed if elapsed else 0:.2f} MB/s")
+        if summary["degraded"]:
+            print(f"{summary['degraded']} pairs degraded, see results.jsonl for offline deep comparison")
+        print(f"{summary['with_differences']} pairs with differences: {summary['added']} added, "
+              f"{summary['removed']} removed, {summary['changed']} changed segments")
+        return results
     except Exception as e:
         print(f"Error in process_all_files : {str(e)}")
         raise
 
 if __name__ == "__main__":
-    from_dir = "edicompare/fromData"
-    to_dir = "edicompare/toData"
-    output_dir = "edicompareresults"
+    parser = argparse.ArgumentParser(description="Compare EDI files in fromData with matching UUIDs in toData")
+    parser.add_argument("--from-dir", default="edicompare/fromData",
+                        help="directory or zip archive of fromData files")
+    parser.add_argument("--to-dir", default="edicompare/toData",
+                        help="directory or zip archive of toData files")
+    parser.add_argument("--output-dir", default="edicompareresults")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=DEFAULT_ENGINE)
+    parser.add_argument("--from-pattern", default=DEFAULT_FROM_PATTERN,
+                        help="regex for fromData names, must contain a (?P<uuid>...) group")
+    parser.add_argument("--to-pattern", default=DEFAULT_TO_PATTERN,
+                        help="regex for toData names, must contain a (?P<uuid>...) group")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (1 compares the pairs in this process)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of pairs queued for the workers (default: 2 per worker)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory for cached reports, reused across runs (disabled by default)")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024),
+                        help="size limit of the report cache in MB")
+    parser.add_argument("--collapse", action="store_true",
+                        help="fold unchanged runs into expandable rows")
+    parser.add_argument("--context-lines", type=int, default=5,
+                        help="unchanged segments kept around each change with --collapse")
+    parser.add_argument("--page-rows", type=int, nargs="?", const=PAGE_ROWS, default=None,
+                        help=f"split each report into pages of this many rows behind an index page (default: {PAGE_ROWS})")
+    parser.add_argument("--max-differences", type=int, default=DEFAULT_MAX_DIFFERENCES,
+                        help="differences listed per pair in results.jsonl")
+    parser.add_argument("--normalize", nargs="?", const=DEFAULT_RULES, default=None,
+                        help=f"mask volatile envelope fields before comparing, e.g. ISA09,GS04:drop,SE:drop "
+                             f"(default rules: {DEFAULT_RULES})")
+    parser.add_argument("--transaction-key", nargs="?", const=DEFAULT_TRANSACTION_KEY, default=None,
+                        help="split interchanges into ST/SE transaction sets matched by this element, "
+                             f"e.g. BEG03 or BEG03,ST02 (default: {DEFAULT_TRANSACTION_KEY})")
+    parser.add_argument("--transaction-workers", type=int, default=1,
+                        help="processes diffing the matched transaction sets of one pair")
+    parser.add_argument("--unordered-loops", nargs="?", const=DEFAULT_LOOPS, default=None,
+                        help="compare these repeated loops regardless of order, as START[:MEMBER|MEMBER] "
+                             f"separated by commas (default: {DEFAULT_LOOPS})")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS,
+                        help="time budget per pair before falling back to a coarser diff (0: unlimited)")
+    parser.add_argument("--max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="input size per pair above which only a summary is produced (0: unlimited)")
+    parser.add_argument("--fail-on-differences", action="store_true",
+                        help="exit with status 2 when any pair has differences")
+    args = parser.parse_args()
 
-    process_all_files(from_dir, to_dir, output_dir)
+    results = process_all_files(args.from_dir, args.to_dir, args.output_dir, engine=args.engine,
+                                workers=args.workers, max_in_flight=args.max_in_flight,
+                                from_pattern=args.from_pattern, to_pattern=args.to_pattern,
+                                cache_dir=args.cache_dir, cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+                                collapse=args.collapse, context_lines=args.context_lines,
+                                page_rows=args.page_rows, max_differences=args.max_differences,
+                                normalize=args.normalize, transaction_key=args.transaction_key,
+                                transaction_workers=args.transaction_workers, loops=args.unordered_loops,
+                                max_seconds=args.max_seconds, max_bytes=args.max_mb * 1024 * 1024)
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(1)
+    if args.fail_on_differences and any(has_differences(result["diff"]) for result in results):
+        sys.exit(2)
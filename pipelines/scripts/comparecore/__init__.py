@@ -0,0 +1,21 @@
+""" Compare core shared by every entry point.
+
+The pipeline scripts, the Streamlit apps and both Azure Function apps build
+on the modules of this package: EDI tokenizing, normalization and pairing,
+the diff engines and their HTML / summary output, and the JSON compare.
+
+Nothing is imported here, and no module of the package imports an optional
+backend (numpy, ijson) at load: see backends. Importing the package costs
+only the standard library modules actually used, which keeps the cold
+start of a Function app on the consumption plan short
+(pipelines/scripts/import_benchmark.py guards it).
+
+The package installs from pipelines/scripts (pyproject.toml there):
+
+    pip install ./pipelines/scripts            # or -e for development
+    pip install "./pipelines/scripts[all]"     # with the optional backends
+
+The Function apps do not list it in their requirements.txt:
+package_function_app.py bundles the wheel built from this checkout into the
+app folder for deployment.
+"""
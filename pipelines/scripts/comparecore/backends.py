@@ -0,0 +1,34 @@
+""" Optional backends, imported on first use.
+
+numpy (array trimming in diff_engine, numeric JSON arrays in json_diff)
+and ijson (streamed JSON arrays in json_stream) speed things up when they
+are installed but are never needed. Importing numpy alone takes longer
+than loading the whole compare core, so the modules ask for a backend only
+on the code path that uses it, e.g. past a size threshold, and a compare
+that never gets there never pays for the import.
+"""
+import importlib
+
+_modules = {}
+
+
+def optional_module(name):
+    """ The module called name, imported on the first call, or None when it is not installed. """
+    try:
+        return _modules[name]
+    except KeyError:
+        pass
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        module = None
+    _modules[name] = module
+    return module
+
+
+def numpy():
+    return optional_module("numpy")
+
+
+def ijson():
+    return optional_module("ijson")
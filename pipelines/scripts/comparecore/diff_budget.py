@@ -0,0 +1,160 @@
+""" Cost budgeted diff that degrades instead of running unbounded.
+
+budgeted_opcodes tries, in order:
+  full     the configured diff engine over the segments
+  block    a block-hash diff: segments are cut into content defined blocks
+           (a block ends after a segment whose hash is 0 modulo block_size,
+           so an insertion only disturbs the blocks around it), the block
+           hashes are diffed and blocks that differ are reported as whole
+           replaced / deleted / inserted ranges
+  summary  no alignment at all, only the added / removed segment counts of
+           a multiset comparison
+each step getting the time left of max_seconds. Inputs over max_bytes go
+straight to summary, computed by streaming without holding the segments.
+"""
+import collections
+import html
+import time
+
+from .diff_engine import DEFAULT_ENGINE, DiffTimeout, check_deadline, diff_opcodes
+
+DEFAULT_MAX_SECONDS = 60
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_BLOCK_SIZE = 32
+
+FULL = "full"
+BLOCK = "block"
+SUMMARY = "summary"
+
+
+class DiffBudget:
+    """ Time and size limits of one comparison; 0 or None disables a limit. """
+
+    def __init__(self, max_seconds=DEFAULT_MAX_SECONDS, max_bytes=DEFAULT_MAX_BYTES,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        self.max_seconds = max_seconds or None
+        self.max_bytes = max_bytes or None
+        self.block_size = block_size
+
+    def deadline(self, started):
+        return None if self.max_seconds is None else started + self.max_seconds
+
+    def too_large(self, input_bytes):
+        return self.max_bytes is not None and input_bytes > self.max_bytes
+
+
+def content_blocks(items, block_size=DEFAULT_BLOCK_SIZE):
+    """ Cut items into content defined blocks, returned as [(start, end)]. """
+    spans = []
+    start = 0
+    for index, item in enumerate(items):
+        if hash(item) % block_size == 0:
+            spans.append((start, index + 1))
+            start = index + 1
+    if start < len(items):
+        spans.append((start, len(items)))
+    return spans
+
+
+def block_hash_opcodes(a, b, block_size=DEFAULT_BLOCK_SIZE, engine=DEFAULT_ENGINE, deadline=None):
+    """ Coarse opcodes from diffing content defined block hashes of a and b. """
+    spans_a = content_blocks(a, block_size)
+    spans_b = content_blocks(b, block_size)
+    check_deadline(deadline)
+    keys_a = [hash(tuple(a[start:end])) for start, end in spans_a]
+    keys_b = [hash(tuple(b[start:end])) for start, end in spans_b]
+    opcodes = []
+    for tag, i1, i2, j1, j2 in diff_opcodes(keys_a, keys_b, engine=engine, deadline=deadline):
+        a1 = spans_a[i1][0] if i1 < i2 else (spans_a[i1 - 1][1] if i1 else 0)
+        a2 = spans_a[i2 - 1][1] if i1 < i2 else a1
+        b1 = spans_b[j1][0] if j1 < j2 else (spans_b[j1 - 1][1] if j1 else 0)
+        b2 = spans_b[j2 - 1][1] if j1 < j2 else b1
+        opcodes.append((tag, a1, a2, b1, b2))
+    return opcodes
+
+
+def multiset_summary(a, b):
+    """ Added / removed segment counts without aligning a and b.
+
+    a and b may be any iterables (e.g. streaming tokenizers). Returns a
+    summary dict shaped like diff_summary.summarize_opcodes.
+    """
+    counts = collections.Counter()
+    segments_from = segments_to = 0
+    for segment in a:
+        counts[segment] += 1
+        segments_from += 1
+    for segment in b:
+        counts[segment] -= 1
+        segments_to += 1
+    removed = sum(count for count in counts.values() if count > 0)
+    added = -sum(count for count in counts.values() if count < 0)
+    return {
+        "segments_from": segments_from,
+        "segments_to": segments_to,
+        "added": added,
+        "removed": removed,
+        "changed": 0,
+        "unchanged": segments_from - removed,
+        "differences": [],
+    }
+
+
+def budgeted_opcodes(a, b, engine=DEFAULT_ENGINE, budget=None, started=None, diff=None):
+    """ Diff a and b within budget. Returns (opcodes, strategy, reason).
+
+    opcodes is None when even the block diff ran out of time (strategy
+    SUMMARY). diff is the full strategy, called as diff(deadline) and
+    returning opcodes; it defaults to diff_opcodes(a, b, engine).
+    """
+    budget = budget or DiffBudget()
+    started = time.monotonic() if started is None else started
+    deadline = budget.deadline(started)
+    if diff is None:
+        def diff(deadline):
+            return diff_opcodes(a, b, engine=engine, deadline=deadline)
+    try:
+        return diff(deadline), FULL, None
+    except DiffTimeout:
+        reason = f"full diff exceeded {budget.max_seconds}s"
+    # the fallbacks get the same time again, the batch stays bounded at 2x
+    deadline = budget.deadline(time.monotonic())
+    try:
+        return block_hash_opcodes(a, b, budget.block_size, engine=engine, deadline=deadline), BLOCK, reason
+    except DiffTimeout:
+        reason = f"full and block diff exceeded {budget.max_seconds}s"
+    return None, SUMMARY, reason
+
+
+_SUMMARY_REPORT = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8" />
+    <title>%(title)s</title>
+</head>
+<body style="font-family: sans-serif;">
+    <h2>%(title)s</h2>
+    <p>Only a summary was produced for this pair: %(reason)s.
+       It is flagged as degraded for an offline deep comparison.</p>
+    <table border="1" cellpadding="4" cellspacing="0">
+        <tr><th></th><th>%(fromdesc)s</th><th>%(todesc)s</th></tr>
+        <tr><td>Segments</td><td>%(segments_from)s</td><td>%(segments_to)s</td></tr>
+        <tr><td>Segments only on this side</td><td>%(removed)s</td><td>%(added)s</td></tr>
+    </table>
+</body>
+</html>
+"""
+
+
+def summary_report(fromdesc, todesc, summary, reason):
+    """ HTML report of a pair that was only summarized. """
+    return _SUMMARY_REPORT % dict(
+        title="EDI comparison summary",
+        fromdesc=html.escape(fromdesc),
+        todesc=html.escape(todesc),
+        reason=html.escape(reason),
+        segments_from=summary["segments_from"],
+        segments_to=summary["segments_to"],
+        removed=summary["removed"],
+        added=summary["added"],
+    )
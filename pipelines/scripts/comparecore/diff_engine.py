@@ -0,0 +1,362 @@
+""" Hashed diff engines for EDI segment / text line sequences.
+
+Every segment is interned to an integer id so the algorithms below only ever
+compare small ints. The result is a list of SequenceMatcher style opcodes
+('equal', 'replace', 'delete', 'insert') that the HTML report is built from.
+"""
+import bisect
+import difflib
+import time
+
+from .backends import numpy
+
+ENGINE_VERSION = "2"
+DEFAULT_ENGINE = "patience"
+
+# below this many items the pure python loop beats building numpy arrays
+NUMPY_TRIM_THRESHOLD = 10000
+
+# histogram diff: items occurring more often than this in a range are not
+# used as split points (same limit as git's histogram diff)
+HISTOGRAM_MAX_CHAIN = 64
+
+
+class DiffTimeout(Exception):
+    """ Raised by the engines when a diff runs past its deadline. """
+
+
+def check_deadline(deadline):
+    """ Raise DiffTimeout once time.monotonic() passes deadline (None: no limit). """
+    if deadline is not None and time.monotonic() > deadline:
+        raise DiffTimeout("diff exceeded its time budget")
+
+
+def intern_sequences(a, b):
+    """ Map the items of a and b to integer ids (equal items share an id). """
+    ids = {}
+    setdefault = ids.setdefault
+    ia = [setdefault(item, len(ids)) for item in a]
+    ib = [setdefault(item, len(ids)) for item in b]
+    return ia, ib
+
+
+def common_affix(a, b, use_numpy=True):
+    """ Return (prefix, suffix) lengths shared by the int sequences a and b. """
+    n = min(len(a), len(b))
+    # numpy is optional, only used to trim long common ends
+    np = numpy() if use_numpy and n >= NUMPY_TRIM_THRESHOLD else None
+    if np is not None:
+        arr_a = np.asarray(a, dtype=np.int64)
+        arr_b = np.asarray(b, dtype=np.int64)
+        mismatch = np.flatnonzero(arr_a[:n] != arr_b[:n])
+        prefix = int(mismatch[0]) if mismatch.size else n
+        rest = n - prefix
+        if not rest:
+            return prefix, 0
+        tail_a = arr_a[len(a) - rest:][::-1]
+        tail_b = arr_b[len(b) - rest:][::-1]
+        mismatch = np.flatnonzero(tail_a != tail_b)
+        suffix = int(mismatch[0]) if mismatch.size else rest
+        return prefix, suffix
+
+    prefix = 0
+    while prefix < n and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    la, lb = len(a), len(b)
+    while suffix < n - prefix and a[la - suffix - 1] == b[lb - suffix - 1]:
+        suffix += 1
+    return prefix, suffix
+
+
+def _middle_snake(a, a0, n, b, b0, m, deadline=None):
+    """ Find the middle snake of a[a0:a0+n] vs b[b0:b0+m] (Myers, linear space).
+
+    Returns (d, x, y, u, v): the edit distance and the snake from (x, y) to
+    (u, v) relative to a0/b0.
+    """
+    delta = n - m
+    odd = delta & 1
+    offset = n + m + 1
+    vf = [0] * (2 * offset + 2)
+    vb = [0] * (2 * offset + 2)
+    for d in range((n + m + 1) // 2 + 1):
+        if deadline is not None and not d & 63:
+            check_deadline(deadline)
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[offset + k - 1] < vf[offset + k + 1]):
+                x = vf[offset + k + 1]
+            else:
+                x = vf[offset + k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            vf[offset + k] = x
+            c = delta - k
+            if odd and -(d - 1) <= c <= d - 1 and x + vb[offset + c] >= n:
+                return 2 * d - 1, x_start, y_start, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[offset + k - 1] < vb[offset + k + 1]):
+                x = vb[offset + k + 1]
+            else:
+                x = vb[offset + k - 1] + 1
+            y = x - k
+            x_start, y_start = x, y
+            while x < n and y < m and a[a0 + n - x - 1] == b[b0 + m - y - 1]:
+                x += 1
+                y += 1
+            vb[offset + k] = x
+            c = delta - k
+            if not odd and -d <= c <= d and x + vf[offset + c] >= n:
+                return 2 * d, n - x, m - y, n - x_start, m - y_start
+    raise AssertionError("middle snake not found")
+
+
+def myers_blocks(a, b, a0=0, a1=None, b0=0, b1=None, deadline=None):
+    """ Matching blocks of a[a0:a1] vs b[b0:b1] using linear space Myers.
+
+    Raises DiffTimeout when deadline (a time.monotonic() value) passes.
+    """
+    a1 = len(a) if a1 is None else a1
+    b1 = len(b) if b1 is None else b1
+    blocks = []
+    # explicit stack instead of recursion, items are ranges or finished blocks
+    stack = [(a0, a1 - a0, b0, b1 - b0)]
+    while stack:
+        item = stack.pop()
+        if len(item) == 3:
+            blocks.append(item)
+            continue
+        x0, n, y0, m = item
+        if n == 0 or m == 0:
+            continue
+        d, x, y, u, v = _middle_snake(a, x0, n, b, y0, m, deadline)
+        if d > 1:
+            stack.append((x0 + u, n - u, y0 + v, m - v))
+            if u > x:
+                stack.append((x0 + x, y0 + y, u - x))
+            stack.append((x0, x, y0, y))
+        elif d == 1:
+            # a single insert or delete: everything else lines up
+            prefix = 0
+            while prefix < min(n, m) and a[x0 + prefix] == b[y0 + prefix]:
+                prefix += 1
+            rest = min(n, m) - prefix
+            if rest:
+                stack.append((x0 + prefix + (n > m), y0 + prefix + (m > n), rest))
+            if prefix:
+                stack.append((x0, y0, prefix))
+        else:
+            stack.append((x0, y0, n))
+    return blocks
+
+
+def _unique_anchors(a, a0, a1, b, b0, b1):
+    """ Items occurring exactly once in both ranges, longest increasing run. """
+    index_a = {}
+    for i in range(a0, a1):
+        index_a[a[i]] = -1 if a[i] in index_a else i
+    index_b = {}
+    for j in range(b0, b1):
+        if index_a.get(b[j], -1) >= 0:
+            index_b[b[j]] = -1 if b[j] in index_b else j
+    pairs = sorted((index_a[item], j) for item, j in index_b.items() if j >= 0)
+
+    # patience sort: longest increasing subsequence of the b positions
+    tails, tail_index, previous = [], [], [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos:
+            previous[index] = tail_index[pos - 1]
+        if pos == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[pos] = j
+            tail_index[pos] = index
+    anchors = []
+    index = tail_index[-1] if tail_index else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def patience_blocks(a, b, a0=0, a1=None, b0=0, b1=None, deadline=None):
+    """ Matching blocks using patience diff, falling back to Myers. """
+    a1 = len(a) if a1 is None else a1
+    b1 = len(b) if b1 is None else b1
+    blocks = []
+    stack = [(a0, a1, b0, b1)]
+    while stack:
+        item = stack.pop()
+        if len(item) == 3:
+            blocks.append(item)
+            continue
+        x0, x1, y0, y1 = item
+        if x0 >= x1 or y0 >= y1:
+            continue
+        check_deadline(deadline)
+        # matching head and tail of the range are taken as is
+        head = 0
+        while x0 + head < x1 and y0 + head < y1 and a[x0 + head] == b[y0 + head]:
+            head += 1
+        tail = 0
+        while x1 - tail > x0 + head and y1 - tail > y0 + head and a[x1 - tail - 1] == b[y1 - tail - 1]:
+            tail += 1
+        if tail:
+            stack.append((x1 - tail, y1 - tail, tail))
+        # myers_blocks takes (a0, a1, b0, b1)
+        inner = (x0 + head, x1 - tail, y0 + head, y1 - tail)
+        anchors = _unique_anchors(a, inner[0], inner[1], b, inner[2], inner[3])
+        if anchors:
+            # diff the gaps between anchors; anchors themselves match
+            pending = []
+            prev_i, prev_j = inner[0], inner[2]
+            for i, j in anchors:
+                pending.append((prev_i, i, prev_j, j))
+                pending.append((i, j, 1))
+                prev_i, prev_j = i + 1, j + 1
+            pending.append((prev_i, inner[1], prev_j, inner[3]))
+            stack.extend(reversed(pending))
+        else:
+            stack.extend(myers_blocks(a, b, *inner, deadline=deadline))
+        if head:
+            stack.append((x0, y0, head))
+    return blocks
+
+
+def _lowest_occurrence_region(a, a0, a1, b, b0, b1):
+    """ Longest common run containing the item that occurs least often in a[a0:a1].
+
+    Returns (i, j, size), or None when no common item occurs at most
+    HISTOGRAM_MAX_CHAIN times.
+    """
+    positions = {}
+    for i in range(a0, a1):
+        positions.setdefault(a[i], []).append(i)
+    best = None
+    lowest = HISTOGRAM_MAX_CHAIN + 1
+    j = b0
+    while j < b1:
+        occurrences = positions.get(b[j])
+        if occurrences is None or len(occurrences) > lowest:
+            j += 1
+            continue
+        next_j = j + 1
+        for i in occurrences:
+            # grow the match around (i, j) in both directions
+            start_i, start_j = i, j
+            while start_i > a0 and start_j > b0 and a[start_i - 1] == b[start_j - 1]:
+                start_i -= 1
+                start_j -= 1
+            end_i, end_j = i + 1, j + 1
+            while end_i < a1 and end_j < b1 and a[end_i] == b[end_j]:
+                end_i += 1
+                end_j += 1
+            count = min(len(positions[a[k]]) for k in range(start_i, end_i))
+            if best is None or count < lowest or (count == lowest and end_i - start_i > best[2]):
+                lowest = count
+                best = (start_i, start_j, end_i - start_i)
+            next_j = max(next_j, end_j)
+        j = next_j
+    return best
+
+
+def histogram_blocks(a, b, a0=0, a1=None, b0=0, b1=None, deadline=None):
+    """ Matching blocks using histogram diff (as git diff --histogram), falling back to Myers.
+
+    Each range is split on the common run around its rarest item, which keeps
+    repeated segments (N1, REF, ...) from being matched across the file the
+    way unique-only patience anchors cannot.
+    """
+    a1 = len(a) if a1 is None else a1
+    b1 = len(b) if b1 is None else b1
+    blocks = []
+    stack = [(a0, a1, b0, b1)]
+    while stack:
+        x0, x1, y0, y1 = stack.pop()
+        if x0 >= x1 or y0 >= y1:
+            continue
+        check_deadline(deadline)
+        region = _lowest_occurrence_region(a, x0, x1, b, y0, y1)
+        if region is None:
+            blocks.extend(myers_blocks(a, b, x0, x1, y0, y1, deadline=deadline))
+            continue
+        i, j, size = region
+        blocks.append(region)
+        stack.append((i + size, x1, j + size, y1))
+        stack.append((x0, i, y0, j))
+    return blocks
+
+
+def difflib_blocks(a, b, a0=0, a1=None, b0=0, b1=None, deadline=None):
+    """ Matching blocks from difflib.SequenceMatcher over the interned ids.
+
+    SequenceMatcher cannot be interrupted, deadline is only checked up front.
+    """
+    check_deadline(deadline)
+    a1 = len(a) if a1 is None else a1
+    b1 = len(b) if b1 is None else b1
+    matcher = difflib.SequenceMatcher(None, a[a0:a1], b[b0:b1], autojunk=False)
+    return [(i + a0, j + b0, size) for i, j, size in matcher.get_matching_blocks() if size]
+
+
+ENGINES = {
+    "myers": myers_blocks,
+    "patience": patience_blocks,
+    "histogram": histogram_blocks,
+    "difflib": difflib_blocks,
+}
+
+
+def get_engine(name):
+    """ Look up a diff engine by name. """
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown diff engine '{name}', expected one of: {', '.join(sorted(ENGINES))}")
+
+
+def blocks_to_opcodes(blocks, len_a, len_b):
+    """ Convert sorted matching blocks to SequenceMatcher style opcodes. """
+    opcodes = []
+    i = j = 0
+    for block_i, block_j, size in sorted(blocks) + [(len_a, len_b, 0)]:
+        # merge adjacent blocks so equal runs come out as one opcode
+        if i < block_i and j < block_j:
+            opcodes.append(("replace", i, block_i, j, block_j))
+        elif i < block_i:
+            opcodes.append(("delete", i, block_i, j, j))
+        elif j < block_j:
+            opcodes.append(("insert", i, i, j, block_j))
+        if size:
+            if opcodes and opcodes[-1][0] == "equal":
+                _, eq_i1, _, eq_j1, _ = opcodes.pop()
+                opcodes.append(("equal", eq_i1, block_i + size, eq_j1, block_j + size))
+            else:
+                opcodes.append(("equal", block_i, block_i + size, block_j, block_j + size))
+        i, j = block_i + size, block_j + size
+    return opcodes
+
+
+def diff_opcodes(a, b, engine=DEFAULT_ENGINE, use_numpy=True, deadline=None):
+    """ Diff two sequences of hashable items and return opcodes.
+
+    The common prefix and suffix are trimmed first (vectorized with numpy when
+    available) so the engine only sees the region that actually differs.
+    Raises DiffTimeout when deadline (a time.monotonic() value) passes.
+    """
+    blocks_for = get_engine(engine)
+    ia, ib = intern_sequences(a, b)
+    prefix, suffix = common_affix(ia, ib, use_numpy=use_numpy)
+    blocks = []
+    if prefix:
+        blocks.append((0, 0, prefix))
+    blocks.extend(blocks_for(ia, ib, prefix, len(ia) - suffix, prefix, len(ib) - suffix, deadline=deadline))
+    if suffix:
+        blocks.append((len(ia) - suffix, len(ib) - suffix, suffix))
+    return blocks_to_opcodes(blocks, len(ia), len(ib))
@@ -0,0 +1,501 @@
+""" Side by side HTML report built from diff_engine opcodes.
+
+SegmentHtmlDiff produces the same table markup as difflib.HtmlDiff but takes
+its line alignment from a pluggable diff engine instead of difflib._mdiff, so
+the expensive SequenceMatcher pass over the whole file is avoided.
+iter_unified_diff renders the same opcodes as difflib.unified_diff text, so
+one diff serves both the HTML and the text report.
+"""
+import collections
+import difflib
+import itertools
+
+from .diff_engine import DEFAULT_ENGINE, diff_opcodes
+
+# same cut off ndiff uses to decide whether two lines are "similar"
+INTRALINE_CUTOFF = 0.75
+
+# characters of changed segments highlighted per pair; past it changed
+# segments are marked as a whole
+INTRALINE_BUDGET = 1000000
+
+_MARKER_KEYS = {"replace": "^", "delete": "-", "insert": "+"}
+
+# streaming output: table rows per yielded chunk, and how many rows may be
+# held back waiting to know whether a change is the last one
+ROWS_PER_CHUNK = 500
+MAX_PENDING_ROWS = 5000
+
+# collapsed reports: unchanged runs longer than this are not expandable,
+# and paged reports hold this many rows per page
+EXPAND_LIMIT = 200
+PAGE_ROWS = 2000
+
+_SPLIT = "\x02"
+
+# flag of a row standing for a run of unchanged rows that was folded away
+COLLAPSED = "collapsed"
+CollapsedRun = collections.namedtuple("CollapsedRun", ["count", "first", "rows"])
+
+STUB_STYLES = """
+        tr.diff_stub td {background-color:#eef; color:#555; font-style:italic; cursor:default}
+        tr.diff_stub[onclick] td {cursor:pointer}"""
+
+STUB_SCRIPT = """
+    <script type="text/javascript">
+    function diffExpand(row) {
+        var hidden = row.querySelector('template');
+        if (hidden) { row.replaceWith(hidden.content.cloneNode(true)); }
+    }
+    </script>
+"""
+
+
+def intraline_markup(from_text, to_text):
+    """ Return (from, to) text with difflib's \\0x ... \\1 change markers.
+
+    Returns None when the lines are too different to be worth highlighting
+    character by character.
+    """
+    matcher = difflib.SequenceMatcher(None, from_text, to_text, autojunk=False)
+    if (matcher.real_quick_ratio() <= INTRALINE_CUTOFF
+            or matcher.quick_ratio() <= INTRALINE_CUTOFF
+            or matcher.ratio() <= INTRALINE_CUTOFF):
+        return None
+    from_parts, to_parts = [], []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            from_parts.append(from_text[i1:i2])
+            to_parts.append(to_text[j1:j2])
+            continue
+        key = _MARKER_KEYS[tag]
+        if i2 > i1:
+            from_parts.append("\0" + key + from_text[i1:i2] + "\1")
+        if j2 > j1:
+            to_parts.append("\0" + key + to_text[j1:j2] + "\1")
+    return "".join(from_parts), "".join(to_parts)
+
+
+def element_markup(from_text, to_text, separator):
+    """ Like intraline_markup, but marks whole EDI elements split on separator.
+
+    Returns None when the segment ids differ.
+    """
+    from_elements = from_text.split(separator)
+    to_elements = to_text.split(separator)
+    if from_elements[0] != to_elements[0]:
+        return None
+    matcher = difflib.SequenceMatcher(None, from_elements, to_elements, autojunk=False)
+    from_parts, to_parts = [], []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            from_parts.extend(from_elements[i1:i2])
+            to_parts.extend(to_elements[j1:j2])
+            continue
+        key = _MARKER_KEYS[tag]
+        from_parts.extend("\0" + key + element + "\1" for element in from_elements[i1:i2])
+        to_parts.extend("\0" + key + element + "\1" for element in to_elements[j1:j2])
+    return separator.join(from_parts), separator.join(to_parts)
+
+
+def iter_line_pairs(fromlines, tolines, opcodes, element_separator=None, intraline_budget=INTRALINE_BUDGET,
+                    to_line_numbers=None):
+    """ Yield (fromdata, todata, flag) rows in the format of difflib._mdiff.
+
+    Changed line pairs are highlighted as they are yielded: element by
+    element when element_separator is given, otherwise character by
+    character. Once intraline_budget characters have been highlighted
+    (None for no limit) the remaining changed lines are marked whole.
+    to_line_numbers[j] is the number shown for tolines[j] (default j + 1),
+    for a side whose lines were reordered.
+    """
+    blank = ("", "\n")
+    budget = intraline_budget
+    to_number = (lambda j: j + 1) if to_line_numbers is None else to_line_numbers.__getitem__
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                yield (i1 + offset + 1, fromlines[i1 + offset]), (to_number(j1 + offset), tolines[j1 + offset]), False
+            continue
+        rows = max(i2 - i1, j2 - j1)
+        for offset in range(rows):
+            i, j = i1 + offset, j1 + offset
+            if i < i2 and j < j2:
+                marked = None
+                cost = len(fromlines[i]) + len(tolines[j])
+                if budget is None or cost <= budget:
+                    if budget is not None:
+                        budget -= cost
+                    if element_separator:
+                        marked = element_markup(fromlines[i], tolines[j], element_separator)
+                    else:
+                        marked = intraline_markup(fromlines[i], tolines[j])
+                if marked is None:
+                    marked = "\0-" + (fromlines[i] or " ") + "\1", "\0+" + (tolines[j] or " ") + "\1"
+                yield (i + 1, marked[0]), (to_number(j), marked[1]), True
+            elif i < i2:
+                yield (i + 1, "\0-" + (fromlines[i] or " ") + "\1"), blank, True
+            else:
+                yield blank, (to_number(j), "\0+" + (tolines[j] or " ") + "\1"), True
+
+
+def iter_context_pairs(pairs, numlines):
+    """ Keep numlines of unchanged rows around each change (difflib context mode).
+
+    A (None, None, None) row marks a skipped run, exactly like difflib._mdiff.
+    """
+    context = numlines + 1
+    pairs = iter(pairs)
+    while True:
+        index, context_lines = 0, [None] * context
+        found_diff = False
+        while found_diff is False:
+            row = next(pairs, None)
+            if row is None:
+                return
+            found_diff = row[2]
+            context_lines[index % context] = row
+            index += 1
+        if index > context:
+            yield None, None, None
+            lines_to_write = context
+        else:
+            lines_to_write = index
+            index = 0
+        while lines_to_write:
+            yield context_lines[index % context]
+            index += 1
+            lines_to_write -= 1
+        lines_to_write = context - 1
+        while lines_to_write:
+            row = next(pairs, None)
+            if row is None:
+                return
+            lines_to_write = context - 1 if row[2] else lines_to_write - 1
+            yield row
+
+
+def iter_collapsed_pairs(pairs, numlines, expand_limit=None):
+    """ Like iter_context_pairs, but skipped runs are yielded as CollapsedRun rows.
+
+    Each collapsed run comes out as (CollapsedRun, None, COLLAPSED). Its rows
+    are kept so the report can expand them in place, unless there are more
+    than expand_limit of them, in which case only the count is kept.
+    """
+    expand_limit = EXPAND_LIMIT if expand_limit is None else expand_limit
+    held = collections.deque()
+    first = None
+    dropped = 0
+    trailing = 0
+
+    def collapsed(keep):
+        hidden = list(held)[:max(0, len(held) - keep)]
+        count = dropped + len(hidden)
+        if not count:
+            return None
+        rows = None if count > expand_limit else hidden
+        run_first = first or (hidden[0][0][0], hidden[0][1][0])
+        return CollapsedRun(count, run_first, rows), None, COLLAPSED
+
+    for row in pairs:
+        if row[2]:
+            stub = collapsed(numlines)
+            if stub is not None:
+                yield stub
+            # leading context of the change
+            yield from list(held)[len(held) - min(numlines, len(held)):]
+            held.clear()
+            first, dropped = None, 0
+            yield row
+            trailing = numlines
+        elif trailing:
+            trailing -= 1
+            yield row
+        else:
+            held.append(row)
+            if len(held) > expand_limit + numlines:
+                # too long to expand: keep only the count and the context rows
+                oldest = held.popleft()
+                if first is None:
+                    first = (oldest[0][0], oldest[1][0])
+                dropped += 1
+    stub = collapsed(0)
+    if stub is not None:
+        yield stub
+
+
+def group_opcodes(opcodes, n=3):
+    """ difflib.SequenceMatcher.get_grouped_opcodes for a diff_engine opcode list. """
+    codes = list(opcodes) or [("equal", 0, 1, 0, 1)]
+    # trim the leading and trailing unchanged runs to n lines of context
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # an unchanged run longer than twice the context splits the hunks
+        if tag == "equal" and i2 - i1 > n + n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _unified_range(start, stop):
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def iter_unified_diff(fromlines, tolines, opcodes, fromfile='', tofile='', n=3, lineterm='\n'):
+    """ Same lines as difflib.unified_diff, from precomputed diff_engine opcodes. """
+    for index, group in enumerate(group_opcodes(opcodes, n)):
+        if index == 0:
+            yield f"--- {fromfile}{lineterm}"
+            yield f"+++ {tofile}{lineterm}"
+        first, last = group[0], group[-1]
+        yield f"@@ -{_unified_range(first[1], last[2])} +{_unified_range(first[3], last[4])} @@{lineterm}"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for line in fromlines[i1:i2]:
+                    yield " " + line
+                continue
+            if tag in ("replace", "delete"):
+                for line in fromlines[i1:i2]:
+                    yield "-" + line
+            if tag in ("replace", "insert"):
+                for line in tolines[j1:j2]:
+                    yield "+" + line
+
+
+class SegmentHtmlDiff(difflib.HtmlDiff):
+    """ difflib.HtmlDiff driven by a diff_engine engine (myers, patience, ...).
+
+    iter_file / iter_table yield the report in chunks of rows instead of
+    building it as one string; make_file / make_table join them. With
+    collapse=True unchanged runs are folded into expandable stub rows, and
+    iter_pages splits the table into separate page documents.
+    element_separator highlights changed EDI elements instead of characters
+    and intraline_budget caps the highlighting work per report.
+    to_line_numbers numbers the lines of a reordered "to" side as in its file.
+    """
+
+    def __init__(self, tabsize=8, wrapcolumn=None, engine=DEFAULT_ENGINE, element_separator=None,
+                 intraline_budget=INTRALINE_BUDGET, to_line_numbers=None):
+        super().__init__(tabsize=tabsize, wrapcolumn=wrapcolumn)
+        self._engine = engine
+        # see iter_line_pairs
+        self._element_separator = element_separator
+        self._intraline_budget = intraline_budget
+        self._to_line_numbers = to_line_numbers
+
+    def make_file(self, fromlines, tolines, fromdesc='', todesc='',
+                  context=False, numlines=5, *, charset='utf-8', opcodes=None, collapse=False,
+                  expand_limit=EXPAND_LIMIT):
+        """ Same as difflib.HtmlDiff.make_file, optionally with precomputed opcodes. """
+        return ''.join(self.iter_file(fromlines, tolines, fromdesc, todesc, context=context,
+                                      numlines=numlines, charset=charset, opcodes=opcodes,
+                                      max_pending_rows=None, collapse=collapse,
+                                      expand_limit=expand_limit))
+
+    def make_table(self, fromlines, tolines, fromdesc='', todesc='', context=False,
+                   numlines=5, opcodes=None, collapse=False, expand_limit=EXPAND_LIMIT):
+        """ Same as difflib.HtmlDiff.make_table, rows come from the diff engine. """
+        return ''.join(self.iter_table(fromlines, tolines, fromdesc, todesc, context=context,
+                                       numlines=numlines, opcodes=opcodes, max_pending_rows=None,
+                                       collapse=collapse, expand_limit=expand_limit))
+
+    def _file_parts(self, charset, collapse):
+        head, tail = (self._file_template % dict(
+            styles=self._styles + (STUB_STYLES if collapse else ''),
+            legend=self._legend,
+            table=_SPLIT,
+            charset=charset
+        )).split(_SPLIT)
+        if collapse:
+            head += STUB_SCRIPT
+        return head, tail
+
+    def iter_file(self, fromlines, tolines, fromdesc='', todesc='', context=False, numlines=5,
+                  *, charset='utf-8', opcodes=None, rows_per_chunk=ROWS_PER_CHUNK,
+                  max_pending_rows=MAX_PENDING_ROWS, collapse=False, expand_limit=EXPAND_LIMIT):
+        """ Yield the HTML file of make_file in chunks of rows_per_chunk table rows. """
+        head, tail = self._file_parts(charset, collapse)
+        chunks = self.iter_table(fromlines, tolines, fromdesc, todesc, context=context,
+                                 numlines=numlines, opcodes=opcodes, rows_per_chunk=rows_per_chunk,
+                                 max_pending_rows=max_pending_rows, collapse=collapse,
+                                 expand_limit=expand_limit)
+        for chunk in itertools.chain([head], chunks, [tail]):
+            yield chunk.encode(charset, 'xmlcharrefreplace').decode(charset)
+
+    def iter_pages(self, fromlines, tolines, fromdesc='', todesc='', context=False, numlines=5,
+                   *, charset='utf-8', opcodes=None, page_rows=PAGE_ROWS, collapse=False,
+                   expand_limit=EXPAND_LIMIT):
+        """ Yield the report as standalone HTML page documents of page_rows rows each. """
+        head, tail = self._file_parts(charset, collapse)
+        table_head, table_tail = self._table_parts(fromdesc, todesc)
+        rows = self._iter_rows(fromlines, tolines, context, numlines, opcodes, MAX_PENDING_ROWS,
+                               collapse, expand_limit)
+        while True:
+            page = list(itertools.islice(rows, page_rows))
+            if not page:
+                return
+            text = head + table_head + ''.join(page) + table_tail + tail
+            yield text.encode(charset, 'xmlcharrefreplace').decode(charset)
+
+    def _diff_rows(self, fromlines, tolines, context, numlines, opcodes, collapse, expand_limit):
+        if opcodes is None:
+            opcodes = diff_opcodes(fromlines, tolines, engine=self._engine)
+        fromlines, tolines = self._tab_newline_replace(fromlines, tolines)
+        diffs = iter_line_pairs(fromlines, tolines, opcodes, self._element_separator, self._intraline_budget,
+                                self._to_line_numbers)
+        if collapse:
+            diffs = iter_collapsed_pairs(diffs, numlines, expand_limit)
+        elif context:
+            diffs = iter_context_pairs(diffs, numlines)
+        if self._wrapcolumn:
+            diffs = self._wrap_rows(diffs)
+        return diffs
+
+    def _wrap_rows(self, diffs):
+        for row in diffs:
+            if row[2] is COLLAPSED:
+                yield row
+            else:
+                yield from self._line_wrapper([row])
+
+    def _table_parts(self, fromdesc, todesc):
+        self._make_prefix()
+        if fromdesc or todesc:
+            header_row = '<thead><tr>%s%s%s%s</tr></thead>' % (
+                '<th class="diff_next"><br /></th>',
+                '<th colspan="2" class="diff_header">%s</th>' % fromdesc,
+                '<th class="diff_next"><br /></th>',
+                '<th colspan="2" class="diff_header">%s</th>' % todesc)
+        else:
+            header_row = ''
+        head, tail = (self._table_template % dict(
+            data_rows=_SPLIT,
+            header_row=header_row,
+            prefix=self._prefix[1])).split(_SPLIT)
+        return head, tail
+
+    def iter_table(self, fromlines, tolines, fromdesc='', todesc='', context=False, numlines=5,
+                   opcodes=None, rows_per_chunk=ROWS_PER_CHUNK, max_pending_rows=MAX_PENDING_ROWS,
+                   collapse=False, expand_limit=EXPAND_LIMIT):
+        """ Yield the HTML table of make_table in chunks of rows_per_chunk rows.
+
+        difflib needs the whole table to place the "next change" links; here
+        rows are held back only until those links are known, at most
+        max_pending_rows of them (None for no limit). Past that limit the
+        last change links to a later anchor instead of the top of the table.
+        """
+        head, tail = self._table_parts(fromdesc, todesc)
+        yield head
+        rows = self._iter_rows(fromlines, tolines, context, numlines, opcodes, max_pending_rows,
+                               collapse, expand_limit)
+        while True:
+            chunk = list(itertools.islice(rows, rows_per_chunk))
+            if not chunk:
+                break
+            yield ''.join(chunk)
+        yield tail
+
+    def _format_stub(self, run, fmt, next_id='', next_href=''):
+        label = '&#8943; %d unchanged lines (from line %s, to line %s)' % (run.count, run.first[0], run.first[1])
+        if run.rows is None:
+            return '            <tr class="diff_stub"><td class="diff_next"%s>%s</td>' \
+                   '<td colspan="5">%s</td></tr>\n' % (next_id, next_href, label)
+        hidden = []
+        for fromdata, todata, flag in (self._line_wrapper(run.rows) if self._wrapcolumn else run.rows):
+            hidden.append(fmt % ('', '', self._format_line(0, flag, *fromdata), '',
+                                 self._format_line(1, flag, *todata)))
+        return '            <tr class="diff_stub" onclick="diffExpand(this)"><td class="diff_next"%s>%s</td>' \
+               '<td colspan="5">%s &ndash; click to expand<template>%s</template></td></tr>\n' % (
+                   next_id, next_href, label, _replace_markers(''.join(hidden)))
+
+    def _iter_rows(self, fromlines, tolines, context, numlines, opcodes, max_pending_rows,
+                   collapse, expand_limit):
+        """ Yield the formatted table rows (difflib's _collect_lines + _convert_flags). """
+        toprefix = self._prefix[1]
+        fmt = '            <tr><td class="diff_next"%s>%s</td>%s' + \
+              '<td class="diff_next">%s</td>%s</tr>\n'
+        separator = '        </tbody>        \n        <tbody>\n'
+        top_link = '<a href="#difflib_chg_%s_top">t</a>' % toprefix
+
+        # rows are [next_id, next_href, from_html, to_html, flag, index]
+        pending = collections.deque()
+        num_chg, in_change = 0, False
+        last_row = None
+        index = -1
+
+        def render(row):
+            if row[4] is COLLAPSED:
+                return self._format_stub(row[2], fmt, row[0], row[1])
+            if row[4] is None:
+                return separator if row[5] > 0 else ''
+            return _replace_markers(fmt % (row[0], row[1], row[2], row[1], row[3]))
+
+        diffs = self._diff_rows(fromlines, tolines, context, numlines, opcodes, collapse, expand_limit)
+        for index, (fromdata, todata, flag) in enumerate(diffs):
+            if flag is None:
+                row = ['', '', None, None, None, index]
+            elif flag is COLLAPSED:
+                row = ['', '', fromdata, None, COLLAPSED, index]
+            else:
+                row = ['', '', self._format_line(0, flag, *fromdata),
+                       self._format_line(1, flag, *todata), flag, index]
+            pending.append(row)
+            if index == 0:
+                last_row = row
+                if not flag or flag is COLLAPSED:
+                    row[1] = '<a href="#difflib_chg_%s_0">f</a>' % toprefix
+            if flag and flag is not COLLAPSED:
+                if not in_change:
+                    in_change = True
+                    # anchor a few (context) rows before the change for the previous link
+                    pending[max(0, len(pending) - 1 - numlines)][0] = \
+                        ' id="difflib_chg_%s_%d"' % (toprefix, num_chg)
+                    num_chg += 1
+                    row[1] = '<a href="#difflib_chg_%s_%d">n</a>' % (toprefix, num_chg)
+                    last_row = row
+            else:
+                in_change = False
+
+            # keep enough rows to place the next anchor, and the last change
+            # row until we know whether another change follows it
+            while len(pending) > numlines + 1:
+                if pending[0] is last_row and (max_pending_rows is None or len(pending) <= max_pending_rows):
+                    break
+                yield render(pending.popleft())
+
+        if index == -1:
+            # check for cases where there is no content
+            if context or collapse:
+                text = '<td></td><td>&nbsp;No Differences Found&nbsp;</td>'
+            else:
+                text = '<td></td><td>&nbsp;Empty File&nbsp;</td>'
+            yield fmt % ('', top_link, text, top_link, text)
+            return
+        if last_row is not None and last_row in pending:
+            last_row[1] = top_link
+        while pending:
+            yield render(pending.popleft())
+
+
+def _replace_markers(text):
+    return text.replace('\0+', '<span class="diff_add">'). \
+        replace('\0-', '<span class="diff_sub">'). \
+        replace('\0^', '<span class="diff_chg">'). \
+        replace('\1', '</span>'). \
+        replace('\t', '&nbsp;')
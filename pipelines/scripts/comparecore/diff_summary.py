@@ -0,0 +1,147 @@
+""" Machine readable comparison results.
+
+Each compared pair gets a result record (counts of added, removed and
+changed segments or JSON paths, the first differences, timings and input
+sizes). A batch writes the records as JSON lines as the pairs complete and a
+summary of the whole batch at the end, so a pipeline can gate on them or
+feed a dashboard without parsing the HTML reports.
+"""
+import json
+
+# differences listed in full per pair, the rest are only counted
+DEFAULT_MAX_DIFFERENCES = 20
+
+RESULTS_FILE_NAME = "results.jsonl"
+SUMMARY_FILE_NAME = "summary.json"
+
+
+def empty_counts():
+    return {"added": 0, "removed": 0, "changed": 0, "unchanged": 0}
+
+
+def summarize_opcodes(fromlines, tolines, opcodes, max_differences=DEFAULT_MAX_DIFFERENCES, to_line_numbers=None):
+    """ Count the segment differences of a diff_engine opcode list.
+
+    A replace of n segments by m counts min(n, m) changed segments plus the
+    rest as removed or added. The first max_differences differences are
+    listed with their 1 based segment numbers; to_line_numbers maps
+    positions in tolines to those numbers when tolines was reordered (see
+    edi_loops.align_loops).
+    """
+    counts = empty_counts()
+    differences = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            counts["unchanged"] += i2 - i1
+            continue
+        changed = min(i2 - i1, j2 - j1)
+        counts["changed"] += changed
+        counts["removed"] += i2 - i1 - changed
+        counts["added"] += j2 - j1 - changed
+        if len(differences) < max_differences:
+            differences.append({
+                "op": tag,
+                "from_line": i1 + 1 if i2 > i1 else None,
+                "to_line": (j1 + 1 if to_line_numbers is None else to_line_numbers[j1]) if j2 > j1 else None,
+                "from": [line.rstrip("\n") for line in fromlines[i1:min(i2, i1 + 5)]],
+                "to": [line.rstrip("\n") for line in tolines[j1:min(j2, j1 + 5)]],
+            })
+    summary = {"segments_from": len(fromlines), "segments_to": len(tolines)}
+    summary.update(counts)
+    summary["differences"] = differences
+    return summary
+
+
+def _json_path(path):
+    if isinstance(path, str):
+        return path
+    return ".".join(str(part) for part in path)
+
+
+class JsonDiffSummary:
+    """ summarize_json_diff built up one difference record at a time (see json_stream). """
+
+    def __init__(self, max_differences=DEFAULT_MAX_DIFFERENCES):
+        self.max_differences = max_differences
+        self.counts = empty_counts()
+        self.differences = []
+
+    def add(self, difference):
+        d_type, d_path, d_value = difference
+        if d_type == "change":
+            entries = [(_json_path(d_path), d_value)]
+            self.counts["changed"] += 1
+        else:
+            # add / remove carry a list of (key, value) below d_path
+            prefix = _json_path(d_path)
+            entries = [(f"{prefix}.{key}" if prefix else str(key), value) for key, value in d_value]
+            self.counts["added" if d_type == "add" else "removed"] += len(entries)
+        for path, value in entries:
+            if len(self.differences) < self.max_differences:
+                self.differences.append({"op": d_type, "path": path, "value": value})
+
+    def summary(self):
+        summary = dict(self.counts)
+        del summary["unchanged"]
+        summary["differences"] = list(self.differences)
+        return summary
+
+
+def summarize_json_diff(difference, max_differences=DEFAULT_MAX_DIFFERENCES):
+    """ Count the added, removed and changed paths of a dictdiffer diff. """
+    summary = JsonDiffSummary(max_differences)
+    for record in difference:
+        summary.add(record)
+    return summary.summary()
+
+
+def has_differences(summary):
+    return bool(summary and (summary.get("added") or summary.get("removed") or summary.get("changed")))
+
+
+class JsonlWriter:
+    """ Append result records to a JSON lines file, one line per record. """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "w")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def batch_summary(results, elapsed):
+    """ Totals over the result records of a batch. """
+    summary = {
+        "pairs": len(results),
+        "failed": sum(1 for result in results if result.get("status") == "error"),
+        "with_differences": sum(1 for result in results if has_differences(result.get("diff"))),
+        "degraded": sum(1 for result in results if (result.get("diff") or {}).get("degraded")),
+        "outcomes": {},
+        "seconds": round(elapsed, 3),
+        "bytes": sum(result.get("bytes") or 0 for result in results),
+    }
+    summary.update(empty_counts())
+    del summary["unchanged"]
+    for result in results:
+        outcome = result.get("outcome") or result.get("status")
+        summary["outcomes"][outcome] = summary["outcomes"].get(outcome, 0) + 1
+        for key in ("added", "removed", "changed"):
+            summary[key] += (result.get("diff") or {}).get(key, 0)
+    summary["pairs_per_second"] = round(len(results) / elapsed, 3) if elapsed else None
+    return summary
+
+
+def write_summary(summary, summary_path):
+    with open(summary_path, "w") as summary_file:
+        json.dump(summary, summary_file, indent=2)
@@ -0,0 +1,66 @@
+""" Zip archives as comparison inputs, read in place.
+
+A member of an archive is addressed as "<archive path>!/<member name>", so it
+travels through the pairing manifest, worker tasks and result records like a
+plain file path. Members are listed from the zip central directory (no member
+data is read) and opened as decompressing streams, so a multi GB partner drop
+is compared without extracting it to disk.
+"""
+import functools
+import os
+import posixpath
+import zipfile
+
+MEMBER_SEPARATOR = "!/"
+
+
+def is_archive(path):
+    """ True for a zip file (directories and other files are not archives). """
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+def member_path(archive_path, name):
+    return f"{archive_path}{MEMBER_SEPARATOR}{name}"
+
+
+def split_member_path(path):
+    """ Split "<archive>!/<member>" into (archive, member); member is None for a plain path. """
+    archive_path, separator, name = path.partition(MEMBER_SEPARATOR)
+    return (archive_path, name) if separator else (path, None)
+
+
+def is_member_path(path):
+    return MEMBER_SEPARATOR in path
+
+
+@functools.lru_cache(maxsize=16)
+def _open_archive(archive_path, pid):
+    # one open archive (one central directory parse) per archive and process:
+    # forked workers must not share the parent's file offset
+    return zipfile.ZipFile(archive_path)
+
+
+def open_archive(archive_path):
+    return _open_archive(os.path.abspath(archive_path), os.getpid())
+
+
+def list_members(archive):
+    """ (base name, member name) of the files of an open ZipFile, from its central directory. """
+    return [(posixpath.basename(info.filename), info.filename)
+            for info in archive.infolist() if not info.is_dir()]
+
+
+def open_input(path):
+    """ Open a file or an archive member for binary reading. """
+    archive_path, name = split_member_path(path)
+    if name is None:
+        return open(path, "rb")
+    return open_archive(archive_path).open(name)
+
+
+def input_size(path):
+    """ Size in bytes of a file or of an archive member once decompressed. """
+    archive_path, name = split_member_path(path)
+    if name is None:
+        return os.path.getsize(path)
+    return open_archive(archive_path).getinfo(name).file_size
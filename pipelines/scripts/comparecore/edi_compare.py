@@ -0,0 +1,194 @@
+""" Compare of one EDI pair, shared by every EDI entry point.
+
+The pipeline scripts, the Streamlit app and the EdiCompare function each
+read their inputs their own way (files, archive members, uploads, blobs)
+into segment lists or streams. From there the diff within budget, the side
+by side HTML report (one file or paged) and the summary are built here;
+compare_edi_paths runs the whole sequence for two files on disk.
+"""
+import os
+import time
+
+from .diff_budget import FULL, SUMMARY, DiffBudget, budgeted_opcodes, multiset_summary, summary_report
+from .diff_engine import DEFAULT_ENGINE, diff_opcodes
+from .diff_report import SegmentHtmlDiff
+from .diff_summary import DEFAULT_MAX_DIFFERENCES, summarize_opcodes
+from .edi_archive import input_size
+from .edi_loops import align_loops
+from .edi_normalize import iter_normalized_segments
+from .edi_tokenizer import HEADER_PROBE_SIZE, detect_delimiters, iter_segments, read_delimiters, read_segments
+from .report_pages import write_paged_report
+from .report_writer import write_chunks
+
+
+def shared_separator(from_separator, to_separator):
+    """ Element separator of both sides, None when they differ.
+
+    Changed segments are highlighted element by element only when both
+    sides agree on the separator.
+    """
+    return from_separator if from_separator == to_separator else None
+
+
+def text_element_separator(from_text, to_text):
+    """ Element separator shared by two EDI texts, None for plain text. """
+    return shared_separator(detect_delimiters(from_text[:HEADER_PROBE_SIZE]).element,
+                            detect_delimiters(to_text[:HEADER_PROBE_SIZE]).element)
+
+
+def read_edi_segments(file_path, normalizer=None):
+    """ Segment list of an EDI file, with the normalizer's masks applied when one is given. """
+    if normalizer is not None:
+        # mask volatile envelope fields (control numbers, dates) before diffing
+        return list(iter_normalized_segments(file_path, normalizer))
+    return read_segments(file_path)
+
+
+def write_segment_report(from_lines, to_lines, opcodes, output_path, fromdesc, todesc, engine=DEFAULT_ENGINE,
+                         separator=None, collapse=False, context_lines=5, page_rows=None, tabsize=4, wrapcolumn=80,
+                         to_line_numbers=None):
+    """ Write the side by side HTML report of a diff_engine opcode list.
+
+    collapse folds unchanged runs (beyond context_lines around each change)
+    into expandable rows; page_rows splits the report into pages behind an
+    index page at output_path. The report is streamed to disk in chunks,
+    never held as one string. to_line_numbers gives the file segment numbers
+    of reordered to_lines (see edi_loops.align_loops).
+    """
+    html_diff = SegmentHtmlDiff(tabsize=tabsize, wrapcolumn=wrapcolumn, engine=engine, element_separator=separator,
+                                to_line_numbers=to_line_numbers)
+    if page_rows:
+        write_paged_report(html_diff.iter_pages(
+            from_lines,
+            to_lines,
+            fromdesc=fromdesc,
+            todesc=todesc,
+            numlines=context_lines,
+            opcodes=opcodes,
+            page_rows=page_rows,
+            collapse=collapse
+        ), output_path)
+    else:
+        write_chunks(html_diff.iter_file(
+            from_lines,
+            to_lines,
+            fromdesc=fromdesc,
+            todesc=todesc,
+            numlines=context_lines,
+            opcodes=opcodes,
+            collapse=collapse
+        ), output_path)
+
+
+def write_summary_only(from_segments, to_segments, output_path, fromdesc, todesc, reason, strategy=SUMMARY):
+    """ Count the segments of a pair that is not diffed and write the summary only report.
+
+    The segments may be iterators, they are consumed once and never held.
+    Returns the summary, marked degraded for an offline deep comparison.
+    """
+    summary = multiset_summary(from_segments, to_segments)
+    write_chunks([summary_report(fromdesc, todesc, summary, reason)], output_path)
+    summary.update(strategy=strategy, degraded=True, degraded_reason=reason)
+    return summary
+
+
+def compare_segments(from_lines, to_lines, output_path, fromdesc, todesc, engine=DEFAULT_ENGINE, budget=None,
+                     started=None, diff=None, separator=None, max_differences=DEFAULT_MAX_DIFFERENCES,
+                     collapse=False, context_lines=5, page_rows=None, tabsize=4, wrapcolumn=80, to_line_numbers=None):
+    """ Diff two segment lists within budget, write the report and return the diff summary.
+
+    diff is the full diff strategy of diff_budget.budgeted_opcodes (e.g.
+    matched transaction sets). A pair over budget falls back to a block-hash
+    diff or to a summary only report; the summary then has "degraded" set
+    and says which "strategy" was used. One diff serves both the report and
+    the summary. to_line_numbers is passed to both, see write_segment_report.
+    """
+    budget = budget or DiffBudget()
+    opcodes, strategy, reason = budgeted_opcodes(from_lines, to_lines, engine=engine, budget=budget,
+                                                 started=started, diff=diff)
+    if opcodes is None:
+        return write_summary_only(from_lines, to_lines, output_path, fromdesc, todesc, reason, strategy)
+    write_segment_report(from_lines, to_lines, opcodes, output_path, fromdesc, todesc, engine=engine,
+                         separator=separator, collapse=collapse, context_lines=context_lines, page_rows=page_rows,
+                         tabsize=tabsize, wrapcolumn=wrapcolumn, to_line_numbers=to_line_numbers)
+    summary = summarize_opcodes(from_lines, to_lines, opcodes, max_differences, to_line_numbers)
+    summary.update(strategy=strategy, degraded=strategy != FULL, degraded_reason=reason)
+    return summary
+
+
+def compare_segment_streams(from_segments, to_segments, input_bytes, output_path, fromdesc, todesc,
+                            engine=DEFAULT_ENGINE, budget=None, started=None, separator=None,
+                            max_differences=DEFAULT_MAX_DIFFERENCES, **report_options):
+    """ compare_segments over two segment iterators of input_bytes bytes together.
+
+    Streams of more than budget.max_bytes are only counted, never held in
+    memory. report_options are those of compare_segments.
+    """
+    budget = budget or DiffBudget()
+    if budget.too_large(input_bytes):
+        return write_summary_only(from_segments, to_segments, output_path, fromdesc, todesc,
+                                  f"inputs exceed {budget.max_bytes} bytes")
+    return compare_segments(list(from_segments), list(to_segments), output_path, fromdesc, todesc, engine=engine,
+                            budget=budget, started=started, separator=separator, max_differences=max_differences,
+                            **report_options)
+
+
+def compare_edi_paths(from_path, to_path, output_path, fromdesc=None, todesc=None, engine=DEFAULT_ENGINE,
+                      budget=None, normalizer=None, segments=None, transaction_key=None, transaction_workers=1,
+                      loops=None, max_differences=DEFAULT_MAX_DIFFERENCES, **report_options):
+    """ Compare two EDI files (or archive members), write the report and return the diff summary.
+
+    normalizer (edi_normalize.Normalizer) masks volatile envelope fields;
+    segments is an optional pair of segment lists the caller has already
+    read. loops aligns repeated loops of to_path in from_path order (see
+    edi_loops), transaction_key diffs matched ST/SE transaction sets in
+    transaction_workers processes (see edi_transactions). The diff runs
+    within budget as in compare_segments; inputs over budget.max_bytes are
+    only counted while streaming. The summary also holds the "transactions"
+    and "loops" statistics when those options are used. report_options are
+    those of write_segment_report.
+    """
+    budget = budget or DiffBudget()
+    started = time.monotonic()
+    fromdesc = fromdesc or os.path.basename(from_path)
+    todesc = todesc or os.path.basename(to_path)
+    if segments is None and budget.too_large(input_size(from_path) + input_size(to_path)):
+        # too big to hold: count segments while streaming and report only that
+        return write_summary_only(
+            iter_normalized_segments(from_path, normalizer) if normalizer else iter_segments(from_path),
+            iter_normalized_segments(to_path, normalizer) if normalizer else iter_segments(to_path),
+            output_path, fromdesc, todesc, f"inputs exceed {budget.max_bytes} bytes")
+
+    # diff on EDI segments (split on the ISA segment terminator), not on physical lines
+    if segments is not None:
+        from_lines, to_lines = segments
+    else:
+        from_lines = read_edi_segments(from_path, normalizer)
+        to_lines = read_edi_segments(to_path, normalizer)
+
+    transactions = loop_stats = to_line_numbers = None
+    from_separator = read_delimiters(from_path).element
+    to_separator = read_delimiters(to_path).element
+    if loops and to_separator:
+        # to_path's loops in from_path order, under their segment numbers in to_path
+        to_lines, loop_stats, to_line_numbers = align_loops(from_lines, to_lines, to_separator, loops)
+
+    def full_diff(deadline):
+        nonlocal transactions
+        if transaction_key and from_separator and to_separator:
+            # imported here: the process pool it brings in is not needed by the other compares
+            from .edi_transactions import transaction_opcodes
+            opcodes, transactions = transaction_opcodes(from_lines, to_lines, from_separator, to_separator,
+                                                        key=transaction_key, engine=engine,
+                                                        workers=transaction_workers, deadline=deadline)
+            return opcodes
+        return diff_opcodes(from_lines, to_lines, engine=engine, deadline=deadline)
+
+    summary = compare_segments(from_lines, to_lines, output_path, fromdesc, todesc, engine=engine, budget=budget,
+                               started=started, diff=full_diff, separator=shared_separator(from_separator, to_separator),
+                               max_differences=max_differences, to_line_numbers=to_line_numbers, **report_options)
+    if transactions is not None:
+        summary["transactions"] = transactions
+    if loop_stats is not None:
+        summary["loops"] = loop_stats
+    return summary
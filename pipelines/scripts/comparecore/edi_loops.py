@@ -0,0 +1,134 @@
+""" Order insensitive comparison of repeated EDI loops (N1, PO1, REF, ...).
+
+Loops are declared as a comma separated list of loop start segment ids,
+each optionally followed by its member segment ids:
+  N1:N2|N3|N4|PER,PO1,REF:
+A loop is its start segment plus the following segments: the listed members
+when given ("REF:" lists none, so each REF is a loop of its own), otherwise
+everything up to the next start of the same loop or an envelope segment
+(ST, SE, CTT, ...). Consecutive loops of the same id form a block.
+
+Matching blocks of both sides are compared as multisets of loops by hash
+counting, in linear time. The "to" block is then rewritten in "from" order:
+loops present on both sides line up, and loops found on one side only are
+paired with each other so the real differences still show segment by segment.
+The rewritten side keeps the segment numbers it has in the file, which the
+report and the summary show instead of its position after reordering.
+"""
+import collections
+
+# segments that always end a loop block
+BOUNDARY_SEGMENTS = frozenset(["ISA", "IEA", "GS", "GE", "ST", "SE", "CTT", "AMT"])
+
+DEFAULT_LOOPS = "N1:N2|N3|N4|PER,PO1,REF:"
+
+
+def parse_loops(spec):
+    """ Parse "N1:N2|N3,PO1,REF:" into {"N1": {"N2", "N3"}, "PO1": None, "REF": set()}. """
+    loops = {}
+    for item in spec.split(","):
+        item = item.strip().upper()
+        if not item:
+            continue
+        start, colon, members = item.partition(":")
+        loops[start] = frozenset(member for member in members.split("|") if member) if colon else None
+    if not loops:
+        raise ValueError("Loop spec must name at least one loop start segment, e.g. N1,PO1")
+    return loops
+
+
+def find_blocks(segment_ids, loops):
+    """ Yield (loop id, [(start, end), ...]) for each block of consecutive loops. """
+    index = 0
+    count = len(segment_ids)
+    while index < count:
+        loop_id = segment_ids[index]
+        if loop_id not in loops:
+            index += 1
+            continue
+        members = loops[loop_id]
+        spans = []
+        while index < count and segment_ids[index] == loop_id:
+            start = index
+            index += 1
+            while index < count:
+                segment_id = segment_ids[index]
+                if segment_id == loop_id or segment_id in BOUNDARY_SEGMENTS:
+                    break
+                if members is not None and segment_id not in members:
+                    break
+                index += 1
+            spans.append((start, index))
+        yield loop_id, spans
+
+
+def _segment_ids(segments, element_separator):
+    return [segment.split(element_separator, 1)[0] for segment in segments]
+
+
+def align_loops(from_lines, to_lines, element_separator, loops):
+    """ Return to_lines with each configured loop block rewritten in from_lines order.
+
+    loops is a spec string or the result of parse_loops. Blocks are paired by
+    loop id and occurrence. Returns (aligned to_lines, stats, line numbers):
+    line numbers[k] is the 1 based number in to_lines of aligned segment k.
+    """
+    if isinstance(loops, str):
+        loops = parse_loops(loops)
+    stats = {"blocks": 0, "loops": 0, "matched": 0, "moved": 0, "only_from": 0, "only_to": 0}
+    from_blocks = collections.defaultdict(list)
+    for loop_id, spans in find_blocks(_segment_ids(from_lines, element_separator), loops):
+        from_blocks[loop_id].append(spans)
+
+    aligned = []
+    line_numbers = []
+    position = 0
+    seen = collections.Counter()
+    for loop_id, to_spans in find_blocks(_segment_ids(to_lines, element_separator), loops):
+        occurrence = seen[loop_id]
+        seen[loop_id] += 1
+        if occurrence >= len(from_blocks[loop_id]):
+            continue
+        from_spans = from_blocks[loop_id][occurrence]
+        stats["blocks"] += 1
+        stats["loops"] += len(from_spans)
+
+        # multiset of the "to" loops: loop contents -> indexes, in order
+        available = collections.defaultdict(collections.deque)
+        to_loops = [tuple(to_lines[start:end]) for start, end in to_spans]
+        for to_index, loop in enumerate(to_loops):
+            available[loop].append(to_index)
+
+        order = []
+        unmatched_from = []
+        for from_index, (start, end) in enumerate(from_spans):
+            matches = available.get(tuple(from_lines[start:end]))
+            if matches:
+                to_index = matches.popleft()
+                order.append(to_index)
+                stats["matched"] += 1
+                if to_index != from_index:
+                    stats["moved"] += 1
+            else:
+                order.append(None)
+                unmatched_from.append(from_index)
+        used = set(index for index in order if index is not None)
+        unmatched_to = collections.deque(index for index in range(len(to_loops)) if index not in used)
+        stats["only_from"] += len(unmatched_from)
+        stats["only_to"] += len(unmatched_to)
+        # pair one sided loops with each other, the rest of "to" goes last
+        order = [index if index is not None else (unmatched_to.popleft() if unmatched_to else None)
+                 for index in order]
+        order = [index for index in order if index is not None] + list(unmatched_to)
+
+        block_start, block_end = to_spans[0][0], to_spans[-1][1]
+        aligned.extend(to_lines[position:block_start])
+        line_numbers.extend(range(position + 1, block_start + 1))
+        for to_index in order:
+            aligned.extend(to_loops[to_index])
+            start, end = to_spans[to_index]
+            line_numbers.extend(range(start + 1, end + 1))
+        position = block_end
+    aligned.extend(to_lines[position:])
+    line_numbers.extend(range(position + 1, len(to_lines) + 1))
+    return aligned, stats, line_numbers
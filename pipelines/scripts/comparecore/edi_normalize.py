@@ -0,0 +1,125 @@
+""" Normalization of volatile EDI envelope fields before hashing and diffing.
+
+Rules are declared as a comma separated list (or a JSON list) of
+  SEGnn        mask element nn of segment SEG, e.g. ISA09
+  SEGnn:drop   remove element nn, e.g. GS04:drop
+  SEG:drop     remove the whole segment
+and compiled once into a per segment id table, so normalizing a segment that
+no rule mentions costs one dictionary lookup. Masked elements keep their
+position, which keeps the report columns aligned with the input.
+"""
+import hashlib
+import json
+import re
+
+from .edi_tokenizer import HEADER_PROBE_SIZE, detect_delimiters, iter_segments, iter_segments_from_text, read_delimiters
+
+# interchange / group / transaction control numbers and the ISA / GS dates and times
+DEFAULT_RULES = "ISA09,ISA10,ISA13,GS04,GS05,GS06,ST02,SE02,GE02,IEA02"
+
+MASK = "#"
+
+_RULE = re.compile(r"^(?P<segment>[A-Z][A-Z0-9]{1,2})(?P<element>\d{2})?(?::(?P<action>mask|drop))?$", re.IGNORECASE)
+
+
+def parse_rules(rules):
+    """ Parse a rule list into [(segment id, element index or None, action)]. """
+    if isinstance(rules, str):
+        rules = rules.strip()
+        rules = json.loads(rules) if rules.startswith("[") else rules.split(",")
+    parsed = []
+    for rule in rules:
+        rule = rule.strip()
+        if not rule:
+            continue
+        match = _RULE.match(rule)
+        if not match:
+            raise ValueError(f"Invalid normalization rule: {rule}")
+        element = match.group("element")
+        action = (match.group("action") or ("mask" if element else "")).lower() or None
+        if element is None and action != "drop":
+            raise ValueError(f"Normalization rule without an element must be SEG:drop: {rule}")
+        parsed.append((match.group("segment").upper(), int(element) if element else None, action))
+    return parsed
+
+
+class Normalizer:
+    """ Compiled normalization rules, applied to one segment at a time. """
+
+    def __init__(self, rules=DEFAULT_RULES, mask=MASK):
+        self.rules = parse_rules(rules)
+        self.mask = mask
+        # segment id -> None (drop the segment) or [(element index, action)], highest index first
+        self._table = {}
+        for segment_id, element, action in self.rules:
+            if element is None:
+                self._table[segment_id] = None
+            elif self._table.get(segment_id, []) is not None:
+                self._table.setdefault(segment_id, []).append((element, action))
+        for elements in self._table.values():
+            if elements:
+                # drops from the right so the indexes of the remaining elements hold
+                elements.sort(reverse=True)
+
+    @property
+    def spec(self):
+        """ Canonical form of the rules, used in cache keys. """
+        return ",".join(f"{segment_id}{'' if element is None else f'{element:02d}'}:{action}"
+                        for segment_id, element, action in sorted(self.rules))
+
+    def normalize(self, segment, element_separator):
+        """ Return the normalized segment, or None when it is dropped. """
+        segment_id = segment.split(element_separator, 1)[0]
+        if segment_id not in self._table:
+            return segment
+        elements_rules = self._table[segment_id]
+        if elements_rules is None:
+            return None
+        elements = segment.split(element_separator)
+        for index, action in elements_rules:
+            if index >= len(elements):
+                continue
+            if action == "drop":
+                del elements[index]
+            else:
+                elements[index] = self.mask
+        return element_separator.join(elements)
+
+    def iter_normalized(self, segments, element_separator):
+        """ Normalize a stream of segments. """
+        if not element_separator:
+            # plain text input, there are no elements to address
+            yield from segments
+            return
+        normalize = self.normalize
+        for segment in segments:
+            segment = normalize(segment, element_separator)
+            if segment is not None:
+                yield segment
+
+
+def iter_normalized_segments(file_path, normalizer, encoding="utf-8"):
+    """ Stream the normalized segments of an EDI file. """
+    delimiters = read_delimiters(file_path, encoding)
+    segments = iter_segments(file_path, encoding=encoding, delimiters=delimiters)
+    if normalizer is None:
+        return segments
+    return normalizer.iter_normalized(segments, delimiters.element)
+
+
+def iter_normalized_text_segments(content, normalizer):
+    """ Normalized segments of an in memory interchange. """
+    delimiters = detect_delimiters(content[:HEADER_PROBE_SIZE])
+    segments = iter_segments_from_text(content, delimiters=delimiters)
+    if normalizer is None:
+        return segments
+    return normalizer.iter_normalized(segments, delimiters.element)
+
+
+def hash_segments(segments):
+    """ sha256 of a segment sequence, independent of how the segments were delimited. """
+    digest = hashlib.sha256()
+    for segment in segments:
+        digest.update(segment.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
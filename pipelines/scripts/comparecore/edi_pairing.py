@@ -0,0 +1,128 @@
+""" Pair fromData / toData files by UUID with a single directory scan per side.
+
+Either side may also be a zip archive, whose members are listed from the
+central directory and paired without extracting them (see edi_archive).
+
+File names are matched against a regular expression with a named "uuid" group
+(and optionally a "prefix" group used to name the report). Names that do not
+fit the pattern, UUIDs found more than once and UUIDs present on only one side
+are reported in the manifest instead of being silently skipped.
+"""
+import json
+import os
+import re
+
+from .edi_archive import is_archive, list_members, member_path, open_archive
+
+DEFAULT_FROM_PATTERN = r"^(?P<prefix>[^_]+)_(?P<uuid>[^.]+)\.txt$"
+DEFAULT_TO_PATTERN = r"^(?P<prefix>[^_]+?)bla_(?P<uuid>[^.]+)\.txt$"
+
+
+def compile_pattern(pattern):
+    """ Compile a naming pattern and check it captures a uuid. """
+    regex = re.compile(pattern) if isinstance(pattern, str) else pattern
+    if "uuid" not in regex.groupindex:
+        raise ValueError(f"Naming pattern must contain a (?P<uuid>...) group: {regex.pattern}")
+    return regex
+
+
+def index_names(names, pattern):
+    """ Index file names by UUID.
+
+    names is an iterable of (name, path). Returns (index, unmatched) where
+    index maps uuid -> list of {"name", "path", "prefix"} entries.
+    """
+    regex = compile_pattern(pattern)
+    index = {}
+    unmatched = []
+    for name, path in names:
+        match = regex.match(name)
+        if not match:
+            unmatched.append(name)
+            continue
+        groups = match.groupdict()
+        prefix = groups.get("prefix") or os.path.splitext(name)[0]
+        index.setdefault(groups["uuid"], []).append({"name": name, "path": path, "prefix": prefix})
+    return index, unmatched
+
+
+def index_directory(directory, pattern):
+    """ Index the regular files of a directory by UUID using one os.scandir pass. """
+    with os.scandir(directory) as entries:
+        names = [(entry.name, entry.path) for entry in entries if entry.is_file()]
+    return index_names(names, pattern)
+
+
+def index_archive(archive_path, pattern):
+    """ Index the members of a zip archive by UUID, from its central directory. """
+    names = [(name, member_path(archive_path, member))
+             for name, member in list_members(open_archive(archive_path))]
+    return index_names(names, pattern)
+
+
+def index_source(path, pattern):
+    """ Index a directory or a zip archive by UUID. """
+    if is_archive(path):
+        return index_archive(path, pattern)
+    return index_directory(path, pattern)
+
+
+def pair_indexes(from_index, to_index, from_unmatched=(), to_unmatched=()):
+    """ Build the pairing manifest from two UUID indexes. """
+    manifest = {
+        "pairs": [],
+        "orphans_from": [],
+        "orphans_to": [],
+        "duplicates": {"from": {}, "to": {}},
+        "unmatched": {"from": sorted(from_unmatched), "to": sorted(to_unmatched)},
+    }
+    for side, index in (("from", from_index), ("to", to_index)):
+        for uuid, entries in index.items():
+            if len(entries) > 1:
+                manifest["duplicates"][side][uuid] = sorted(entry["name"] for entry in entries)
+
+    for uuid in sorted(from_index):
+        from_entries = from_index[uuid]
+        to_entries = to_index.get(uuid)
+        if not to_entries:
+            manifest["orphans_from"].extend(sorted(entry["name"] for entry in from_entries))
+            continue
+        if len(from_entries) > 1 or len(to_entries) > 1:
+            # ambiguous, listed under duplicates
+            continue
+        from_entry, to_entry = from_entries[0], to_entries[0]
+        manifest["pairs"].append({
+            "uuid": uuid,
+            "prefix": from_entry["prefix"],
+            "from_file": from_entry["path"],
+            "to_file": to_entry["path"],
+        })
+    for uuid in sorted(set(to_index) - set(from_index)):
+        manifest["orphans_to"].extend(sorted(entry["name"] for entry in to_index[uuid]))
+    return manifest
+
+
+def build_manifest(from_dir, to_dir, from_pattern=DEFAULT_FROM_PATTERN, to_pattern=DEFAULT_TO_PATTERN):
+    """ Scan both directories (or archives) once and return the pairing manifest. """
+    from_index, from_unmatched = index_source(from_dir, from_pattern)
+    to_index, to_unmatched = index_source(to_dir, to_pattern)
+    return pair_indexes(from_index, to_index, from_unmatched, to_unmatched)
+
+
+def write_manifest(manifest, manifest_path):
+    """ Write the pairing manifest as JSON. """
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def print_manifest_summary(manifest):
+    print(f"Matched pairs: {len(manifest['pairs'])}")
+    if manifest["orphans_from"]:
+        print(f"No matching toData file for: {', '.join(manifest['orphans_from'])}")
+    if manifest["orphans_to"]:
+        print(f"No matching fromData file for: {', '.join(manifest['orphans_to'])}")
+    for side in ("from", "to"):
+        for uuid, names in manifest["duplicates"][side].items():
+            print(f"Duplicate UUID '{uuid}' in {side}Data: {', '.join(names)}")
+        if manifest["unmatched"][side]:
+            print(f"Names not matching the {side}Data pattern: {', '.join(manifest['unmatched'][side])}")
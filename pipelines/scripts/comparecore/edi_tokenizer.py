@@ -0,0 +1,163 @@
+import mmap
+import os
+from collections import namedtuple
+
+from .edi_archive import is_member_path, open_input
+
+ISA_ELEMENT_COUNT = 16
+HEADER_PROBE_SIZE = 512
+
+# bytes read at a time from inputs that cannot be memory mapped (zip members)
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+Delimiters = namedtuple("Delimiters", ["segment", "element", "sub_element"])
+
+# Used when the input does not start with an ISA header (e.g. plain text files).
+LINE_DELIMITERS = Delimiters(segment="\n", element=None, sub_element=None)
+
+
+def detect_delimiters(header):
+    """ Read the segment, element and sub element separators from an ISA header.
+
+    Returns LINE_DELIMITERS when the text does not start with an ISA segment so
+    callers can fall back to comparing physical lines.
+    """
+    header = header.lstrip("\ufeff \t\r\n")
+    if not header.startswith("ISA") or len(header) < 4:
+        return LINE_DELIMITERS
+
+    element = header[3]
+
+    # Standard case: walk the 16 ISA element separators, ISA16 is the sub
+    # element separator and the next character terminates the segment.
+    pos = 3
+    for _ in range(ISA_ELEMENT_COUNT - 1):
+        pos = header.find(element, pos + 1)
+        if pos == -1:
+            break
+    else:
+        sub_element = header[pos + 1:pos + 2]
+        segment = header[pos + 2:pos + 3]
+        if sub_element and segment and not segment.isalnum():
+            return Delimiters(segment=segment, element=element, sub_element=sub_element)
+
+    # Truncated or non standard ISA: the segment ends at the first "~",
+    # otherwise at the end of the line.
+    end = header.find("~")
+    if end == -1:
+        return Delimiters(segment="\n", element=element, sub_element=None)
+    last_element = header[:end].rsplit(element, 1)[-1]
+    sub_element = last_element if len(last_element) == 1 and not last_element.isalnum() else None
+    return Delimiters(segment="~", element=element, sub_element=sub_element)
+
+
+def read_delimiters(file_path, encoding="utf-8"):
+    """ Detect the delimiters of an EDI file (or archive member) from its first bytes. """
+    with open_input(file_path) as file:
+        header = file.read(HEADER_PROBE_SIZE)
+    return detect_delimiters(header.decode(encoding, errors="replace"))
+
+
+def _clean_segment(segment):
+    return segment.strip("\ufeff\r\n\t ")
+
+
+def iter_segments_from_text(content, delimiters=None):
+    """ Yield EDI segments from an in memory string. """
+    if delimiters is None:
+        delimiters = detect_delimiters(content[:HEADER_PROBE_SIZE])
+    if delimiters is LINE_DELIMITERS:
+        for line in content.splitlines():
+            yield line
+        return
+
+    terminator = delimiters.segment
+    pos = 0
+    size = len(content)
+    while pos < size:
+        end = content.find(terminator, pos)
+        if end == -1:
+            end = size
+        segment = _clean_segment(content[pos:end])
+        if segment:
+            yield segment
+        pos = end + len(terminator)
+
+
+def iter_segments(file_path, encoding="utf-8", delimiters=None):
+    """ Yield EDI segments from a file without loading it into memory.
+
+    The file is memory mapped and scanned for the segment terminator read from
+    the ISA header, so an interchange written on a single physical line is
+    still split into one item per segment. Archive members
+    ("<archive>!/<member>", see edi_archive) are streamed instead.
+    """
+    if is_member_path(file_path):
+        with open_input(file_path) as stream:
+            yield from iter_segments_from_stream(stream, encoding=encoding, delimiters=delimiters)
+        return
+
+    if os.path.getsize(file_path) == 0:
+        return
+
+    with open(file_path, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if delimiters is None:
+            delimiters = detect_delimiters(data[:HEADER_PROBE_SIZE].decode(encoding, errors="replace"))
+
+        terminator = delimiters.segment.encode(encoding)
+        pos = 0
+        size = len(data)
+        while pos < size:
+            end = data.find(terminator, pos)
+            if end == -1:
+                end = size
+            raw = data[pos:end]
+            pos = end + len(terminator)
+            if delimiters is LINE_DELIMITERS:
+                # keep physical lines as they are, including blank ones
+                yield raw.rstrip(b"\r").decode(encoding, errors="replace")
+                continue
+            segment = _clean_segment(raw.decode(encoding, errors="replace"))
+            if segment:
+                yield segment
+
+
+def iter_segments_from_stream(stream, encoding="utf-8", delimiters=None, chunk_size=STREAM_CHUNK_SIZE):
+    """ Yield EDI segments from a binary stream read chunk_size bytes at a time.
+
+    Splits like iter_segments, for inputs that cannot be memory mapped such
+    as zip members; only the segment being split is held in memory.
+    """
+    buffer = stream.read(max(chunk_size, HEADER_PROBE_SIZE))
+    if delimiters is None:
+        delimiters = detect_delimiters(buffer[:HEADER_PROBE_SIZE].decode(encoding, errors="replace"))
+
+    terminator = delimiters.segment.encode(encoding)
+    pos = scan = 0
+    while True:
+        end = buffer.find(terminator, scan)
+        if end == -1:
+            chunk = stream.read(chunk_size)
+            if chunk:
+                # keep the unfinished segment, a terminator may straddle the chunks
+                scan = max(0, len(buffer) - pos - len(terminator) + 1)
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            if pos >= len(buffer):
+                return
+            end = len(buffer)
+        raw = buffer[pos:end]
+        pos = scan = end + len(terminator)
+        if delimiters is LINE_DELIMITERS:
+            yield raw.rstrip(b"\r").decode(encoding, errors="replace")
+            continue
+        segment = _clean_segment(raw.decode(encoding, errors="replace"))
+        if segment:
+            yield segment
+
+
+def read_segments(file_path, encoding="utf-8"):
+    """ Return the segments of an EDI file as a list (for difflib style APIs). """
+    return list(iter_segments(file_path, encoding=encoding))
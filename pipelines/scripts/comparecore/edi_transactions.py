@@ -0,0 +1,158 @@
+""" Transaction level (ST ... SE) comparison of EDI interchanges.
+
+Each side is split into units: one per transaction set and one per envelope
+segment outside a transaction (ISA, GS, GE, IEA). Units are keyed (a
+transaction by a configurable element such as BEG03 or ST02, an envelope
+segment by its id and occurrence) and the two key sequences are aligned with
+the diff engine. Only matched transactions are diffed segment by segment,
+each on its own, optionally in a process pool, so one inserted transaction
+costs one extra unit instead of a realignment of the whole file. Unmatched
+transactions come out as removed or added.
+
+The result is an opcode list over the original segment sequences, so the
+usual report and summary code works on it unchanged.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+from .diff_engine import DEFAULT_ENGINE, diff_opcodes
+
+# first of these elements found in a transaction is its key
+DEFAULT_TRANSACTION_KEY = "ST02"
+
+# matched transactions handed to a worker process at a time
+TRANSACTION_CHUNK_SIZE = 16
+
+
+def parse_key(spec):
+    """ Parse "BEG03,ST02" into [("BEG", 3), ("ST", 2)]. """
+    fields = []
+    for field in spec.split(","):
+        field = field.strip().upper()
+        if not field:
+            continue
+        segment_id, element = field[:-2], field[-2:]
+        if not segment_id or not element.isdigit():
+            raise ValueError(f"Invalid transaction key: {field} (expected e.g. BEG03)")
+        fields.append((segment_id, int(element)))
+    if not fields:
+        raise ValueError("Transaction key must name at least one element, e.g. ST02")
+    return fields
+
+
+def _transaction_key(segments, element_separator, key_fields):
+    for segment_id, element in key_fields:
+        for segment in segments:
+            elements = segment.split(element_separator)
+            if elements[0] == segment_id and element < len(elements):
+                return elements[element]
+    return None
+
+
+def split_units(segments, element_separator, key_fields):
+    """ Split segments into [(key, start, end)] transaction and envelope units.
+
+    Keys repeat when a key value occurs more than once; they are numbered by
+    occurrence so each unit key is unique within its side.
+    """
+    units = []
+    seen = {}
+    start = None
+
+    def add(kind, key, unit_start, unit_end):
+        occurrence = seen.get((kind, key), 0)
+        seen[(kind, key)] = occurrence + 1
+        units.append(((kind, key, occurrence), unit_start, unit_end))
+
+    for index, segment in enumerate(segments):
+        segment_id = segment.split(element_separator, 1)[0]
+        if start is None:
+            if segment_id == "ST":
+                start = index
+            else:
+                add("envelope", segment_id, index, index + 1)
+        if start is not None and segment_id == "SE":
+            add("transaction", _transaction_key(segments[start:index + 1], element_separator, key_fields),
+                start, index + 1)
+            start = None
+    if start is not None:
+        # ST without SE: keep the rest as one transaction
+        add("transaction", _transaction_key(segments[start:], element_separator, key_fields),
+            start, len(segments))
+    return units
+
+
+def _unit_opcodes(task):
+    from_unit, to_unit, engine, deadline = task
+    return diff_opcodes(from_unit, to_unit, engine=engine, deadline=deadline)
+
+
+def _append(opcodes, tag, i1, i2, j1, j2):
+    if i1 == i2 and j1 == j2:
+        return
+    if tag == "equal" and opcodes and opcodes[-1][0] == "equal":
+        _, eq_i1, _, eq_j1, _ = opcodes.pop()
+        i1, j1 = eq_i1, eq_j1
+    opcodes.append((tag, i1, i2, j1, j2))
+
+
+def transaction_opcodes(from_lines, to_lines, from_separator, to_separator,
+                        key=DEFAULT_TRANSACTION_KEY, engine=DEFAULT_ENGINE, workers=1, deadline=None):
+    """ Diff two interchanges transaction by transaction.
+
+    Returns (opcodes, stats) where opcodes cover the full segment sequences
+    and stats counts matched, changed, added and removed transactions.
+    Raises diff_engine.DiffTimeout when deadline passes.
+    """
+    key_fields = parse_key(key) if isinstance(key, str) else key
+    from_units = split_units(from_lines, from_separator, key_fields)
+    to_units = split_units(to_lines, to_separator, key_fields)
+    unit_ops = diff_opcodes([unit[0] for unit in from_units], [unit[0] for unit in to_units], engine=engine,
+                            deadline=deadline)
+
+    stats = {"from": 0, "to": 0, "matched": 0, "changed": 0, "added": 0, "removed": 0}
+    stats["from"] = sum(1 for unit in from_units if unit[0][0] == "transaction")
+    stats["to"] = sum(1 for unit in to_units if unit[0][0] == "transaction")
+
+    # matched units whose segments differ are diffed on their own
+    pending = []
+    for tag, i1, i2, j1, j2 in unit_ops:
+        if tag != "equal":
+            continue
+        for from_unit, to_unit in zip(from_units[i1:i2], to_units[j1:j2]):
+            from_segments = from_lines[from_unit[1]:from_unit[2]]
+            to_segments = to_lines[to_unit[1]:to_unit[2]]
+            if from_unit[0][0] == "transaction":
+                stats["matched"] += 1
+            if from_segments != to_segments:
+                pending.append((from_unit, to_unit, from_segments, to_segments))
+    tasks = [(from_segments, to_segments, engine, deadline) for _, _, from_segments, to_segments in pending]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            sub_opcodes = list(executor.map(_unit_opcodes, tasks, chunksize=TRANSACTION_CHUNK_SIZE))
+    else:
+        sub_opcodes = [_unit_opcodes(task) for task in tasks]
+    diffs = {(from_unit[1], to_unit[1]): ops for (from_unit, to_unit, _, _), ops in zip(pending, sub_opcodes)}
+
+    opcodes = []
+    for tag, i1, i2, j1, j2 in unit_ops:
+        if tag == "equal":
+            for from_unit, to_unit in zip(from_units[i1:i2], to_units[j1:j2]):
+                ops = diffs.get((from_unit[1], to_unit[1]))
+                if ops is None:
+                    _append(opcodes, "equal", from_unit[1], from_unit[2], to_unit[1], to_unit[2])
+                    continue
+                if from_unit[0][0] == "transaction":
+                    stats["changed"] += 1
+                for op, a1, a2, b1, b2 in ops:
+                    _append(opcodes, op, from_unit[1] + a1, from_unit[1] + a2, to_unit[1] + b1, to_unit[1] + b2)
+            continue
+        # unmatched units: removed first, then added
+        from_start = from_units[i1][1] if i1 < i2 else (from_units[i1 - 1][2] if i1 else 0)
+        from_end = from_units[i2 - 1][2] if i1 < i2 else from_start
+        to_start = to_units[j1][1] if j1 < j2 else (to_units[j1 - 1][2] if j1 else 0)
+        to_end = to_units[j2 - 1][2] if j1 < j2 else to_start
+        _append(opcodes, "delete", from_start, from_end, to_start, to_start)
+        _append(opcodes, "insert", from_end, from_end, to_start, to_end)
+        stats["removed"] += sum(1 for unit in from_units[i1:i2] if unit[0][0] == "transaction")
+        stats["added"] += sum(1 for unit in to_units[j1:j2] if unit[0][0] == "transaction")
+    return opcodes, stats
@@ -0,0 +1,172 @@
+""" Fan-out of a compare batch over a storage queue.
+
+In a batch run one request lists and compares every pair, bound by one
+instance's CPU and the HTTP timeout. In a fan-out run the HTTP trigger only
+lists the work items (blob pairs, archive member pairs), records the run
+and enqueues one message per shard of them; queue triggered instances
+compare the shards, so a large batch scales out across instances.
+
+Each shard writes its result records to runs/<run id>/shards/ in the
+results container, then sets its bit in runs/<run id>/progress.bin, one bit
+per shard, with a conditional write: If-Match on the etag it read, read
+again and retried when another shard wrote in between. Only the write that
+sets the last bit sees the run go from incomplete to complete, so exactly
+one instance aggregates the shards, with the records the listing already
+settled (unmatched blobs), into runs/<run id>/results.jsonl and
+summary.json: the completion record, the same files a batch run writes at
+the container root. No shard lists the others. Shard results are written
+under a fixed name and a retried message finds its bit already set, so
+nothing counts twice; a retry only aggregates when the run is complete but
+has no summary.json, i.e. the instance completing it failed before writing
+it (the aggregation is idempotent).
+
+This module only builds the names, messages and records; the function
+apps do the storage I/O with their own (sync or async) clients.
+"""
+import datetime
+import json
+import os
+import time
+import uuid
+
+from .diff_summary import RESULTS_FILE_NAME, SUMMARY_FILE_NAME, batch_summary
+from .edi_archive import member_path
+
+RUNS_PREFIX = "runs/"
+RUN_FILE_NAME = "run.json"
+PROGRESS_FILE_NAME = "progress.bin"
+SHARDS_DIRECTORY = "shards/"
+
+# work items per queue message
+DEFAULT_SHARD_SIZE = 1
+# a queue message holds 64 KiB, base64 encoded by the Functions host
+MAX_MESSAGE_BYTES = 45 * 1024
+# messages sent at once while enqueueing a run
+QUEUE_SEND_CONCURRENCY = 16
+
+
+def fan_out_enabled():
+    """ True when the FanOut app setting turns fan-out runs on. """
+    return os.environ.get("FanOut", "false").lower() in ("1", "true", "yes")
+
+
+def run_prefix(run_id):
+    return f"{RUNS_PREFIX}{run_id}/"
+
+
+def run_blob_name(run_id):
+    return run_prefix(run_id) + RUN_FILE_NAME
+
+
+def progress_blob_name(run_id):
+    return run_prefix(run_id) + PROGRESS_FILE_NAME
+
+
+def shards_prefix(run_id):
+    return run_prefix(run_id) + SHARDS_DIRECTORY
+
+
+def shard_blob_name(run_id, shard):
+    return f"{shards_prefix(run_id)}{shard:06d}.jsonl"
+
+
+def results_blob_name(run_id):
+    return run_prefix(run_id) + RESULTS_FILE_NAME
+
+
+def summary_blob_name(run_id):
+    return run_prefix(run_id) + SUMMARY_FILE_NAME
+
+
+def _shards(items, shard_size, max_message_bytes):
+    # by count, and smaller where the items would not fit one message
+    shard = []
+    size = 0
+    for item in items:
+        item_size = len(json.dumps(item)) + 2
+        if shard and (len(shard) >= shard_size or size + item_size > max_message_bytes):
+            yield shard
+            shard = []
+            size = 0
+        shard.append(item)
+        size += item_size
+    if shard:
+        yield shard
+
+
+def new_run(kind, items, records=(), shard_size=DEFAULT_SHARD_SIZE, options=None,
+            max_message_bytes=MAX_MESSAGE_BYTES):
+    """ Split the work items of a batch into shards. Returns (run record, queue messages).
+
+    items are JSON serializable work items, records the result records the
+    listing already settled; both end up in the completion record. options
+    (compare settings) travel in every message, so a shard needs nothing
+    but its message.
+    """
+    run_id = f"{datetime.datetime.now(datetime.timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    shards = list(_shards(items, max(1, shard_size), max_message_bytes))
+    messages = [json.dumps({"run_id": run_id, "kind": kind, "shard": index, "shards": len(shards), "items": shard,
+                            "options": options or {}})
+                for index, shard in enumerate(shards)]
+    run = {
+        "run_id": run_id,
+        "kind": kind,
+        "started": time.time(),
+        "items": len(items),
+        "shards": len(messages),
+        "options": options or {},
+        "records": list(records),
+        "summary": summary_blob_name(run_id),
+    }
+    return run, messages
+
+
+def parse_message(body):
+    """ Shard message from a queue message body (bytes or str). """
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    return json.loads(body)
+
+
+def failed_shard_records(message, error):
+    """ Error records for every work item of a shard that could not be processed (e.g. a poison message). """
+    records = []
+    for item in message["items"]:
+        name = member_path(item["archive"], item["from_file"]) if "archive" in item else item.get("from_blob")
+        records.append({"from_blob": name, "status": "error", "error": error})
+    return records
+
+
+def jsonl(records):
+    return "".join(json.dumps(record, default=str) + "\n" for record in records)
+
+
+def new_progress(shards):
+    """ Content of progress.bin for a run of shards shards, none done. """
+    return bytes((shards + 7) // 8)
+
+
+def mark_shard(progress, shard):
+    """ (progress with the bit of shard set, False when it was set already). """
+    index, bit = divmod(shard, 8)
+    if (progress[index] >> bit) & 1:
+        return progress, False
+    progress = bytearray(progress)
+    progress[index] |= 1 << bit
+    return bytes(progress), True
+
+
+def is_complete(shards, progress):
+    """ True when every one of shards shards has set its bit in progress. """
+    return sum(bin(byte).count("1") for byte in progress) >= shards
+
+
+def aggregate(run, shard_texts):
+    """ (results, summary) of a run from the JSON lines texts of all its shards. """
+    results = list(run["records"])
+    for text in shard_texts:
+        results.extend(json.loads(line) for line in text.splitlines() if line.strip())
+    summary = batch_summary(results, time.time() - run["started"])
+    summary["run_id"] = run["run_id"]
+    summary["shards"] = run["shards"]
+    return results, summary
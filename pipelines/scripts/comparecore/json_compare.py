@@ -0,0 +1,61 @@
+""" Compare of one JSON pair, shared by the Streamlit app and the JsonCompare function.
+
+load_json parses both sides. compare_json_streams runs the whole document
+compare, or for NDJSON and large top level arrays the element by element
+compare of json_stream, and returns the HTML report as chunks together
+with the summary of the differences.
+"""
+import json
+
+from .diff_summary import DEFAULT_MAX_DIFFERENCES, JsonDiffSummary, summarize_json_diff
+from .json_diff import EPSILON, diff_json
+from .json_report import iter_json_report
+from .json_stream import STREAM_THRESHOLD_BYTES, iter_array_items, iter_ndjson, iter_stream_report, starts_with_array
+
+
+def load_json(file1, file2):
+    """ Parse two JSON files; invalid JSON is raised as ValueError. """
+    try:
+        return json.load(file1), json.load(file2)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON file: {str(e)}")
+
+
+def compare_json_colored(file1, file2):
+    """ Colored HTML comparison of two JSON files, as one string. """
+    data1, data2 = load_json(file1, file2)
+    return "".join(iter_json_report(data1, data2))
+
+
+def should_stream(stream1, stream2, input_bytes, ndjson=False, stream_bytes=STREAM_THRESHOLD_BYTES):
+    """ True for NDJSON and for two top level arrays of at least stream_bytes together.
+
+    stream1 and stream2 are buffered binary streams (see json_stream.open_chunks);
+    nothing is consumed.
+    """
+    return ndjson or (input_bytes >= stream_bytes and starts_with_array(stream1) and starts_with_array(stream2))
+
+
+def compare_json_streams(stream1, stream2, streamed=False, ndjson=False, max_differences=DEFAULT_MAX_DIFFERENCES,
+                         collapse_identical=False, align_arrays=False, key_paths=(), tolerance=EPSILON,
+                         absolute_tolerance=None):
+    """ Compare two JSON binary streams. Returns (report chunks, summary).
+
+    With streamed the top level arrays (the records with ndjson) are read
+    and compared one element at a time, in bounded memory; otherwise both
+    documents are loaded. summary is a function returning the diff summary
+    (diff_summary.summarize_json_diff), to be called once the report has
+    been consumed.
+    """
+    options = dict(collapse_identical=collapse_identical, align_arrays=align_arrays, key_paths=key_paths,
+                   tolerance=tolerance, absolute_tolerance=absolute_tolerance)
+    if streamed:
+        read_items = iter_ndjson if ndjson else iter_array_items
+        summary = JsonDiffSummary(max_differences)
+        return iter_stream_report(read_items(stream1), read_items(stream2), summary.add, **options), summary.summary
+
+    data1, data2 = load_json(stream1, stream2)
+    difference = list(diff_json(data1, data2, tolerance, absolute_tolerance, align_arrays=align_arrays,
+                                key_paths=key_paths))
+    return (iter_json_report(data1, data2, difference, **options),
+            lambda: summarize_json_diff(difference, max_differences))
@@ -0,0 +1,282 @@
+""" Helpers shared by the JSON compare (Streamlit app and JsonCompare function).
+
+dictdiffer reports each difference with the path of the node it concerns,
+as a dotted string ("a.b") or, when a key is not a plain string, a list
+(["a", 0]). diff_path_index turns the whole difference list into one set
+of path prefixes, built once, so the report renderer can tell in O(1)
+whether a subtree holds any difference at all.
+
+diff_json produces dictdiffer's difference records without walking the
+subtrees that are the same on both sides, recognised by native equality:
+== runs in C and stops at the first difference, which beats hashing every
+container of both documents in Python by two orders of magnitude on
+mostly identical payloads.
+
+dictdiffer compares arrays index by index, so one insertion at the front
+turns every later element into a change. align_lists pairs the elements of
+two arrays instead: by a key path such as "id" or "lineNumber" when one
+identifies every element, else by content (a hashed LCS through
+diff_engine). diff_json and the report take it up with align_arrays.
+
+Arrays of plain numbers (prices, quantities, readings) are compared in one
+numpy pass with the same relative / absolute tolerance as dictdiffer's
+are_different, so only the differing positions reach Python.
+
+dictdiffer itself is not imported: EPSILON and are_different are its
+number comparison, kept here so loading the JSON compare pulls in no
+third party package.
+"""
+import json
+import math
+import sys
+
+from .backends import numpy
+from .diff_engine import diff_opcodes
+
+# below this many elements the element by element compare beats building numpy arrays
+NUMPY_ARRAY_THRESHOLD = 64
+# numbers past this are not all exact as float64
+_EXACT_FLOAT_LIMIT = 2 ** 53
+
+# dictdiffer's default relative tolerance
+EPSILON = sys.float_info.epsilon
+
+_canonical = json.JSONEncoder(sort_keys=True).encode
+
+
+def are_different(first, second, tolerance, absolute_tolerance=None):
+    """ dictdiffer.utils.are_different: numbers within tolerance (math.isclose) and two NaNs are not different. """
+    if first == second:
+        return False
+    first_is_nan, second_is_nan = bool(first != first), bool(second != second)
+    if first_is_nan or second_is_nan:
+        return not (first_is_nan and second_is_nan)
+    if isinstance(first, (int, float)) and isinstance(second, (int, float)):
+        return not math.isclose(first, second, rel_tol=tolerance or 0, abs_tol=absolute_tolerance or 0)
+    return True
+
+
+def diff_path(d_path):
+    """ dictdiffer path as a tuple of keys / indexes. """
+    if isinstance(d_path, str):
+        return tuple(d_path.split(".")) if d_path else ()
+    return tuple(d_path)
+
+
+def diff_path_index(difference):
+    """ Set of every path, and every prefix of a path, named by a difference.
+
+    A subtree whose path is not in the set is identical on both sides.
+    """
+    index = {()}
+    for _, d_path, *_ in difference:
+        path = diff_path(d_path)
+        for end in range(1, len(path) + 1):
+            index.add(path[:end])
+    return index
+
+
+def _dotted(node):
+    # dictdiffer's path notation
+    if all(isinstance(key, str) and "." not in key for key in node):
+        return ".".join(node)
+    return list(node)
+
+
+def _same(value1, value2):
+    if isinstance(value1, (dict, list)) and isinstance(value2, (dict, list)) and type(value1) is not type(value2):
+        return False
+    try:
+        return value1 == value2
+    except RecursionError:
+        # nested too deep for the C comparison, walk it instead
+        return False
+
+
+_MISSING = object()
+
+
+def _key_value(element, key_path):
+    value = element
+    for key in key_path:
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    return _MISSING if isinstance(value, (dict, list)) else value
+
+
+def _keyed(items, key_path):
+    """ Key values of items under key_path, or None unless every item has a distinct one. """
+    values = [_key_value(item, key_path) for item in items]
+    if _MISSING in values or len(set(values)) != len(values):
+        return None
+    return values
+
+
+def parse_key_paths(text):
+    """ "id, header.lineNumber" -> [("id",), ("header", "lineNumber")] """
+    return [tuple(part.strip().split(".")) for part in text.split(",") if part.strip()]
+
+
+def numeric_array(values):
+    """ values as a 1-d numpy array when it holds numbers only (no bool, str, null or containers), else None. """
+    if len(values) < NUMPY_ARRAY_THRESHOLD:
+        return None
+    np = numpy()
+    if np is None:
+        # numpy is optional, numeric arrays are then compared element by element
+        return None
+    # cheap rejection of the common non numeric arrays before converting
+    for value in (values[0], values[-1]):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+    try:
+        array = np.asarray(values)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if array.ndim != 1 or array.dtype.kind not in "if":
+        return None
+    finite = array[np.isfinite(array)] if array.dtype.kind == "f" else array
+    if finite.size and (finite.max() > _EXACT_FLOAT_LIMIT or finite.min() < -_EXACT_FLOAT_LIMIT):
+        # large integers may have been rounded on the way into the array
+        return None
+    return array
+
+
+def format_numbers(values):
+    """ json.dumps of every number in values, from one json.dumps of the list. """
+    # numbers never contain ", "
+    return json.dumps(values)[1:-1].split(", ") if values else []
+
+
+def numeric_arrays(list1, list2):
+    """ (array1, array2) when both lists are numeric arrays, else None. """
+    array1 = numeric_array(list1)
+    array2 = numeric_array(list2) if array1 is not None else None
+    return None if array2 is None else (array1, array2)
+
+
+def numeric_changes(array1, array2, tolerance=EPSILON, absolute_tolerance=None):
+    """ Positions where two equally long numeric arrays differ, as are_different decides. """
+    np = numpy()
+    candidates = np.flatnonzero(array1 != array2)
+    if candidates.size:
+        values1 = array1[candidates].astype(np.float64)
+        values2 = array2[candidates].astype(np.float64)
+        with np.errstate(invalid="ignore", over="ignore"):
+            # two NaNs are not different, numbers within tolerance neither (math.isclose)
+            same = np.isnan(values1) & np.isnan(values2)
+            bound = np.maximum((tolerance or 0) * np.maximum(np.abs(values1), np.abs(values2)), absolute_tolerance or 0)
+            same |= np.isfinite(values1) & np.isfinite(values2) & (np.abs(values1 - values2) <= bound)
+        candidates = candidates[~same]
+    return candidates.tolist()
+
+
+def align_lists(list1, list2, key_paths=()):
+    """ Pair up the elements of two arrays, as (i, j) steps in document order.
+
+    i is None for an element only in list2, j is None for one only in
+    list1. Elements are matched by the first of key_paths (tuples of keys)
+    whose value is present and distinct in every element of both arrays;
+    otherwise by an LCS over their canonical JSON, where the elements left
+    over in a changed run are paired by position to be compared in detail.
+    """
+    keyed = False
+    for key_path in key_paths:
+        tokens1 = _keyed(list1, key_path)
+        tokens2 = _keyed(list2, key_path) if tokens1 is not None else None
+        if tokens2 is not None:
+            keyed = True
+            break
+    else:
+        if numeric_arrays(list1, list2) is not None:
+            # the same canonical JSON, in one call per array
+            tokens1, tokens2 = format_numbers(list1), format_numbers(list2)
+        else:
+            tokens1 = [_canonical(item) for item in list1]
+            tokens2 = [_canonical(item) for item in list2]
+
+    steps = []
+    for tag, i1, i2, j1, j2 in diff_opcodes(tokens1, tokens2):
+        # elements with different keys are never the same element
+        paired = 0 if keyed and tag == "replace" else min(i2 - i1, j2 - j1)
+        steps.extend(zip(range(i1, i1 + paired), range(j1, j1 + paired)))
+        steps.extend((i, None) for i in range(i1 + paired, i2))
+        steps.extend((None, j) for j in range(j1 + paired, j2))
+    return steps
+
+
+def diff_json(first, second, tolerance=EPSILON, absolute_tolerance=None, align_arrays=False, key_paths=()):
+    """ dictdiffer.diff of two parsed JSON documents, pruned at identical subtrees.
+
+    Yields the same ("change" | "add" | "remove", path, detail) records in
+    the same order as dictdiffer.diff, without recursion and without deep
+    copying the reported values (they are the documents' own objects).
+    Identical subtrees, found by ==, are skipped.
+
+    With align_arrays, differing arrays are paired up by align_lists (with
+    key_paths) instead of by index: a change inside a pair is reported at
+    the element's index in first, added elements at their index in second
+    and removed ones at their index in first.
+
+    tolerance (relative) and absolute_tolerance apply to numbers, as in
+    dictdiffer; numeric arrays are compared with them in one numpy pass.
+    """
+    if _same(first, second):
+        return
+    # LIFO work list of ("node", value1, value2, path) and ("emit", record)
+    stack = [("node", first, second, [])]
+    while stack:
+        item = stack.pop()
+        if item[0] == "emit":
+            yield item[1]
+            continue
+        _, value1, value2, node = item
+        numeric = None
+        if isinstance(value1, dict) and isinstance(value2, dict):
+            intersection = [(key, key) for key in value1 if key in value2]
+            addition = [key for key in value2 if key not in value1]
+            deletion = [key for key in value1 if key not in value2]
+        elif isinstance(value1, list) and isinstance(value2, list):
+            numeric = numeric_arrays(value1, value2)
+            if align_arrays:
+                steps = align_lists(value1, value2, key_paths)
+                intersection = [(i, j) for i, j in steps if i is not None and j is not None]
+                addition = [j for i, j in steps if i is None]
+                deletion = [i for i, j in reversed(steps) if j is None]
+                if numeric is not None:
+                    np = numpy()
+                    pairs = np.array(intersection, dtype=np.intp).reshape(-1, 2)
+                    index1, index2 = pairs[:, 0], pairs[:, 1]
+            else:
+                common = min(len(value1), len(value2))
+                intersection = zip(range(common), range(common))
+                addition = range(common, len(value2))
+                deletion = reversed(range(common, len(value1)))
+                if numeric is not None:
+                    index1 = index2 = numpy().arange(common)
+            if numeric is not None:
+                # every pair is two numbers, compared in one vectorized pass
+                changed = numeric_changes(numeric[0][index1], numeric[1][index2], tolerance, absolute_tolerance)
+                intersection = [(int(index1[k]), int(index2[k])) for k in changed]
+        else:
+            if are_different(value1, value2, tolerance, absolute_tolerance):
+                yield "change", _dotted(node), (value1, value2)
+            continue
+
+        parent = _dotted(node)
+        deletion = [(key, value1[key]) for key in deletion]
+        if deletion:
+            stack.append(("emit", ("remove", parent, deletion)))
+        addition = [(key, value2[key]) for key in addition]
+        if addition:
+            stack.append(("emit", ("add", parent, addition)))
+        if numeric is not None:
+            for i, j in reversed(intersection):
+                stack.append(("emit", ("change", _dotted(node + [i]), (value1[i], value2[j]))))
+            continue
+        for key1, key2 in reversed(list(intersection)):
+            child1 = value1[key1]
+            child2 = value2[key2]
+            if not _same(child1, child2):
+                stack.append(("node", child1, child2, node + [key1]))
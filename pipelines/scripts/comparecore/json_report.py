@@ -0,0 +1,507 @@
+""" Color coded side by side HTML report of two JSON documents.
+
+Shared by the Streamlit app (comparejson.py) and the JsonCompare function.
+The renderers walk the documents with an explicit stack instead of
+recursion, so deeply nested payloads cannot hit the recursion limit, and
+write fragments to a callable (a list's append, a stream's write) instead
+of concatenating strings, so the cost is linear in the document size.
+
+Each node is rendered by a generator frame that writes its own fragments
+and yields the frame of a child node whenever the child's output comes
+next; _walk runs the frames depth first.
+
+With collapse_identical, a non empty subtree that is the same on both sides
+is written as a one line stub ("{… 12 identical keys …}") instead of in
+full, which keeps reports of large, mostly equal documents small.
+
+With align_arrays, array elements are paired by json_diff.align_lists (by
+key path or content) instead of by index, so an inserted element shows as
+one addition rather than shifting every later element into a change. The
+difference passed in must then come from diff_json with the same options.
+
+Numbers are compared with diff_json's tolerance. Arrays of plain numbers are
+compared in one vectorized pass and written as runs: an equal run is one
+string per side (one stub line with collapse_identical), so only the
+differing positions are formatted one by one.
+"""
+import html
+import json
+import tempfile
+
+from .json_diff import (EPSILON, align_lists, are_different, diff_json, diff_path_index, format_numbers,
+                        numeric_arrays, numeric_changes)
+
+REMOVED = '<span style="background-color: lightsalmon;">'
+ADDED = '<span style="background-color: lightgreen;">'
+CHANGED = '<span style="background-color: lightyellow;">'
+IDENTICAL = '<span style="color: gray;">'
+END = "</span>"
+
+# stands for the missing side of an array element found in one document only
+ABSENT = object()
+
+# fragments joined into one string at a time by FragmentBuffer
+BUFFER_FRAGMENTS = 4096
+# side 2 of a streamed report stays in memory up to SPOOL_SIZE characters,
+# then goes to disk, and is read back SPOOL_READ_SIZE characters at a time
+SPOOL_SIZE = 16 * 1024 * 1024
+SPOOL_READ_SIZE = 1024 * 1024
+
+REPORT_HEAD = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>JSON Comparison (Colored Diff)</title>
+        <style>
+            body { font-family: monospace; display: flex; margin: 0; padding: 0; }
+            .container { flex: 1; padding: 20px; border: 1px solid #ccc; margin: 10px; overflow: auto; }
+            h2 { text-align: center; font-family: sans-serif; }
+            pre { white-space: pre-wrap; font-size: 14px; line-height: 1.5; }
+            .legend { display: flex; justify-content: center; margin-bottom: 15px; font-family: sans-serif; }
+            .legend-item { margin: 0 10px; padding: 2px 8px; border-radius: 3px; }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <h2>File 1</h2>
+            <div class="legend">
+                <span class="legend-item" style="background-color: lightsalmon;">Removed</span>
+                <span class="legend-item" style="background-color: lightyellow;">Changed</span>
+            </div>
+            <pre>"""
+REPORT_MIDDLE = """</pre>
+        </div>
+        <div class="container">
+            <h2>File 2</h2>
+            <div class="legend">
+                <span class="legend-item" style="background-color: lightgreen;">Added</span>
+                <span class="legend-item" style="background-color: lightyellow;">Changed</span>
+            </div>
+            <pre>"""
+REPORT_TAIL = """</pre>
+        </div>
+    </body>
+    </html>
+    """
+
+
+class FragmentBuffer:
+    """ Collects written fragments, joined every BUFFER_FRAGMENTS to keep the list short. """
+
+    def __init__(self):
+        self._chunks = []
+        self._pending = []
+
+    def write(self, text):
+        self._pending.append(text)
+        if len(self._pending) >= BUFFER_FRAGMENTS:
+            self._chunks.append("".join(self._pending))
+            self._pending = []
+
+    def chunks(self):
+        if self._pending:
+            self._chunks.append("".join(self._pending))
+            self._pending = []
+        return self._chunks
+
+    def getvalue(self):
+        return "".join(self.chunks())
+
+
+def _walk(root):
+    """ Run a frame and the child frames it yields, depth first, without recursion. """
+    stack = [root]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+        else:
+            stack.append(child)
+
+
+def _iter_walk(root, written):
+    """ _walk, yielding the fragments of the list written (joined) whenever it holds BUFFER_FRAGMENTS. """
+    stack = [root]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+        else:
+            stack.append(child)
+        if len(written) >= BUFFER_FRAGMENTS:
+            yield "".join(written)
+            written.clear()
+
+
+def _pretty_frame(obj, indent, indent_size, write):
+    if isinstance(obj, dict) and obj:
+        next_indent_str = " " * (indent + indent_size)
+        last = len(obj) - 1
+        write("{\n")
+        for i, (key, value) in enumerate(obj.items()):
+            write(f'{next_indent_str}"{key}": ')
+            if value and isinstance(value, (dict, list)):
+                yield _pretty_frame(value, indent + indent_size, indent_size, write)
+            else:
+                write(json.dumps(value))
+            write(",\n" if i < last else "\n")
+        write(f"{' ' * indent}}}")
+    elif isinstance(obj, list) and obj:
+        next_indent_str = " " * (indent + indent_size)
+        last = len(obj) - 1
+        write("[\n")
+        for i, item in enumerate(obj):
+            if item and isinstance(item, (dict, list)):
+                write(next_indent_str)
+                yield _pretty_frame(item, indent + indent_size, indent_size, write)
+            else:
+                write(next_indent_str + json.dumps(item))
+            write(",\n" if i < last else "\n")
+        write(f"{' ' * indent}]")
+    else:
+        # scalars, null and empty containers
+        write(json.dumps(obj))
+
+
+def write_pretty_json(obj, write, indent=0, indent_size=2):
+    """ Write obj pretty printed (keys in document order) to write. """
+    _walk(_pretty_frame(obj, indent, indent_size, write))
+
+
+def pretty_format_json(obj, indent=0, indent_size=2):
+    """Pretty format JSON with proper indentation."""
+    buffer = FragmentBuffer()
+    write_pretty_json(obj, buffer.write, indent, indent_size)
+    return buffer.getvalue()
+
+
+class _ColorDiff:
+    """ Frames of the color coded rendering of two documents, one writer per side. """
+
+    def __init__(self, dirty, indent_size, write1, write2, collapse_identical=False, align_arrays=False, key_paths=(),
+                 tolerance=EPSILON, absolute_tolerance=None):
+        self.dirty = dirty
+        self.indent_size = indent_size
+        self.write1 = write1
+        self.write2 = write2
+        self.collapse_identical = collapse_identical
+        self.align_arrays = align_arrays
+        self.key_paths = key_paths
+        self.tolerance = tolerance
+        self.absolute_tolerance = absolute_tolerance
+
+    def different(self, val1, val2):
+        return are_different(val1, val2, self.tolerance, self.absolute_tolerance)
+
+    def both(self, text):
+        self.write1(text)
+        self.write2(text)
+
+    def each(self, text1, text2):
+        """ Values that are equal within the tolerance: each side shows its own, written once when the text is the same. """
+        if text1 == text2:
+            self.both(text1)
+        else:
+            self.write1(text1)
+            self.write2(text2)
+
+    def escaped(self, write):
+        return lambda text: write(html.escape(text))
+
+    def identical(self, obj, indent):
+        """ A subtree that is the same on both sides, rendered once into both. """
+        indent_size = self.indent_size
+        both = self.both
+        next_indent_str = " " * (indent + indent_size)
+        if isinstance(obj, dict):
+            keys = sorted(obj)
+            last = len(keys) - 1
+            both("{\n")
+            for i, key in enumerate(keys):
+                value = obj[key]
+                if isinstance(value, (dict, list)):
+                    both(f'{next_indent_str}"{html.escape(str(key))}": ')
+                    yield self.identical(value, indent + indent_size)
+                else:
+                    both(f'{next_indent_str}"{html.escape(str(key))}": {html.escape(json.dumps(value))}')
+                both(",\n" if i < last else "\n")
+            both(f"{' ' * indent}}}")
+        elif isinstance(obj, list):
+            last = len(obj) - 1
+            both("[\n")
+            for i, item in enumerate(obj):
+                if isinstance(item, (dict, list)):
+                    both(next_indent_str)
+                    yield self.identical(item, indent + indent_size)
+                else:
+                    both(next_indent_str + html.escape(json.dumps(item)))
+                both(",\n" if i < last else "\n")
+            both(f"{' ' * indent}]")
+        else:
+            both(html.escape(json.dumps(obj)))
+
+    def element(self, val1, val2, path, indent):
+        """ Frame of one array element, ABSENT on the side that lacks it. """
+        write1, write2 = self.write1, self.write2
+        indent_str = " " * indent
+        if val1 is not ABSENT and val2 is not ABSENT:
+            # Element exists in both lists
+            if isinstance(val1, (dict, list)) and isinstance(val2, (dict, list)):
+                self.both(indent_str)
+                yield self.child(val1, val2, path, indent)
+            elif not self.different(val1, val2):
+                self.each(indent_str + html.escape(json.dumps(val1)), indent_str + html.escape(json.dumps(val2)))
+            else:
+                write1(f"{indent_str}{CHANGED}{html.escape(json.dumps(val1))}{END}")
+                write2(f"{indent_str}{CHANGED}{html.escape(json.dumps(val2))}{END}")
+        elif val2 is ABSENT:
+            # Element only in obj1 (deleted)
+            write1(indent_str + REMOVED)
+            yield _pretty_frame(val1, indent, self.indent_size, self.escaped(write1))
+            write1(END)
+        else:
+            # Element only in obj2 (added)
+            write2(indent_str + ADDED)
+            yield _pretty_frame(val2, indent, self.indent_size, self.escaped(write2))
+            write2(END)
+
+    def numeric_segments(self, numeric, steps):
+        """ Runs of two numeric arrays as (tag, i1, i2, j1, j2), tag "equal", "change", "delete" or "insert".
+
+        steps is the align_lists pairing, or None to pair by position.
+        """
+        array1, array2 = numeric
+        len1 = len(array1)
+        len2 = len(array2)
+        segments = []
+        if steps is None:
+            # only the changed positions come back from numpy
+            common = min(len1, len2)
+            start = 0
+            for i in numeric_changes(array1[:common], array2[:common], self.tolerance, self.absolute_tolerance) + [common]:
+                if start < i:
+                    segments.append(("equal", start, i, start, i))
+                if i < common:
+                    segments.append(("change", i, i + 1, i, i + 1))
+                start = i + 1
+            if common < len1:
+                segments.append(("delete", common, len1, None, None))
+            if common < len2:
+                segments.append(("insert", None, None, common, len2))
+            return segments
+
+        pairs = [(i, j) for i, j in steps if i is not None and j is not None]
+        changes = numeric_changes(array1[[i for i, _ in pairs]], array2[[j for _, j in pairs]],
+                                  self.tolerance, self.absolute_tolerance)
+        changed = {pairs[k] for k in changes}
+        for i, j in steps:
+            if i is None:
+                segment = ("insert", None, None, j, j + 1)
+            elif j is None:
+                segment = ("delete", i, i + 1, None, None)
+            else:
+                segment = ("change" if (i, j) in changed else "equal", i, i + 1, j, j + 1)
+            last = segments[-1] if segments else None
+            if (last is not None and last[0] == segment[0] != "change"
+                    and last[2] == segment[1] and last[4] == segment[3]):
+                # the next element of the same run
+                segments[-1] = (last[0], last[1], segment[2], last[3], segment[4])
+            else:
+                segments.append(segment)
+        return segments
+
+    def numeric_list(self, obj1, obj2, segments, indent):
+        """ Write two numeric arrays run by run, from numeric_segments. """
+        write1, write2 = self.write1, self.write2
+        len1 = len(obj1)
+        len2 = len(obj2)
+        next_indent_str = " " * (indent + self.indent_size)
+        separator = ",\n" + next_indent_str
+        self.both("[\n")
+        for tag, i1, i2, j1, j2 in segments:
+            if tag == "equal":
+                if self.collapse_identical and i2 - i1 > 1:
+                    self.both(f"{next_indent_str}{IDENTICAL}… {i2 - i1} equal items …{END}")
+                else:
+                    self.each(next_indent_str + separator.join(format_numbers(obj1[i1:i2])),
+                              next_indent_str + separator.join(format_numbers(obj2[j1:j2])))
+            elif tag == "change":
+                write1(f"{next_indent_str}{CHANGED}{json.dumps(obj1[i1])}{END}")
+                write2(f"{next_indent_str}{CHANGED}{json.dumps(obj2[j1])}{END}")
+            elif tag == "delete":
+                write1(f"{END},\n".join(f"{next_indent_str}{REMOVED}{number}" for number in format_numbers(obj1[i1:i2])) + END)
+                write2("\n" * (i2 - i1 - 1))
+            else:
+                write2(f"{END},\n".join(f"{next_indent_str}{ADDED}{number}" for number in format_numbers(obj2[j1:j2])) + END)
+                write1("\n" * (j2 - j1 - 1))
+            # both sides get the line break after the run, the comma only where an element follows
+            write1(",\n" if tag != "insert" and i2 < len1 else "\n")
+            write2(",\n" if tag != "delete" and j2 < len2 else "\n")
+        self.both(f"{' ' * indent}]")
+
+    def child(self, val1, val2, path, indent):
+        """ Frame of two containers found at the same place.
+
+        A subtree without a difference may still hold numbers that are only
+        equal within the tolerance; it is rendered once only when it is
+        exactly equal.
+        """
+        if path in self.dirty or val1 != val2:
+            return self.node(val1, val2, path, indent)
+        if self.collapse_identical and val1:
+            return self.stub(val1)
+        return self.identical(val1, indent)
+
+    def stub(self, obj):
+        """ One line in place of an identical subtree. """
+        if isinstance(obj, dict):
+            self.both(f"{IDENTICAL}{{… {len(obj)} identical keys …}}{END}")
+        else:
+            self.both(f"{IDENTICAL}[… {len(obj)} identical items …]{END}")
+        yield from ()
+
+    def node(self, obj1, obj2, path, indent):
+        write1, write2 = self.write1, self.write2
+        indent_size = self.indent_size
+        indent_str = " " * indent
+        next_indent = indent + indent_size
+        next_indent_str = " " * next_indent
+
+        # Handle cases where one object is None (completely added or removed)
+        if obj1 is None:
+            write1("null")
+            write2(ADDED)
+            yield _pretty_frame(obj2, indent, indent_size, self.escaped(write2))
+            write2(END)
+            return
+        if obj2 is None:
+            write1(REMOVED)
+            yield _pretty_frame(obj1, indent, indent_size, self.escaped(write1))
+            write1(END)
+            write2("null")
+            return
+
+        if isinstance(obj1, dict) and isinstance(obj2, dict):
+            all_keys = sorted(set(obj1).union(obj2))
+            last = len(all_keys) - 1
+            self.both("{\n")
+            for i, key in enumerate(all_keys):
+                key_html = f'"{html.escape(str(key))}": '
+                # Key only in obj1 (deleted)
+                if key not in obj2:
+                    write1(f"{next_indent_str}{REMOVED}{key_html}")
+                    yield _pretty_frame(obj1[key], next_indent, indent_size, self.escaped(write1))
+                    write1(END + ",\n" if i < last else END + "\n")
+                    continue
+                # Key only in obj2 (added)
+                if key not in obj1:
+                    write2(f"{next_indent_str}{ADDED}{key_html}")
+                    yield _pretty_frame(obj2[key], next_indent, indent_size, self.escaped(write2))
+                    write2(END + ",\n" if i < last else END + "\n")
+                    continue
+
+                # Key in both dictionaries
+                val1 = obj1[key]
+                val2 = obj2[key]
+                if isinstance(val1, (dict, list)) and isinstance(val2, (dict, list)):
+                    self.both(next_indent_str + key_html)
+                    yield self.child(val1, val2, path + (key,), next_indent)
+                elif not self.different(val1, val2):
+                    self.each(next_indent_str + key_html + html.escape(json.dumps(val1)),
+                              next_indent_str + key_html + html.escape(json.dumps(val2)))
+                else:
+                    write1(f"{next_indent_str}{key_html}{CHANGED}{html.escape(json.dumps(val1))}{END}")
+                    write2(f"{next_indent_str}{key_html}{CHANGED}{html.escape(json.dumps(val2))}{END}")
+                self.both(",\n" if i < last else "\n")
+            self.both(f"{indent_str}}}")
+
+        elif isinstance(obj1, list) and isinstance(obj2, list):
+            len1 = len(obj1)
+            len2 = len(obj2)
+            steps = align_lists(obj1, obj2, self.key_paths) if self.align_arrays else None
+            numeric = numeric_arrays(obj1, obj2)
+            if numeric is not None:
+                self.numeric_list(obj1, obj2, self.numeric_segments(numeric, steps), indent)
+                return
+            if steps is None:
+                steps = ((i if i < len1 else None, i if i < len2 else None) for i in range(max(len1, len2)))
+            self.both("[\n")
+            for i, j in steps:
+                yield self.element(ABSENT if i is None else obj1[i], ABSENT if j is None else obj2[j],
+                                   path + (i,), next_indent)
+                # both sides get the line break, the comma only where an element follows
+                write1(",\n" if i is not None and i < len1 - 1 else "\n")
+                write2(",\n" if j is not None and j < len2 - 1 else "\n")
+            self.both(f"{indent_str}]")
+
+        elif not self.different(obj1, obj2):
+            # Simple values
+            self.each(html.escape(json.dumps(obj1)), html.escape(json.dumps(obj2)))
+        else:
+            write1(f"{CHANGED}{html.escape(json.dumps(obj1))}{END}")
+            write2(f"{CHANGED}{html.escape(json.dumps(obj2))}{END}")
+
+
+def write_color_diff(obj1, obj2, difference, write1, write2, indent=0, indent_size=2, dirty=None, path=(),
+                     collapse_identical=False, align_arrays=False, key_paths=(), tolerance=EPSILON, absolute_tolerance=None):
+    """ Write the color coded rendering of obj1 to write1 and of obj2 to write2.
+
+    difference is the dictdiffer output for the two documents; its
+    diff_path_index (dirty) tells which subtrees hold a difference, the
+    others are rendered once for both sides without being compared, or as a
+    one line stub with collapse_identical.
+    """
+    if dirty is None:
+        dirty = diff_path_index(difference)
+    frames = _ColorDiff(dirty, indent_size, write1, write2, collapse_identical, align_arrays, key_paths,
+                        tolerance, absolute_tolerance)
+    _walk(frames.node(obj1, obj2, tuple(path), indent))
+
+
+def write_color_diff_element(val1, val2, difference, write1, write2, index, indent_size=2, collapse_identical=False,
+                             align_arrays=False, key_paths=(), tolerance=EPSILON, absolute_tolerance=None):
+    """ Write element index of two top level arrays as write_color_diff would.
+
+    difference is the diff of the two elements alone (paths relative to
+    them); val1 or val2 is ABSENT when the element is in one array only.
+    The caller writes the brackets, commas and line breaks around it.
+    """
+    dirty = {(index,) + path for path in diff_path_index(difference)} if difference else set()
+    frames = _ColorDiff(dirty, indent_size, write1, write2, collapse_identical, align_arrays, key_paths,
+                        tolerance, absolute_tolerance)
+    _walk(frames.element(val1, val2, (index,), indent_size))
+
+
+def color_diff_pretty(obj1, obj2, difference, path=None, indent=0, indent_size=2, dirty=None, collapse_identical=False,
+                      align_arrays=False, key_paths=(), tolerance=EPSILON, absolute_tolerance=None):
+    """Generate color-coded pretty-printed JSON comparison, as (html1, html2)."""
+    buffer1 = FragmentBuffer()
+    buffer2 = FragmentBuffer()
+    write_color_diff(obj1, obj2, difference, buffer1.write, buffer2.write, indent, indent_size, dirty, path or (),
+                     collapse_identical, align_arrays, key_paths, tolerance, absolute_tolerance)
+    return buffer1.getvalue(), buffer2.getvalue()
+
+
+def iter_json_report(data1, data2, difference=None, collapse_identical=False, align_arrays=False, key_paths=(),
+                     tolerance=EPSILON, absolute_tolerance=None):
+    """Yield the colored comparison HTML in pieces of about BUFFER_FRAGMENTS fragments.
+
+    Side 1 is yielded while it is rendered; side 2, which the page shows
+    after all of side 1, is spooled to a temporary file past SPOOL_SIZE, so
+    the report is never held in memory whole.
+    """
+    if difference is None:
+        difference = list(diff_json(data1, data2, tolerance, absolute_tolerance, align_arrays=align_arrays,
+                                    key_paths=key_paths))
+    side1 = []
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+", encoding="utf-8") as side2:
+        frames = _ColorDiff(diff_path_index(difference), 2, side1.append, side2.write, collapse_identical,
+                            align_arrays, key_paths, tolerance, absolute_tolerance)
+        yield REPORT_HEAD
+        yield from _iter_walk(frames.node(data1, data2, (), 0), side1)
+        yield "".join(side1)
+        yield REPORT_MIDDLE
+        side2.seek(0)
+        for chunk in iter(lambda: side2.read(SPOOL_READ_SIZE), ""):
+            yield chunk
+        yield REPORT_TAIL
@@ -0,0 +1,201 @@
+""" Streaming compare of two large JSON arrays or NDJSON files.
+
+json.load holds both documents, both parsed trees and the whole difference
+in memory at once. Here a top level array is read one element at a time
+(with ijson when it is installed, else with raw_decode over a sliding text
+buffer) and an NDJSON file one line at a time. The two sides are walked in
+lockstep: each pair of elements is diffed and rendered on its own and then
+dropped, so memory is bounded by the largest element, not the document.
+
+The report is the HTML json_report writes for the whole documents (an
+NDJSON file is compared as the array of its records). Side 2 is spooled to
+a temporary file because the page shows it after all of side 1. The
+difference records are those of diff_json, except that elements found in
+one document only come as one add / remove record each.
+"""
+import codecs
+import io
+import json
+import re
+import tempfile
+from itertools import zip_longest
+
+from .backends import ijson
+from .json_diff import EPSILON, diff_json, diff_path
+from .json_report import (ABSENT, BUFFER_FRAGMENTS, REPORT_HEAD, REPORT_MIDDLE, REPORT_TAIL, SPOOL_SIZE,
+                          write_color_diff_element)
+
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+# bytes read from an input at a time
+STREAM_CHUNK_SIZE = 1024 * 1024
+# pairs at least this large (both sides together) are streamed by default
+STREAM_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+def is_ndjson(name):
+    return name.lower().endswith(NDJSON_EXTENSIONS)
+
+
+class ChunkStream(io.RawIOBase):
+    """ Read only file over an iterator of byte chunks (e.g. a blob download's chunks()). """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, None)
+            if self._pending is None:
+                self._pending = b""
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def open_chunks(chunks, buffer_size=STREAM_CHUNK_SIZE):
+    """ Buffered binary stream over byte chunks. """
+    return io.BufferedReader(ChunkStream(chunks), buffer_size)
+
+
+def starts_with_array(stream):
+    """ True when the buffered binary stream holds a top level JSON array (nothing is consumed). """
+    return stream.peek(STREAM_CHUNK_SIZE).lstrip()[:1] == b"["
+
+
+def _raw_array_items(stream, chunk_size):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    raw_decode = json.JSONDecoder().raw_decode
+    buffer = ""
+    pos = 0
+    eof = False
+    expect = "["
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Invalid JSON array: unexpected end of input")
+            data = stream.read(chunk_size)
+            eof = not data
+            buffer = buffer[pos:] + decoder.decode(data, final=eof)
+            pos = 0
+            continue
+
+        char = buffer[pos]
+        if expect == "[":
+            if char != "[":
+                raise ValueError("Not a JSON array")
+            pos += 1
+            expect = "first"
+        elif expect in ("first", "separator") and char == "]":
+            return
+        elif expect == "separator":
+            if char != ",":
+                raise ValueError(f"Invalid JSON array: expected ',' or ']', found {char!r}")
+            pos += 1
+            expect = "value"
+        else:
+            try:
+                item, end = raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            # a number at the end of the buffer ("1" of "1.5") may continue in the
+            # next chunk; read at least as much again as is buffered so a large
+            # element is not decoded over and over
+            if end is None or (not eof and (end == len(buffer) or buffer[end] in _NUMBER_CHARS)):
+                data = stream.read(max(chunk_size, len(buffer) - pos))
+                eof = not data
+                buffer = buffer[pos:] + decoder.decode(data, final=eof)
+                pos = 0
+                continue
+            yield item
+            pos = end
+            expect = "separator"
+
+
+def iter_array_items(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """ Elements of the top level JSON array in a binary stream, one at a time. """
+    # ijson is optional, the raw_decode reader is used without it
+    backend = ijson()
+    if backend is not None:
+        return backend.items(stream, "item", use_float=True)
+    return _raw_array_items(stream, chunk_size)
+
+
+def iter_ndjson(stream):
+    """ Records of an NDJSON (JSON lines) binary stream; blank lines are skipped. """
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _with_last(items):
+    """ (item, is_last) for every item, reading one item ahead. """
+    items = iter(items)
+    current = next(items, ABSENT)
+    if current is ABSENT:
+        return
+    for following in items:
+        yield current, False
+        current = following
+    yield current, True
+
+
+def iter_stream_report(items1, items2, on_difference=None, collapse_identical=False, align_arrays=False,
+                       key_paths=(), tolerance=EPSILON, absolute_tolerance=None):
+    """ Yield the HTML report of two element iterators compared in lockstep.
+
+    Elements are paired by position, as diff_json pairs top level array
+    elements; align_arrays, key_paths and the tolerances apply inside the
+    elements.
+    on_difference is called with every difference record (paths from the
+    document root), e.g. diff_summary.JsonDiffSummary().add.
+    """
+    side1 = []
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+", encoding="utf-8") as side2:
+        yield REPORT_HEAD
+        side1.append("[\n")
+        side2.write("[\n")
+        pairs = zip_longest(_with_last(items1), _with_last(items2), fillvalue=(ABSENT, True))
+        for index, ((val1, last1), (val2, last2)) in enumerate(pairs):
+            if val1 is ABSENT or val2 is ABSENT:
+                difference = []
+                if on_difference is not None:
+                    on_difference(("add", "", [(index, val2)]) if val1 is ABSENT else ("remove", "", [(index, val1)]))
+            else:
+                difference = list(diff_json(val1, val2, tolerance, absolute_tolerance, align_arrays=align_arrays,
+                                            key_paths=key_paths))
+                if on_difference is not None:
+                    for kind, d_path, detail in difference:
+                        on_difference((kind, [index, *diff_path(d_path)], detail))
+
+            write_color_diff_element(val1, val2, difference, side1.append, side2.write, index,
+                                     collapse_identical=collapse_identical, align_arrays=align_arrays,
+                                     key_paths=key_paths, tolerance=tolerance, absolute_tolerance=absolute_tolerance)
+            # both sides get the line break, the comma only where an element follows
+            side1.append(",\n" if val1 is not ABSENT and not last1 else "\n")
+            side2.write(",\n" if val2 is not ABSENT and not last2 else "\n")
+            if len(side1) >= BUFFER_FRAGMENTS:
+                yield "".join(side1)
+                side1.clear()
+
+        side1.append("]")
+        side2.write("]")
+        yield "".join(side1)
+        yield REPORT_MIDDLE
+        side2.seek(0)
+        for chunk in iter(lambda: side2.read(STREAM_CHUNK_SIZE), ""):
+            yield chunk
+        yield REPORT_TAIL
@@ -0,0 +1,97 @@
+""" Paged reports: one HTML document per page plus an index page.
+
+Very large diffs are split into pages (see SegmentHtmlDiff.iter_pages) that
+are written next to the report. The report itself becomes an index that
+links every page and embeds it in an iframe with loading="lazy", so the
+browser only fetches and renders the pages scrolled into view. This works
+from file:// as well as from blob storage.
+"""
+import html
+import os
+import re
+
+from .report_writer import write_chunks
+
+# height of an embedded page in the index, in pixels
+PAGE_HEIGHT = 800
+
+_INDEX_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8" />
+    <title>%(title)s</title>
+    <style type="text/css">
+        body {font-family:sans-serif; margin:10px}
+        nav a {margin-right:8px}
+        iframe {width:100%%; height:%(height)dpx; border:1px solid #ccc; margin-bottom:10px}
+    </style>
+</head>
+<body>
+    <h2>%(title)s</h2>
+    <p>%(count)d pages</p>
+    <nav>
+"""
+_INDEX_TAIL = """</body>
+</html>
+"""
+
+_SPAN_TAG = re.compile(r"<span\b[^>]*>|</span>")
+
+
+def page_file_name(report_name, number):
+    """ Name of page number (1 based) of a paged report. """
+    stem, ext = os.path.splitext(report_name)
+    return f"{stem}_page{number:04d}{ext or '.html'}"
+
+
+def iter_index_page(title, page_names, page_height=PAGE_HEIGHT):
+    """ Yield the index page of a paged report in chunks. """
+    title = html.escape(title)
+    yield _INDEX_HEAD % dict(title=title, height=page_height, count=len(page_names))
+    for number, name in enumerate(page_names, 1):
+        yield f'        <a href="{html.escape(name)}">{number}</a>\n'
+    yield "    </nav>\n"
+    for number, name in enumerate(page_names, 1):
+        yield (f'    <h3 id="page{number}">Page {number}</h3>\n'
+               f'    <iframe loading="lazy" src="{html.escape(name)}" title="Page {number}"></iframe>\n')
+    yield _INDEX_TAIL
+
+
+def write_paged_report(pages, output_path, title="", page_height=PAGE_HEIGHT):
+    """ Write each page document next to output_path and the index to output_path.
+
+    pages is an iterable of page documents, consumed one at a time. Returns
+    the list of page file names.
+    """
+    directory = os.path.dirname(output_path)
+    report_name = os.path.basename(output_path)
+    page_names = []
+    for number, page in enumerate(pages, 1):
+        name = page_file_name(report_name, number)
+        write_chunks([page], os.path.join(directory, name))
+        page_names.append(name)
+    write_chunks(iter_index_page(title or report_name, page_names, page_height), output_path)
+    return page_names
+
+
+def paginate_spans(text, lines_per_page):
+    """ Split highlighted <pre> text into pages of lines_per_page lines.
+
+    A <span> that is still open at the end of a page is closed there and
+    reopened at the top of the next page, so every page is valid markup.
+    """
+    pages = []
+    open_tags = []
+    lines = text.split("\n")
+    for start in range(0, len(lines), lines_per_page):
+        page_lines = lines[start:start + lines_per_page]
+        prefix = "".join(open_tags)
+        for line in page_lines:
+            for tag in _SPAN_TAG.findall(line):
+                if tag == "</span>":
+                    if open_tags:
+                        open_tags.pop()
+                else:
+                    open_tags.append(tag)
+        pages.append(prefix + "\n".join(page_lines) + "</span>" * len(open_tags))
+    return pages or [""]
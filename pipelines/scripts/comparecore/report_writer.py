@@ -0,0 +1,96 @@
+""" Write reports from a generator of HTML chunks without joining them.
+
+Local runs stream the chunks to a file; Azure runs upload them to block blob
+storage as staged blocks of chunk_size bytes (optionally gzip encoded), so
+peak memory is one block rather than the whole report.
+"""
+import base64
+import zlib
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def iter_byte_blocks(chunks, chunk_size=DEFAULT_CHUNK_SIZE, encoding="utf-8", gzip_encode=False):
+    """ Re-block text chunks into byte blocks of about chunk_size bytes. """
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip_encode else None
+    buffer = bytearray()
+    for chunk in chunks:
+        data = chunk.encode(encoding) if isinstance(chunk, str) else chunk
+        if compressor is not None:
+            data = compressor.compress(data)
+        buffer += data
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if compressor is not None:
+        buffer += compressor.flush()
+    while buffer:
+        yield bytes(buffer[:chunk_size])
+        del buffer[:chunk_size]
+
+
+def iter_file_blocks(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Read a file as byte blocks of chunk_size. """
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(chunk_size), b""):
+            yield block
+
+
+def write_chunks(chunks, output_path, chunk_size=DEFAULT_CHUNK_SIZE, encoding="utf-8"):
+    """ Stream text chunks to output_path. Returns the number of bytes written. """
+    written = 0
+    with open(output_path, "wb") as output_file:
+        for block in iter_byte_blocks(chunks, chunk_size, encoding):
+            output_file.write(block)
+            written += len(block)
+    return written
+
+
+def _block_id(index):
+    # block ids must all have the same length within a blob
+    return base64.b64encode(f"{index:08d}".encode("ascii")).decode("ascii")
+
+
+def blob_content_settings(content_type, gzip_encode=False):
+    """ ContentSettings of an uploaded blob; upload_blob takes them as content_settings, not content_type. """
+    from azure.storage.blob import ContentSettings
+
+    return ContentSettings(content_type=content_type, content_encoding="gzip" if gzip_encode else None)
+
+
+def upload_blocks(blob_client, blocks, content_type="text/html", gzip_encode=False):
+    """ Upload byte blocks as staged blocks of a block blob and commit them.
+
+    gzip_encode only sets Content-Encoding; the blocks must already be
+    compressed (see iter_byte_blocks). Returns the number of blocks.
+    """
+    from azure.storage.blob import BlobBlock
+
+    block_list = []
+    for index, block in enumerate(blocks):
+        block_id = _block_id(index)
+        blob_client.stage_block(block_id=block_id, data=block)
+        block_list.append(BlobBlock(block_id=block_id))
+    blob_client.commit_block_list(block_list, content_settings=blob_content_settings(content_type, gzip_encode))
+    return len(block_list)
+
+
+async def upload_blocks_async(blob_client, blocks, content_type="text/html", gzip_encode=False):
+    """ upload_blocks for an azure.storage.blob.aio blob client. """
+    from azure.storage.blob import BlobBlock
+
+    block_list = []
+    for index, block in enumerate(blocks):
+        block_id = _block_id(index)
+        await blob_client.stage_block(block_id=block_id, data=block)
+        block_list.append(BlobBlock(block_id=block_id))
+    await blob_client.commit_block_list(block_list, content_settings=blob_content_settings(content_type, gzip_encode))
+    return len(block_list)
+
+
+def upload_chunks(blob_client, chunks, chunk_size=DEFAULT_CHUNK_SIZE, content_type="text/html",
+                  gzip_encode=False):
+    """ Stream text chunks to a blob through staged blocks. """
+    blocks = iter_byte_blocks(chunks, chunk_size, gzip_encode=gzip_encode)
+    return upload_blocks(blob_client, blocks, content_type=content_type, gzip_encode=gzip_encode)
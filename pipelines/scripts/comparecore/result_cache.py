@@ -0,0 +1,132 @@
+""" Content hashing and an on-disk cache of comparison reports.
+
+Reports are stored under a key built from the sha256 of both inputs, the
+compare options and diff_engine.ENGINE_VERSION, so a rerun over unchanged
+data copies the previous report (and its diff summary) instead of diffing
+again. The cache is kept
+under a size limit by evicting the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from .diff_engine import ENGINE_VERSION
+from .edi_archive import open_input
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def hash_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """ sha256 of a file (or archive member), read in fixed size chunks. """
+    digest = hashlib.sha256()
+    with open_input(file_path) as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data):
+    """ sha256 of an input already in memory, same as hash_file of its content. """
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(from_hash, to_hash, options=None):
+    """ Key for a comparison of two inputs with the given options. """
+    payload = json.dumps({
+        "from": from_hash,
+        "to": to_hash,
+        "options": options or {},
+        "engine_version": ENGINE_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """ Directory of cached reports (<key>.html, summary in <key>.json) with size based LRU eviction.
+
+    Safe to share between worker processes: entries are written to a
+    temporary file and renamed into place, and a hit refreshes the entry's
+    mtime which is what eviction orders by.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key, ext=".html"):
+        return os.path.join(self.cache_dir, f"{key}{ext}")
+
+    def fetch(self, key, output_path):
+        """ Copy a cached report to output_path. Returns False on a miss. """
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, output_path)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def fetch_summary(self, key):
+        """ Diff summary stored with a cached report, None if there is none. """
+        try:
+            with open(self._path(key, ".json")) as summary_file:
+                return json.load(summary_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store(self, key, report_path, summary=None):
+        """ Add a report, and optionally its diff summary, to the cache. """
+        if summary is not None:
+            # written first so a visible report always has its summary
+            self._store_file(key, ".json", lambda temp_path: _dump_json(summary, temp_path))
+        self._store_file(key, ".html", lambda temp_path: shutil.copyfile(report_path, temp_path))
+
+    def _store_file(self, key, ext, write):
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(temp_path)
+            os.replace(temp_path, self._path(key, ext))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits max_bytes.
+
+        Returns the number of entries removed.
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if not entry.name.endswith(".html"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for entry_path in (path, path[:-len(".html")] + ".json"):
+                try:
+                    os.remove(entry_path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def _dump_json(data, path):
+    with open(path, "w") as file:
+        json.dump(data, file)
@@ -0,0 +1,127 @@
+""" Import time benchmark of the compare core, guarding Function app cold start.
+
+A cold start on the consumption plan imports the function app module before
+the first request is served, so everything the module imports at load is
+request latency. Each target is imported in a fresh interpreter (best of
+--repeat runs) and the benchmark fails when one takes longer than --max-ms
+or loads a heavy module at import: numpy and ijson are optional backends
+loaded on first use (comparecore.backends), dictdiffer is not used by the
+core and azure.storage.blob is imported by the functions that talk to
+storage.
+
+    python pipelines/scripts/import_benchmark.py
+    python pipelines/scripts/import_benchmark.py --app azurecloudfunction/function_app.py \\
+        --app streamlit/function_app.py --max-ms 150
+
+Exits 0 when every target is within budget, 1 otherwise. A failing target
+is imported once more under python -X importtime and its slowest imports
+are listed.
+"""
+import argparse
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+CORE_PACKAGE = "comparecore"
+
+HEAVY_MODULES = ("numpy", "ijson", "dictdiffer", "azure.storage.blob")
+DEFAULT_MAX_MS = 150
+DEFAULT_REPEAT = 3
+# slowest imports listed for a target over budget
+TOP_IMPORTS = 10
+
+_PROBE = """import json, sys, time
+sys.path[:0] = {paths!r}
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def core_targets():
+    """ (name, module, sys.path entries) of the package and every module of the compare core. """
+    targets = [(CORE_PACKAGE, CORE_PACKAGE, [SCRIPTS_DIR])]
+    for module in sorted(pkgutil.iter_modules([os.path.join(SCRIPTS_DIR, CORE_PACKAGE)]), key=lambda m: m.name):
+        name = f"{CORE_PACKAGE}.{module.name}"
+        targets.append((name, name, [SCRIPTS_DIR]))
+    return targets
+
+
+def app_target(path):
+    """ Target of a function app module file, imported from its own directory as the host does. """
+    directory, file_name = os.path.split(os.path.abspath(path))
+    return path, os.path.splitext(file_name)[0], [directory]
+
+
+def _run_probe(module, paths, importtime=False):
+    code = _PROBE.format(paths=paths, module=module, heavy=HEAVY_MODULES)
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    return subprocess.run(command, capture_output=True, text=True, cwd=paths[0])
+
+
+def measure(module, paths, repeat=DEFAULT_REPEAT):
+    """ Best import time in ms of module over repeat fresh interpreters, and the heavy modules it loaded. """
+    best = None
+    heavy = []
+    for _ in range(repeat):
+        completed = _run_probe(module, paths)
+        if completed.returncode:
+            raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else
+                               f"exit status {completed.returncode}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        best = result["ms"] if best is None else min(best, result["ms"])
+        heavy = result["heavy"]
+    return best, heavy
+
+
+def slowest_imports(module, paths, top=TOP_IMPORTS):
+    """ (cumulative ms, module name) of the slowest imports of module, from python -X importtime. """
+    imports = []
+    for line in _run_probe(module, paths, importtime=True).stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def run_benchmark(targets, max_ms=DEFAULT_MAX_MS, repeat=DEFAULT_REPEAT):
+    """ Benchmark every target and print one line per target. Returns the number of failures. """
+    failures = 0
+    for name, module, paths in targets:
+        try:
+            ms, heavy = measure(module, paths, repeat)
+        except RuntimeError as e:
+            print(f"FAIL  {name}: import failed: {str(e)}")
+            failures += 1
+            continue
+        problems = []
+        if ms > max_ms:
+            problems.append(f"over {max_ms} ms")
+        if heavy:
+            problems.append(f"loads {', '.join(heavy)} at import")
+        print(f"{'FAIL' if problems else 'ok':<5} {name}: {ms:.1f} ms{'  (' + '; '.join(problems) + ')' if problems else ''}")
+        if problems:
+            failures += 1
+            for cumulative, imported in slowest_imports(module, paths):
+                print(f"        {cumulative:8.1f} ms  {imported}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail when importing the compare core or a function app is slow")
+    parser.add_argument("--app", action="append", default=[],
+                        help="function app module file to benchmark as well (repeatable)")
+    parser.add_argument("--max-ms", type=float, default=DEFAULT_MAX_MS,
+                        help=f"import time budget per target in milliseconds (default: {DEFAULT_MAX_MS})")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"fresh interpreters per target, the best time counts (default: {DEFAULT_REPEAT})")
+    args = parser.parse_args()
+    targets = core_targets() + [app_target(path) for path in args.app]
+    failed = run_benchmark(targets, max_ms=args.max_ms, repeat=max(1, args.repeat))
+    print(f"{len(targets) - failed} of {len(targets)} targets within budget")
+    sys.exit(1 if failed else 0)
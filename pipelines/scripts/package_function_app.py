@@ -0,0 +1,61 @@
+""" Build a Function app folder for deployment with the compare core bundled.
+
+A deployment only uploads the app folder, so the comparecore package cannot
+come from pipelines/scripts at run time. This copies the app folder to the
+output directory and installs requirements.txt into
+.python_packages/lib/site-packages of the copy, which the Functions host puts
+on sys.path, together with the comparecore wheel built from this checkout:
+
+    python pipelines/scripts/package_function_app.py azurecloudfunction build/azurecloudfunction
+    cd build/azurecloudfunction && func azure functionapp publish <app name> --no-build
+
+Run it with the Python version of the Function app, on Linux, so binary
+wheels match the host.
+
+comparecore is not on the package index and is not listed in requirements.txt:
+it is installed from the path of the local wheel, so a package of the same
+name on the index can never be picked instead.
+"""
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SITE_PACKAGES = os.path.join(".python_packages", "lib", "site-packages")
+IGNORED = shutil.ignore_patterns("__pycache__", ".python_packages", ".venv", "local.settings.json", "*.whl")
+
+
+def build_core_wheel(wheel_dir):
+    """ Build the comparecore wheel from pipelines/scripts into wheel_dir. Returns the wheel's path. """
+    subprocess.run([sys.executable, "-m", "pip", "wheel", "--no-deps", "--wheel-dir", wheel_dir, SCRIPTS_DIR],
+                   check=True)
+    wheels = glob.glob(os.path.join(wheel_dir, "comparecore-*.whl"))
+    if len(wheels) != 1:
+        raise RuntimeError(f"Expected one comparecore wheel in {wheel_dir}, found {len(wheels)}")
+    return wheels[0]
+
+
+def package_app(app_dir, output_dir):
+    """ Copy app_dir to output_dir and install its requirements next to it. Returns the site-packages path. """
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    shutil.copytree(app_dir, output_dir, ignore=IGNORED)
+    site_packages = os.path.join(output_dir, SITE_PACKAGES)
+    with tempfile.TemporaryDirectory() as wheel_dir:
+        core_wheel = build_core_wheel(wheel_dir)
+        # comparecore by the path of the wheel just built, never by name from the index
+        subprocess.run([sys.executable, "-m", "pip", "install", "--target", site_packages,
+                        "-r", os.path.join(output_dir, "requirements.txt"), core_wheel], check=True)
+    return site_packages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bundle a Function app with its requirements for deployment")
+    parser.add_argument("app_dir", help="Function app folder (function_app.py and requirements.txt)")
+    parser.add_argument("output_dir", help="folder to build the deployable app in (replaced)")
+    args = parser.parse_args()
+    print(f"Packaged {args.app_dir} with its requirements in {package_app(args.app_dir, args.output_dir)}")
@@ -1,243 +1,54 @@
 import streamlit as st
+import io
 import json
-import html
-from dictdiffer import diff
 
-def pretty_format_json(obj, indent=0, indent_size=2):
-    """Pretty format JSON with proper indentation."""
-    if obj is None:
-        return "null"
-    
-    indent_str = " " * indent
-    next_indent = indent + indent_size
-    next_indent_str = " " * next_indent
-    
-    if isinstance(obj, dict):
-        if not obj:  # Empty dict
-            return "{}"
-        
-        result = "{\n"
-        items = list(obj.items())
-        
-        for i, (key, value) in enumerate(items):
-            result += f"{next_indent_str}\"{key}\": {pretty_format_json(value, next_indent, indent_size)}"
-            if i < len(items) - 1:
-                result += ","
-            result += "\n"
-            
-        result += f"{indent_str}}}"
-        return result
-        
-    elif isinstance(obj, list):
-        if not obj:  # Empty list
-            return "[]"
-            
-        result = "[\n"
-        for i, item in enumerate(obj):
-            result += f"{next_indent_str}{pretty_format_json(item, next_indent, indent_size)}"
-            if i < len(obj) - 1:
-                result += ","
-            result += "\n"
-            
-        result += f"{indent_str}]"
-        return result
-        
-    elif isinstance(obj, str):
-        # Escape special characters in string
-        escaped = json.dumps(obj)
-        return escaped
-        
-    else:
-        # For numbers, booleans, etc.
-        return json.dumps(obj)
+# the compare core is the comparecore package: pip install ./pipelines/scripts
+from comparecore.diff_summary import summarize_json_diff
+from comparecore.json_compare import load_json
+from comparecore.json_diff import EPSILON, diff_json, parse_key_paths
+from comparecore.json_report import REPORT_HEAD, REPORT_MIDDLE, REPORT_TAIL, color_diff_pretty
+from comparecore.report_pages import paginate_spans
+from comparecore.result_cache import cache_key, hash_bytes
 
-def color_diff_pretty(obj1, obj2, difference, path=None, indent=0, indent_size=2):
-    """Generate color-coded pretty-printed JSON comparison."""
-    path = path or []
-    indent_str = " " * indent
-    next_indent = indent + indent_size
-    next_indent_str = " " * next_indent
-    
-    # Handle cases where one object is None (completely added or removed)
-    if obj1 is None:
-        pretty_obj2 = pretty_format_json(obj2, indent, indent_size)
-        return "null", f'<span style="background-color: lightgreen;">{html.escape(pretty_obj2)}</span>'
-    elif obj2 is None:
-        pretty_obj1 = pretty_format_json(obj1, indent, indent_size)
-        return f'<span style="background-color: lightsalmon;">{html.escape(pretty_obj1)}</span>', "null"
-    
-    if isinstance(obj1, dict) and isinstance(obj2, dict):
-        keys1 = set(obj1.keys())
-        keys2 = set(obj2.keys())
-        all_keys = sorted(list(keys1.union(keys2)))
-        
-        html1 = "{\n"
-        html2 = "{\n"
-        
-        for i, key in enumerate(all_keys):
-            # Key only in obj1 (deleted)
-            if key in keys1 and key not in keys2:
-                pretty_val = pretty_format_json(obj1[key], next_indent, indent_size)
-                html1 += f'{next_indent_str}<span style="background-color: lightsalmon;">"{html.escape(str(key))}": {html.escape(pretty_val)}</span>'
-                if i < len(all_keys) - 1:
-                    html1 += ","
-                html1 += "\n"
-                continue
-                
-            # Key only in obj2 (added)
-            if key not in keys1 and key in keys2:
-                pretty_val = pretty_format_json(obj2[key], next_indent, indent_size)
-                html2 += f'{next_indent_str}<span style="background-color: lightgreen;">"{html.escape(str(key))}": {html.escape(pretty_val)}</span>'
-                if i < len(all_keys) - 1:
-                    html2 += ","
-                html2 += "\n"
-                continue
-            
-            # Key in both dictionaries
-            val1 = obj1.get(key)
-            val2 = obj2.get(key)
-            current_path = path + [key]
-            
-            # Check if this exact path is in the differences
-            path_in_diff = False
-            for d_type, d_path, *_ in difference:
-                if d_path == current_path or (isinstance(d_path, list) and d_path[:len(current_path)] == current_path):
-                    path_in_diff = True
-                    break
-            
-            # Recursive call for nested structures
-            if isinstance(val1, (dict, list)) and isinstance(val2, (dict, list)):
-                s1, s2 = color_diff_pretty(val1, val2, difference, current_path, next_indent, indent_size)
-                html1 += f'{next_indent_str}"{html.escape(str(key))}": {s1}'
-                html2 += f'{next_indent_str}"{html.escape(str(key))}": {s2}'
-            else:
-                # Simple values
-                if val1 == val2:
-                    # Values are identical
-                    pretty_val = html.escape(json.dumps(val1))
-                    html1 += f'{next_indent_str}"{html.escape(str(key))}": {pretty_val}'
-                    html2 += f'{next_indent_str}"{html.escape(str(key))}": {pretty_val}'
-                else:
-                    # Values differ
-                    html1 += f'{next_indent_str}"{html.escape(str(key))}": <span style="background-color: lightyellow;">{html.escape(json.dumps(val1))}</span>'
-                    html2 += f'{next_indent_str}"{html.escape(str(key))}": <span style="background-color: lightyellow;">{html.escape(json.dumps(val2))}</span>'
-            
-            if i < len(all_keys) - 1 and key in keys1:
-                html1 += ","
-            if i < len(all_keys) - 1 and key in keys2:
-                html2 += ","
-                
-            html1 += "\n"
-            html2 += "\n"
-                
-        html1 += f"{indent_str}}}"
-        html2 += f"{indent_str}}}"
-        return html1, html2
+# lines of pretty printed JSON per page of the paged report
+PAGE_LINES = 2000
+# comparisons (and their rendered reports) kept across reruns
+CACHE_ENTRIES = 8
 
-    elif isinstance(obj1, list) and isinstance(obj2, list):
-        len1 = len(obj1)
-        len2 = len(obj2)
-        max_len = max(len1, len2)
-        
-        html1 = "[\n"
-        html2 = "[\n"
-        
-        for i in range(max_len):
-            if i < len1 and i < len2:
-                # Element exists in both lists
-                val1 = obj1[i]
-                val2 = obj2[i]
-                current_path = path + [i]
-                
-                if isinstance(val1, (dict, list)) and isinstance(val2, (dict, list)):
-                    s1, s2 = color_diff_pretty(val1, val2, difference, current_path, next_indent, indent_size)
-                    html1 += f"{next_indent_str}{s1}"
-                    html2 += f"{next_indent_str}{s2}"
-                elif val1 == val2:
-                    # Values are identical
-                    pretty_val = html.escape(json.dumps(val1))
-                    html1 += f"{next_indent_str}{pretty_val}"
-                    html2 += f"{next_indent_str}{pretty_val}"
-                else:
-                    # Values differ
-                    html1 += f'{next_indent_str}<span style="background-color: lightyellow;">{html.escape(json.dumps(val1))}</span>'
-                    html2 += f'{next_indent_str}<span style="background-color: lightyellow;">{html.escape(json.dumps(val2))}</span>'
-            elif i < len1:
-                # Element only in obj1 (deleted)
-                pretty_val = pretty_format_json(obj1[i], next_indent, indent_size)
-                html1 += f'{next_indent_str}<span style="background-color: lightsalmon;">{html.escape(pretty_val)}</span>'
-                # No corresponding element in html2
-            else:
-                # Element only in obj2 (added)
-                pretty_val = pretty_format_json(obj2[i], next_indent, indent_size)
-                html2 += f'{next_indent_str}<span style="background-color: lightgreen;">{html.escape(pretty_val)}</span>'
-                # No corresponding element in html1
-                
-            if i < max_len - 1:
-                if i < len1 - 1:
-                    html1 += ","
-                if i < len2 - 1:
-                    html2 += ","
-                    
-            html1 += "\n"
-            html2 += "\n"
-                    
-        html1 += f"{indent_str}]"
-        html2 += f"{indent_str}]"
-        return html1, html2
-    else:
-        # Simple values
-        if obj1 == obj2:
-            pretty_val = html.escape(json.dumps(obj1))
-            return pretty_val, pretty_val
-        else:
-            return f'<span style="background-color: lightyellow;">{html.escape(json.dumps(obj1))}</span>', f'<span style="background-color: lightyellow;">{html.escape(json.dumps(obj2))}</span>'
+def json_report_pages(colored_json1, colored_json2, lines_per_page=PAGE_LINES):
+    """Colored comparison split into pages of lines_per_page lines per side."""
+    pages1 = paginate_spans(colored_json1, lines_per_page)
+    pages2 = paginate_spans(colored_json2, lines_per_page)
 
-def compare_json_colored(file1, file2):
-    try:
-        data1 = json.load(file1)
-        data2 = json.load(file2)
-    except json.JSONDecodeError:
-        return "Error: Invalid JSON file(s)."
+    pages = []
+    for i in range(max(len(pages1), len(pages2))):
+        page1 = pages1[i] if i < len(pages1) else ""
+        page2 = pages2[i] if i < len(pages2) else ""
+        pages.append(REPORT_HEAD + page1 + REPORT_MIDDLE + page2 + REPORT_TAIL)
+    return pages
+
+
+# cache_resource hands back the cached object itself instead of unpickling a
+# copy on every rerun; the results are only read. Arguments starting with _
+# are not hashed, the key already stands for them.
+@st.cache_resource(max_entries=CACHE_ENTRIES, show_spinner="Comparing files...")
+def diff_uploads(key, _file1_bytes, _file2_bytes, _options):
+    """Parsed documents, difference and JSON summary of two uploads, diffed once per key."""
+    data1, data2 = load_json(io.BytesIO(_file1_bytes), io.BytesIO(_file2_bytes))
+    difference = list(diff_json(data1, data2, **_options))
+    summary = json.dumps(summarize_json_diff(difference), indent=2, default=str)
+    return data1, data2, difference, summary
 
-    difference = list(diff(data1, data2))
-    colored_json1, colored_json2 = color_diff_pretty(data1, data2, difference)
 
-    html_output = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>JSON Comparison (Colored Diff)</title>
-        <style>
-            body {{ font-family: monospace; display: flex; margin: 0; padding: 0; }}
-            .container {{ flex: 1; padding: 20px; border: 1px solid #ccc; margin: 10px; overflow: auto; }}
-            h2 {{ text-align: center; font-family: sans-serif; }}
-            pre {{ white-space: pre-wrap; font-size: 14px; line-height: 1.5; }}
-            .legend {{ display: flex; justify-content: center; margin-bottom: 15px; font-family: sans-serif; }}
-            .legend-item {{ margin: 0 10px; padding: 2px 8px; border-radius: 3px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h2>File 1</h2>
-            <div class="legend">
-                <span class="legend-item" style="background-color: lightsalmon;">Removed</span>
-                <span class="legend-item" style="background-color: lightyellow;">Changed</span>
-            </div>
-            <pre>{colored_json1}</pre>
-        </div>
-        <div class="container">
-            <h2>File 2</h2>
-            <div class="legend">
-                <span class="legend-item" style="background-color: lightgreen;">Added</span>
-                <span class="legend-item" style="background-color: lightyellow;">Changed</span>
-            </div>
-            <pre>{colored_json2}</pre>
-        </div>
-    </body>
-    </html>
-    """
-    return html_output
+@st.cache_resource(max_entries=CACHE_ENTRIES, show_spinner="Rendering report...")
+def generate_report(key, indent_size, collapse_identical, page_lines, _diff, _options):
+    """Whole colored comparison and its pages, rendered from a cached difference."""
+    data1, data2, difference, _ = _diff
+    colored_json1, colored_json2 = color_diff_pretty(data1, data2, difference, indent_size=indent_size,
+                                                     collapse_identical=collapse_identical, **_options)
+    html_output = "".join([REPORT_HEAD, colored_json1, REPORT_MIDDLE, colored_json2, REPORT_TAIL])
+    return html_output, json_report_pages(colored_json1, colored_json2, page_lines)
+
 
 st.title("JSON Comparison Tool with Pretty Printing")
 st.write("Upload two JSON files to see color-coded differences between them.")
@@ -249,21 +60,33 @@ with col2:
     uploaded_file2 = st.file_uploader("Upload Second JSON File", type=["json"], key="file2")
 
 indent_size = st.slider("Indentation Size", min_value=1, max_value=8, value=2, step=1)
+page_lines = st.number_input("Lines per page", min_value=100, value=PAGE_LINES, step=100)
+collapse_identical = st.checkbox("Collapse identical subtrees", value=False)
+align_arrays = st.checkbox("Align array elements instead of comparing by index", value=True)
+key_paths = parse_key_paths(st.text_input("Array key paths (comma separated, e.g. id, lineNumber)", value=""))
+tolerance = st.number_input("Relative tolerance for numbers", min_value=0.0, value=EPSILON, format="%g")
+absolute_tolerance = st.number_input("Absolute tolerance for numbers", min_value=0.0, value=0.0, format="%g") or None
 
 if uploaded_file1 and uploaded_file2:
     try:
-        # Reset file pointers
-        uploaded_file1.seek(0)
-        uploaded_file2.seek(0)
-        
-        html_output = compare_json_colored(uploaded_file1, uploaded_file2)
+        file1_bytes = uploaded_file1.getvalue()
+        file2_bytes = uploaded_file2.getvalue()
+        # reruns with the same uploads and diff options reuse the difference;
+        # display options (indentation, collapsing, page size) only re-render it
+        options = {"tolerance": tolerance, "absolute_tolerance": absolute_tolerance,
+                   "align_arrays": align_arrays, "key_paths": key_paths}
+        key = cache_key(hash_bytes(file1_bytes), hash_bytes(file2_bytes), options)
+        diff = diff_uploads(key, file1_bytes, file2_bytes, options)
+        html_output, pages = generate_report(key, indent_size, collapse_identical, int(page_lines), diff, options)
         
         st.subheader("Side-by-Side Comparison with Color Coding")
         st.write("- Green: Added in File 2")
         st.write("- Red/Salmon: Removed (only in File 1)")
         st.write("- Yellow: Changed values")
         
-        st.components.v1.html(html_output, height=800, scrolling=True)
+        # only the selected page is sent to the browser
+        page = st.number_input(f"Page (of {len(pages)})", min_value=1, max_value=len(pages), value=1)
+        st.components.v1.html(pages[page - 1], height=800, scrolling=True)
         
         st.download_button(
             label="Download Comparison as HTML",
@@ -271,6 +94,14 @@ if uploaded_file1 and uploaded_file2:
             file_name="json_comparison.html",
             mime="text/html",
         )
+        st.download_button(
+            label="Download Summary as JSON",
+            data=diff[3],
+            file_name="json_comparison_summary.json",
+            mime="application/json",
+        )
+    except ValueError as e:
+        st.error(f"Error: {str(e)}")
     except Exception as e:
         st.error(f"Error comparing files: {str(e)}")
 else:
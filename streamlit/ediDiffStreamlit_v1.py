@@ -1,38 +1,81 @@
 import streamlit as st
-import difflib
-def generate_side_by_side_diff (file1_content, file2_content):
-    html_diff = difflib.HtmlDiff(tabsize=4, wrapcolumn=80)
+import json
 
-    diff_html = html_diff.make_file(
-        file1_content.splitlines(),
-        file2_content.splitlines(),
+# the compare core is the comparecore package: pip install ./pipelines/scripts
+from comparecore.diff_engine import DEFAULT_ENGINE, ENGINES, diff_opcodes
+from comparecore.diff_report import PAGE_ROWS, SegmentHtmlDiff, iter_unified_diff
+from comparecore.diff_summary import summarize_opcodes
+from comparecore.edi_compare import text_element_separator
+from comparecore.edi_tokenizer import iter_segments_from_text
+from comparecore.result_cache import cache_key, hash_bytes
+
+# comparisons (and their rendered reports) kept across reruns
+CACHE_ENTRIES = 8
+
+# cache_resource hands back the cached object itself instead of unpickling a
+# copy on every rerun; the results are only read. Arguments starting with _
+# are not hashed, the key already stands for them.
+@st.cache_resource(max_entries=CACHE_ENTRIES, show_spinner="Comparing files...")
+def diff_uploads(key, _file1_bytes, _file2_bytes, _engine):
+    """ Segments, element separator and opcodes of two uploads, diffed once per key. """
+    file1_content = _file1_bytes.decode("utf-8")
+    file2_content = _file2_bytes.decode("utf-8")
+    segments1 = list(iter_segments_from_text(file1_content))
+    segments2 = list(iter_segments_from_text(file2_content))
+    separator = text_element_separator(file1_content, file2_content)
+    return segments1, segments2, separator, diff_opcodes(segments1, segments2, engine=_engine)
+
+
+@st.cache_resource(max_entries=CACHE_ENTRIES, show_spinner="Rendering report...")
+def generate_diff_pages(key, collapse, page_rows, _diff):
+    """ Side by side diff split into pages of page_rows rows, optionally collapsed. """
+    segments1, segments2, separator, opcodes = _diff
+    html_diff = SegmentHtmlDiff(tabsize=4, wrapcolumn=80, element_separator=separator)
+    return list(html_diff.iter_pages(
+        segments1,
+        segments2,
         fromdesc="File 1",
-        todesc="File 2"
-    )
-    return diff_html    
+        todesc="File 2",
+        opcodes=opcodes,
+        page_rows=page_rows,
+        collapse=collapse
+    ))
+
+
+@st.cache_resource(max_entries=CACHE_ENTRIES)
+def generate_downloads(key, _diff):
+    """ Unified text diff and JSON summary, rendered from the same opcodes as the pages. """
+    segments1, segments2, _, opcodes = _diff
+    diff_report = "\n".join(iter_unified_diff(segments1, segments2, opcodes, fromfile="File 1", tofile="File 2"))
+    summary = json.dumps(summarize_opcodes(segments1, segments2, opcodes), indent=2)
+    return diff_report, summary
 
 
 st.title("Azure Pipeline tester for EDI File compare")
 
 file1 = st.file_uploader("Upload fist edi file", type=['edi','txt'])
 file2 = st.file_uploader("Upload second edi file", type=['edi','txt'])
+engine = st.selectbox("Diff algorithm", sorted(ENGINES), index=sorted(ENGINES).index(DEFAULT_ENGINE))
+collapse = st.checkbox("Collapse unchanged segments", value=True)
+page_rows = st.number_input("Rows per page", min_value=100, value=PAGE_ROWS, step=100)
 
 if file1 and file2:
-    file1_content = file1.getvalue().decode("utf-8")
-    file2_content = file2.getvalue().decode("utf-8")
+    file1_bytes = file1.getvalue()
+    file2_bytes = file2.getvalue()
+    # reruns with the same uploads and engine reuse the diff; display
+    # options only re-render it
+    key = cache_key(hash_bytes(file1_bytes), hash_bytes(file2_bytes), {"engine": engine})
+    diff = diff_uploads(key, file1_bytes, file2_bytes, engine)
 
-    diff_html = generate_side_by_side_diff(file1_content, file2_content)
+    # only the selected page is sent to the browser
+    diff_pages = generate_diff_pages(key, collapse, int(page_rows), diff)
 
     st.subheader("Comparision Results")
+    page = st.number_input(f"Page (of {len(diff_pages)})", min_value=1, max_value=len(diff_pages), value=1)
     # st.markdown(diff_html, unsafe_allow_html=True)
-    st.components.v1.html(diff_html, height=800, scrolling=True)
+    st.components.v1.html(diff_pages[page - 1], height=800, scrolling=True)
 
-    diff_report = "\n".join(difflib.unified_diff(
-        file1_content.splitlines(),
-        file2_content.splitlines(),
-        fromfile="File 1",
-        tofile="File 2"
-    ))
+    diff_report, summary = generate_downloads(key, diff)
 
     st.download_button(
         label="Diff",data=diff_report,
@@ -40,6 +83,13 @@ if file1 and file2:
         mime="text/plain"
     )
 
+    st.download_button(
+        label="Summary (JSON)",
+        data=summary,
+        file_name="edi_diff_summary.json",
+        mime="application/json"
+    )
+
     # st.markdown(""" 
     #   <style>
     #     div[data-testid="stMarkdown"] code {
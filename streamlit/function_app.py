@@ -2,250 +2,39 @@ import azure.functions as func
 import logging
 import json
 import html
-from dictdiffer import diff
-from azure.storage.blob import BlobServiceClient
 import os
+import time
+
+# the compare core is the comparecore package (package_function_app.py);
+# azure.storage.blob is imported by the request, not at cold start
+from comparecore.diff_budget import DEFAULT_MAX_BYTES, SUMMARY, DiffBudget
+from comparecore.diff_summary import RESULTS_FILE_NAME, SUMMARY_FILE_NAME, batch_summary, summarize_json_diff
+from comparecore.fan_out import (DEFAULT_SHARD_SIZE, QUEUE_SEND_CONCURRENCY, aggregate, failed_shard_records,
+                                 fan_out_enabled, is_complete, jsonl, mark_shard, new_progress, new_run, parse_message,
+                                 progress_blob_name, results_blob_name, run_blob_name, shard_blob_name, summary_blob_name)
+from comparecore.json_compare import compare_json_streams, should_stream
+from comparecore.json_diff import EPSILON, parse_key_paths
+from comparecore.json_stream import STREAM_THRESHOLD_BYTES, is_ndjson, open_chunks
+from comparecore.report_writer import DEFAULT_CHUNK_SIZE, blob_content_settings, upload_chunks
+
+# bytes read from the start of a blob to tell a top level array from other JSON
+ARRAY_PROBE_BYTES = 4096
+
+# fan-out mode (app setting FanOut): shards of pairs go through this queue of the storage account
+SHARD_QUEUE_NAME = "jsoncompare-shards"
+# messages the Functions host gave up on after maxDequeueCount attempts
+POISON_QUEUE_NAME = f"{SHARD_QUEUE_NAME}-poison"
 
 app = func.FunctionApp()
 
-def pretty_format_json(obj, indent=0, indent_size=2):
-    """Pretty format JSON with proper indentation."""
-    if obj is None:
-        return "null"
-    
-    indent_str = " " * indent
-    next_indent = indent + indent_size
-    next_indent_str = " " * next_indent
-    
-    if isinstance(obj, dict):
-        if not obj:  # Empty dict
-          
-            return "{}"
-        
-        result = "{\n"
-        items = list(obj.items())
-        
-        for i, (key, value) in enumerate(items):
-            result += f"{next_indent_str}\"{key}\": {pretty_format_json(value, next_indent, indent_size)}"
-            if i < len(items) - 1:
-              
-                result += ","
-            result += "\n"
-            
-        result += f"{indent_str}}}"
-        return result
-        
-    elif isinstance(obj, list):
-        if not obj:  # Empty list
-            return "[]"
-          
-        result = "[\n"
-        for i, item in enumerate(obj):
-            result += f"{next_indent_str}{pretty_format_json(item, next_indent, indent_size)}"
-            if i < len(obj) - 1:
-                result += ","
-            result += "\n"
-           
-        result += f"{indent_str}]"
-        return result
-        
-    elif isinstance(obj, str):
-        # Escape special characters in string
-        escaped = json.dumps(obj)
-        return escaped
-        
-    else:
-        # For numbers, booleans, etc.
-        return json.dumps(obj)
-
-def color_diff_pretty(obj1, obj2, difference, path=None, indent=0, indent_size=2):
-    """Generate color-coded pretty-printed JSON comparison."""
-
-    path = path or []
-    indent_str = " " * indent
-    next_indent = indent + indent_size
-    next_indent_str = " " * next_indent
-    
-    # Handle cases where one object is None (completely added or removed)
-    if obj1 is None:
-        pretty_obj2 = pretty_format_json(obj2, indent, indent_size)
-        return "null", f'<span style="background-color: lightgreen;">{html.escape(pretty_obj2)}</span>'
-   
-    elif obj2 is None:
-        pretty_obj1 = pretty_format_json(obj1, indent, indent_size)
-        return f'<span style="background-color: lightsalmon;">{html.escape(pretty_obj1)}</span>', "null"
-    
-    if isinstance(obj1, dict) and isinstance(obj2, dict):
-        keys1 = set(obj1.keys())
-        keys2 = set(obj2.keys())
-        all_keys = sorted(list(keys1.union(keys2)))
-        
-        html1 = "{\n"
-        html2 = "{\n"
-        
-        for i, key in enumerate(all_keys):
-            # Key only in obj1 (deleted)
-            if key in keys1 and key not in keys2:
-                pretty_val = pretty_format_json(obj1[key], next_indent, indent_size)
-                html1 += f'{next_indent_str}<span style="background-color: lightsalmon;">"{html.escape(str(key))}": {html.escape(pretty_val)}</span>'
-                if i < len(all_keys) - 1:
-                    html1 += ","
-                html1 += "\n"
-                continue
-                
-            # Key only in obj2 (added)
-            if key not in keys1 and key in keys2:
-                pretty_val = pretty_format_json(obj2[key], next_indent, indent_size)
-                html2 += f'{next_indent_str}<span style="background-color: lightgreen;">"{html.escape(str(key))}": {html.escape(pretty_val)}</span>'
-                if i < len(all_keys) - 1:
-                    html2 += ","
-                html2 += "\n"
-                continue
-            
-            # Key in both dictionaries
-            val1 = obj1.get(key)
-            val2 = obj2.get(key)
-            current_path = path + [key]
-            
-            # Check if this exact path is in the differences
-            path_in_diff = False
-            for d_type, d_path, *_ in difference:
-                if d_path == current_path or (isinstance(d_path, list) and d_path[:len(current_path)] == current_path):
-                    path_in_diff = True
-                    break
-            
-            # Recursive call for nested structures
-            if isinstance(val1, (dict, list)) and isinstance(val2, (dict, list)):
-                s1, s2 = color_diff_pretty(val1, val2, difference, current_path, next_indent, indent_size)
-                html1 += f'{next_indent_str}"{html.escape(str(key))}": {s1}'
-                html2 += f'{next_indent_str}"{html.escape(str(key))}": {s2}'
-            else:
-                # Simple values
-                if val1 == val2:
-                    # Values are identical
-                    pretty_val = html.escape(json.dumps(val1))
-                    html1 += f'{next_indent_str}"{html.escape(str(key))}": {pretty_val}'
-                    html2 += f'{next_indent_str}"{html.escape(str(key))}": {pretty_val}'
-                else:
-                    # Values differ
-                    html1 += f'{next_indent_str}"{html.escape(str(key))}": <span style="background-color: lightyellow;">{html.escape(json.dumps(val1))}</span>'
-                    html2 += f'{next_indent_str}"{html.escape(str(key))}": <span style="background-color: lightyellow;">{html.escape(json.dumps(val2))}</span>'
-            
-            if i < len(all_keys) - 1 and key in keys1:
-                html1 += ","
-            if i < len(all_keys) - 1 and key in keys2:
-                html2 += ","
-                
-        html1 += "\n"
-        html2 += "\n"
-                
-        html1 += f"{indent_str}}}"
-        html2 += f"{indent_str}}}"
-        return html1, html2
-
-    elif isinstance(obj1, list) and isinstance(obj2, list):
-        len1 = len(obj1)
-        len2 = len(obj2)
-        max_len = max(len1, len2)
-        
-        html1 = "[\n"
-        html2 = "[\n"
-        
-        for i in range(max_len):
-            if i < len1 and i < len2:
-                # Element exists in both lists
-                val1 = obj1[i]
-                val2 = obj2[i]
-                current_path = path + [i]
-                
-                if isinstance(val1, (dict, list)) and isinstance(val2, (dict, list)):
-                    s1, s2 = color_diff_pretty(val1, val2, difference, current_path, next_indent, indent_size)
-                    html1 += f"{next_indent_str}{s1}"
-                    html2 += f"{next_indent_str}{s2}"
-                elif val1 == val2:
-                    # Values are identical
-                    pretty_val = html.escape(json.dumps(val1))
-                    html1 += f"{next_indent_str}{pretty_val}"
-                    html2 += f"{next_indent_str}{pretty_val}"
-                else:
-                    # Values differ
-                    html1 += f'{next_indent_str}<span style="background-color: lightyellow;">{html.escape(json.dumps(val1))}</span>'
-                    html2 += f'{next_indent_str}<span style="background-color: lightyellow;">{html.escape(json.dumps(val2))}</span>'
-            elif i < len1:
-                # Element only in obj1 (deleted)
-                pretty_val = pretty_format_json(obj1[i], next_indent, indent_size)
-                html1 += f'{next_indent_str}<span style="background-color: lightsalmon;">{html.escape(pretty_val)}</span>'
-                # No corresponding element in html2
-            else:
-                # Element only in obj2 (added)
-                pretty_val = pretty_format_json(obj2[i], next_indent, indent_size)
-                html2 += f'{next_indent_str}<span style="background-color: lightgreen;">{html.escape(pretty_val)}</span>'
-                # No corresponding element in html1
-                
-            if i < max_len - 1:
-                if i < len1 - 1:
-                    html1 += ","
-                if i < len2 - 1:
-                    html2 += ","
-                    
-            html1 += "\n"
-            html2 += "\n"
-                    
-        html1 += f"{indent_str}]"
-        html2 += f"{indent_str}]"
-        return html1, html2
-    else:
-        # Simple values
-        if obj1 == obj2:
-            pretty_val = html.escape(json.dumps(obj1))
-            return pretty_val, pretty_val
-        else:
-            return f'<span style="background-color: lightyellow;">{html.escape(json.dumps(obj1))}</span>', f'<span style="background-color: lightyellow;">{html.escape(json.dumps(obj2))}</span>'
+def _containers(connect_str):
+    from azure.storage.blob import BlobServiceClient
 
-def compare_json_colored(file1, file2):
-    try:
-        data1 = json.load(file1)
-        data2 = json.load(file2)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON file: {str(e)}")
-    difference = list(diff(data1, data2))
-    colored_json1, colored_json2 = color_diff_pretty(data1, data2, difference)
-
-    html_output = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>JSON Comparison (Colored Diff)</title>
-        <style>
-            body {{ font-family: monospace; display: flex; margin: 0; padding: 0; }}
-            .container {{ flex: 1; padding: 20px; border: 1px solid #ccc; margin: 10px; overflow: auto; }}
-            h2 {{ text-align: center; font-family: sans-serif; }}
-            pre {{ white-space: pre-wrap; font-size: 14px; line-height: 1.5; }}
-            .legend {{ display: flex; justify-content: center; margin-bottom: 15px; font-family: sans-serif; }}
-            .legend-item {{ margin: 0 10px; padding: 2px 8px; border-radius: 3px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h2>File 1</h2>
-            <div class="legend">
-                <span class="legend-item" style="background-color: lightsalmon;">Removed</span>
-                <span class="legend-item" style="background-color: lightyellow;">Changed</span>
-            </div>
-            <pre>{colored_json1}</pre>
-        </div>
-        <div class="container">
-            <h2>File 2</h2>
-            <div class="legend">
-                <span class="legend-item" style="background-color: lightgreen;">Added</span>
-                <span class="legend-item" style="background-color: lightyellow;">Changed</span>
-            </div>
-            <pre>{colored_json2}</pre>
-        </div>
-    </body>
-    </html>
-    """
-    return html_output
+    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
+    from_container = blob_service_client.get_container_client("fromdata")
+    to_container = blob_service_client.get_container_client("todata")
+    results_container = blob_service_client.get_container_client("jsoncompareresults")  #Ensure correct container name
+    return from_container, to_container, results_container
 
 @app.function_name(name="JsonCompare")
 @app.route(route="compare_json", auth_level=func.AuthLevel.ANONYMOUS)
@@ -259,55 +48,311 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500
         )
 
-    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-    from_container = blob_service_client.get_container_client("fromdata")
-    to_container = blob_service_client.get_container_client("todata")
-    results_container = blob_service_client.get_container_client("jsoncompareresults")  #Ensure correct container name
+    from_container, to_container, results_container = _containers(connect_str)
 
     try:
+        if fan_out_enabled():
+            # the batch is compared by the JsonCompareShard instances; the caller polls the summary blob
+            run = start_json_fan_out(connect_str, from_container, to_container, results_container)
+            return func.HttpResponse(json.dumps({key: run[key] for key in ("run_id", "items", "shards", "summary")}),
+                                     status_code=202, mimetype="application/json")
         process_json_files_azure(from_container, to_container, results_container)
         return func.HttpResponse("JSON comparison completed", status_code=200)
     except Exception as e:
         logging.error(f"Error processing files: {str(e)}")
         return func.HttpResponse(f"Error processing files: {str(e)}", status_code=500)
 
-def process_json_files_azure(from_container, to_container, results_container):
-    from_blobs = list(from_container.list_blobs(name_starts_with="file"))  # List all blobs in from container
+def blobs_identical_by_properties(from_props, to_props):
+    """ True when listing metadata proves two blobs hold the same bytes.
+
+    Only Content-MD5 (with matching size) is trusted: ETags are per blob and
+    never match across containers. Blobs without a stored MD5 are downloaded.
+    """
+    if from_props.size != to_props.size:
+        return False
+    from_md5 = from_props.content_settings.content_md5
+    to_md5 = to_props.content_settings.content_md5
+    return bool(from_md5) and from_md5 == to_md5
 
-    for from_blob in from_blobs:
+def identical_json_report(from_name, to_name):
+    """HTML report for a pair known to be identical without downloading it."""
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>JSON Comparison (Colored Diff)</title>
+    </head>
+    <body style="font-family: sans-serif;">
+        <h2>No differences found</h2>
+        <p>{html.escape(from_name)} and {html.escape(to_name)} have the same size and Content-MD5.</p>
+    </body>
+    </html>
+    """
+
+def too_large_json_report(from_name, to_name, reason):
+    """HTML report for a pair over the size budget that was not downloaded."""
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>JSON Comparison (Colored Diff)</title>
+    </head>
+    <body style="font-family: sans-serif;">
+        <h2>Not compared</h2>
+        <p>{html.escape(from_name)} and {html.escape(to_name)}: {html.escape(reason)}. Only NDJSON and top level
+        arrays are compared at this size, one element at a time.</p>
+    </body>
+    </html>
+    """
+
+def blob_starts_with_array(container, blob_name, size):
+    """True when a blob holds a top level JSON array, from a range read of its first bytes only."""
+    if not size:
+        return False
+    head = container.get_blob_client(blob_name).download_blob(offset=0, length=ARRAY_PROBE_BYTES).readall()
+    return head.lstrip()[:1] == b"["
+
+def json_work_item(from_blob, to_blobs):
+    """Work item of a listed fromdata blob, JSON serializable so it can be queued.
+
+    Returns the final result record instead (with "status" set) when todata
+    has no matching blob, and None when the blob name has no UUID.
+    """
+    # Extract UUID from filename
+    parts_from = from_blob.name.split('_')
+    if len(parts_from) < 2:
+        logging.warning(f"Skipping file {from_blob.name}: Filename does not contain expected '_' separator.")
+        return None
+
+    uuid_part = parts_from[1].split('.')[0]
+    base_name = parts_from[0]
+
+    # Construct the matching 'toData' blob name
+    extension = os.path.splitext(from_blob.name)[1] if is_ndjson(from_blob.name) else ".json"  #Expect .json extension unless NDJSON
+    to_blob_name = f"{base_name}bla_{uuid_part}{extension}"
+    to_blob = to_blobs.get(to_blob_name)
+    report_blob_name = f"{base_name}_{uuid_part}_report.html"
+
+    if to_blob is None:
+        logging.warning(f"No matching file found in 'toData' for {from_blob.name} (expected: {to_blob_name})")
+        return {"from_blob": from_blob.name, "to_blob": to_blob_name, "report": report_blob_name,
+                "status": "unmatched", "outcome": None, "bytes": from_blob.size, "diff": None, "seconds": 0.0}
+    return {"from_blob": from_blob.name, "to_blob": to_blob_name, "report": report_blob_name,
+            "from_bytes": from_blob.size, "to_bytes": to_blob.size,
+            "identical": blobs_identical_by_properties(from_blob, to_blob)}
+
+def list_json_work_items(from_container, to_container):
+    """Yield the work items of the fromdata / todata containers (see json_work_item)."""
+    # List the to container once instead of one exists() request per pair
+    to_blobs = {blob.name: blob for blob in to_container.list_blobs()}
+    for from_blob in from_container.list_blobs(name_starts_with="file"):  # List all blobs in from container
         try:
-            # Extract UUID from filename
-            parts_from = from_blob.name.split('_')
-            if len(parts_from) < 2:
-                logging.warning(f"Skipping file {from_blob.name}: Filename does not contain expected '_' separator.")
-                continue
+            item = json_work_item(from_blob, to_blobs)
+        except Exception as e:
+            logging.error(f"Error comparing {from_blob.name}: {str(e)}")
+            item = {"from_blob": from_blob.name, "status": "error", "error": str(e)}
+        if item is not None:
+            yield item
+
+def compare_json_item(from_container, to_container, results_container, item):
+    """Compare one work item, upload its HTML report and return its result record.
+
+    A pair whose listed sizes are over DiffMaxBytes is only compared when it
+    can be streamed (NDJSON or two top level arrays); otherwise neither blob
+    is downloaded and the record is marked degraded. A failing pair is
+    logged and recorded, never raised.
+    """
+    from_blob_name = item["from_blob"]
+    to_blob_name = item["to_blob"]
+    report_blob_name = item["report"]
+    try:
+        result = {"from_blob": from_blob_name, "to_blob": to_blob_name, "report": report_blob_name,
+                  "status": "ok", "outcome": None, "bytes": item["from_bytes"], "diff": None}
+        pair_started = time.perf_counter()
+        ndjson = is_ndjson(from_blob_name)
+        max_bytes = int(os.environ.get("DiffMaxBytes", DEFAULT_MAX_BYTES))
+        over_budget = DiffBudget(max_bytes=max_bytes).too_large(item["from_bytes"] + item["to_bytes"])
+
+        if item["identical"]:
+            # Same bytes on both sides, no need to download either blob
+            results_container.upload_blob(name=report_blob_name, data=identical_json_report(from_blob_name, to_blob_name),
+                                          content_settings=blob_content_settings("text/html"), overwrite=True)
+            logging.info(f"{from_blob_name} and {to_blob_name} have the same Content-MD5 -> {report_blob_name}")
+            result["outcome"] = "identical"
+            result["bytes"] += item["to_bytes"]
+            result["diff"] = summarize_json_diff([])
+
+        elif over_budget and not ndjson and not (
+                blob_starts_with_array(from_container, from_blob_name, item["from_bytes"])
+                and blob_starts_with_array(to_container, to_blob_name, item["to_bytes"])):
+            # too large to load and not streamable, decided before downloading either blob
+            reason = f"inputs exceed {max_bytes} bytes"
+            results_container.upload_blob(name=report_blob_name,
+                                          data=too_large_json_report(from_blob_name, to_blob_name, reason),
+                                          content_settings=blob_content_settings("text/html"), overwrite=True)
+            logging.warning(f"{from_blob_name} and {to_blob_name} not compared: {reason}")
+            result["outcome"] = "too_large"
+            result["bytes"] += item["to_bytes"]
+            result["diff"] = {"strategy": SUMMARY, "degraded": True, "degraded_reason": reason}
+
+        else:
+            # pair array elements by key path / content unless AlignJsonArrays is off
+            align_arrays = os.environ.get("AlignJsonArrays", "true").lower() in ("1", "true", "yes")
+            key_paths = parse_key_paths(os.environ.get("JsonArrayKeyPaths", ""))
+            collapse_identical = os.environ.get("CollapseIdenticalJson", "false").lower() in ("1", "true", "yes")
+            # numbers within these tolerances (math.isclose) are not reported as changed
+            tolerance = float(os.environ.get("JsonRelativeTolerance", EPSILON))
+            absolute_tolerance = float(os.environ.get("JsonAbsoluteTolerance", 0)) or None
+
+            # Download file contents as streams instead of readall()
+            from_stream = open_chunks(from_container.get_blob_client(from_blob_name).download_blob().chunks())
+            to_stream = open_chunks(to_container.get_blob_client(to_blob_name).download_blob().chunks())
+
+            # NDJSON and large top level arrays are compared element by element in bounded memory,
+            # always when over DiffMaxBytes
+            stream_bytes = int(os.environ.get("StreamJsonBytes", STREAM_THRESHOLD_BYTES))
+            streamed = over_budget or should_stream(from_stream, to_stream, item["from_bytes"] + item["to_bytes"],
+                                                    ndjson, stream_bytes)
+            report, summary = compare_json_streams(from_stream, to_stream, streamed, ndjson,
+                                                   collapse_identical=collapse_identical, align_arrays=align_arrays,
+                                                   key_paths=key_paths, tolerance=tolerance,
+                                                   absolute_tolerance=absolute_tolerance)
+
+            # Generate the HTML report and stream it to blob storage in staged blocks
+            upload_chunks(
+                results_container.get_blob_client(report_blob_name),
+                report,
+                chunk_size=int(os.environ.get("ReportChunkSize", DEFAULT_CHUNK_SIZE)),
+                gzip_encode=os.environ.get("GzipReports", "false").lower() in ("1", "true", "yes")
+            )
+
+            logging.info(f"Comparison report generated for {from_blob_name} and {to_blob_name} -> {report_blob_name}")
+            result["outcome"] = "compared"
+            result["streamed"] = streamed
+            result["bytes"] += item["to_bytes"]
+            result["diff"] = summary()
 
-            uuid_part = parts_from[1].split('.')[0]
-            base_name = parts_from[0]
+        result["seconds"] = round(time.perf_counter() - pair_started, 3)
+        return result
 
-            # Construct the matching 'toData' blob name
-            to_blob_name = f"{base_name}bla_{uuid_part}.json"  #Expect .json extension
-            to_blob_client = to_container.get_blob_client(to_blob_name)
+    except Exception as e:
+        logging.error(f"Error comparing {from_blob_name}: {str(e)}")
+        return {"from_blob": from_blob_name, "status": "error", "error": str(e)}
 
-            if to_blob_client.exists():
-                # Download file contents
-                from_content = from_container.get_blob_client(from_blob.name).download_blob().readall()
-                to_content = to_container.get_blob_client(to_blob_name).download_blob().readall()
+def process_json_files_azure(from_container, to_container, results_container):
+    """Compare matching JSON blobs, upload one HTML report per pair plus
+    results.jsonl (one record per pair) and summary.json. Returns the records."""
+    started = time.perf_counter()
+    results = []
+    for item in list_json_work_items(from_container, to_container):
+        results.append(item if "status" in item else compare_json_item(from_container, to_container, results_container, item))
 
-                # Decode content
-                from_content_str = from_content.decode('utf-8')
-                to_content_str = to_content.decode('utf-8')
+    # machine readable results next to the reports
+    results_container.upload_blob(name=RESULTS_FILE_NAME, data=jsonl(results),
+                                  content_settings=blob_content_settings("application/x-ndjson"), overwrite=True)
+    results_container.upload_blob(name=SUMMARY_FILE_NAME, data=json.dumps(batch_summary(results, time.perf_counter() - started), indent=2),
+                                  content_settings=blob_content_settings("application/json"), overwrite=True)
+    return results
 
-                # Perform JSON comparison and generate HTML report
-                html_report = compare_json_colored(file1=io.StringIO(from_content_str), file2=io.StringIO(to_content_str))
+def start_json_fan_out(connect_str, from_container, to_container, results_container):
+    """List the batch, record a fan-out run and enqueue its shards; returns the run record.
 
-                # Upload the HTML report
-                report_blob_name = f"{base_name}_{uuid_part}_report.html"
-                results_container.upload_blob(name=report_blob_name, data=html_report, content_type="text/html")
+    Every shard of FanOutShardSize work items becomes one message of
+    SHARD_QUEUE_NAME for JsonCompareShard; the completion record is written
+    to the run's summary.json in jsoncompareresults (see fan_out).
+    """
+    from azure.core.exceptions import ResourceExistsError
+    from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+    from concurrent.futures import ThreadPoolExecutor
 
-                logging.info(f"Comparison report generated for {from_blob.name} and {to_blob_name} -> {report_blob_name}")
+    items = []
+    records = []
+    for item in list_json_work_items(from_container, to_container):
+        (records if "status" in item else items).append(item)
+    run, messages = new_run("json", items, records, shard_size=int(os.environ.get("FanOutShardSize", DEFAULT_SHARD_SIZE)))
+    results_container.upload_blob(name=run_blob_name(run["run_id"]), data=json.dumps(run, indent=2),
+                                  content_settings=blob_content_settings("application/json"), overwrite=True)
+    results_container.upload_blob(name=progress_blob_name(run["run_id"]), data=new_progress(run["shards"]),
+                                  content_settings=blob_content_settings("application/octet-stream"), overwrite=True)
+    logging.info(f"Fan-out run {run['run_id']}: {len(items)} pairs in {len(messages)} shards")
+    if not messages:
+        complete_json_run(results_container, run["run_id"])
+        return run
 
-            else:
-                logging.warning(f"No matching file found in 'toData' for {from_blob.name} (expected: {to_blob_name})")
+    # base64 encoded, as the queue trigger expects
+    queue_client = QueueClient.from_connection_string(connect_str, SHARD_QUEUE_NAME,
+                                                      message_encode_policy=TextBase64EncodePolicy())
+    try:
+        queue_client.create_queue()
+    except ResourceExistsError:
+        pass
+    with ThreadPoolExecutor(max_workers=QUEUE_SEND_CONCURRENCY) as pool:
+        list(pool.map(queue_client.send_message, messages))
+    return run
+
+@app.function_name(name="JsonCompareShard")
+@app.queue_trigger(arg_name="msg", queue_name=SHARD_QUEUE_NAME, connection="BlobStorageConnectionString")
+def compare_shard(msg: func.QueueMessage) -> None:
+    message = parse_message(msg.get_body())
+    logging.info(f"Run {message['run_id']} shard {message['shard']}: {len(message['items'])} pairs (attempt {msg.dequeue_count})")
+    from_container, to_container, results_container = _containers(os.environ["BlobStorageConnectionString"])
+    run_json_shard(from_container, to_container, results_container, message)
+
+@app.function_name(name="JsonCompareShardFailed")
+@app.queue_trigger(arg_name="msg", queue_name=POISON_QUEUE_NAME, connection="BlobStorageConnectionString")
+def record_failed_shard(msg: func.QueueMessage) -> None:
+    # the shard kept failing (e.g. timed out), record its pairs so the run still completes
+    message = parse_message(msg.get_body())
+    logging.error(f"Run {message['run_id']} shard {message['shard']} failed, recording its pairs as errors")
+    _, _, results_container = _containers(os.environ["BlobStorageConnectionString"])
+    finish_json_shard(results_container, message, failed_shard_records(message, "shard failed after the queue's retries"))
+
+def run_json_shard(from_container, to_container, results_container, message):
+    """Compare the work items of one shard message and record their results."""
+    results = [compare_json_item(from_container, to_container, results_container, item) for item in message["items"]]
+    finish_json_shard(results_container, message, results)
+
+def finish_json_shard(results_container, message, results):
+    """Write the result records of a shard; the shard completing the run writes the completion record."""
+    results_container.upload_blob(name=shard_blob_name(message["run_id"], message["shard"]), data=jsonl(results),
+                                  content_settings=blob_content_settings("application/x-ndjson"), overwrite=True)
+    if mark_json_shard_done(results_container, message):
+        complete_json_run(results_container, message["run_id"])
+
+def mark_json_shard_done(results_container, message):
+    """Set the bit of a shard in its run's progress blob; True for the one shard that is to complete the run.
+
+    The write is conditional on the etag read (If-Match), so shards finishing
+    together never drop each other's bit and only one sees the last bit set.
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceModifiedError
+
+    run_id = message["run_id"]
+    progress_blob = results_container.get_blob_client(progress_blob_name(run_id))
+    while True:
+        download = progress_blob.download_blob()
+        progress, marked = mark_shard(download.readall(), message["shard"])
+        if not marked:
+            # a retried message: complete the run only if the shard completing it failed to
+            return (is_complete(message["shards"], progress)
+                    and not results_container.get_blob_client(summary_blob_name(run_id)).exists())
+        try:
+            progress_blob.upload_blob(progress, overwrite=True, etag=download.properties.etag,
+                                      match_condition=MatchConditions.IfNotModified)
+        except ResourceModifiedError:
+            # another shard wrote in between, read its bit too
+            continue
+        return is_complete(message["shards"], progress)
 
-        except
+def complete_json_run(results_container, run_id):
+    """Aggregate the shards of a run into results.jsonl and summary.json (see mark_json_shard_done)."""
+    run = json.loads(results_container.download_blob(run_blob_name(run_id)).readall())
+    shard_texts = [results_container.download_blob(shard_blob_name(run_id, shard)).readall().decode("utf-8")
+                   for shard in range(run["shards"])]
+    results, summary = aggregate(run, shard_texts)
+    results_container.upload_blob(name=results_blob_name(run_id), data=jsonl(results),
+                                  content_settings=blob_content_settings("application/x-ndjson"), overwrite=True)
+    results_container.upload_blob(name=summary_blob_name(run_id), data=json.dumps(summary, indent=2),
+                                  content_settings=blob_content_settings("application/json"), overwrite=True)
+    logging.info(f"Fan-out run {run_id} completed: {summary['pairs']} pairs, {summary['failed']} failed")
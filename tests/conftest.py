@@ -0,0 +1,5 @@
+""" Puts pipelines/scripts on sys.path, so the tests import comparecore from a clean checkout without installing it. """
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipelines", "scripts"))
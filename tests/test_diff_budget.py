@@ -0,0 +1,86 @@
+""" Diff budget: a pair over its time or size budget falls back to a block diff or a summary. """
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from comparecore import diff_budget
+from comparecore.diff_budget import (BLOCK, FULL, SUMMARY, DiffBudget, block_hash_opcodes, budgeted_opcodes,
+                                     multiset_summary)
+from comparecore.diff_engine import DiffTimeout
+from comparecore.edi_compare import compare_segment_streams, compare_segments
+from test_diff_engine import apply_opcodes
+
+FROM_LINES = [f"LIN*{i}*{i % 13}" for i in range(400)]
+TO_LINES = FROM_LINES[:100] + ["DTM*011*20200101"] + FROM_LINES[100:300] + FROM_LINES[310:]
+
+
+def time_out(deadline):
+    raise DiffTimeout("diff exceeded its time budget")
+
+
+class BudgetedOpcodesTest(unittest.TestCase):
+
+    def test_within_budget_is_the_full_diff(self):
+        opcodes, strategy, reason = budgeted_opcodes(FROM_LINES, TO_LINES, budget=DiffBudget())
+        self.assertEqual((FULL, None), (strategy, reason))
+        self.assertEqual(TO_LINES, apply_opcodes(FROM_LINES, TO_LINES, opcodes))
+
+    def test_full_diff_over_time_falls_back_to_block_diff(self):
+        opcodes, strategy, reason = budgeted_opcodes(FROM_LINES, TO_LINES, budget=DiffBudget(5), diff=time_out)
+        self.assertEqual(BLOCK, strategy)
+        self.assertIn("5s", reason)
+        self.assertEqual(TO_LINES, apply_opcodes(FROM_LINES, TO_LINES, opcodes))
+
+    def test_block_diff_over_time_leaves_a_summary(self):
+        with mock.patch.object(diff_budget, "block_hash_opcodes", side_effect=DiffTimeout("late")):
+            opcodes, strategy, _ = budgeted_opcodes(FROM_LINES, TO_LINES, diff=time_out)
+        self.assertIsNone(opcodes)
+        self.assertEqual(SUMMARY, strategy)
+
+    def test_block_diff_keeps_unchanged_blocks(self):
+        opcodes = block_hash_opcodes(FROM_LINES, TO_LINES, block_size=8)
+        self.assertEqual(TO_LINES, apply_opcodes(FROM_LINES, TO_LINES, opcodes))
+        self.assertGreater(sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal"), 300)
+
+    def test_zero_disables_the_limits(self):
+        budget = DiffBudget(0, 0)
+        self.assertIsNone(budget.deadline(0))
+        self.assertFalse(budget.too_large(10 ** 12))
+
+    def test_multiset_summary(self):
+        summary = multiset_summary(iter(["A", "B", "B"]), iter(["B", "C", "C"]))
+        self.assertEqual((3, 3, 2, 2), (summary["segments_from"], summary["segments_to"], summary["removed"],
+                                        summary["added"]))
+
+
+class CompareSegmentsTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.output_path = tempfile.mkstemp(suffix=".html")
+        os.close(handle)
+        self.addCleanup(os.remove, self.output_path)
+
+    def test_degraded_summary(self):
+        with mock.patch.object(diff_budget, "block_hash_opcodes", side_effect=DiffTimeout("late")):
+            summary = compare_segments(FROM_LINES, TO_LINES, self.output_path, "from", "to", diff=time_out)
+        self.assertTrue(summary["degraded"])
+        self.assertEqual(SUMMARY, summary["strategy"])
+        with open(self.output_path) as report:
+            self.assertIn("Only a summary was produced", report.read())
+
+    def test_full_summary(self):
+        summary = compare_segments(FROM_LINES, TO_LINES, self.output_path, "from", "to")
+        self.assertFalse(summary["degraded"])
+        self.assertEqual((1, 10), (summary["added"], summary["removed"]))
+
+    def test_inputs_over_max_bytes_are_only_counted(self):
+        summary = compare_segment_streams(iter(FROM_LINES), iter(TO_LINES), 2048, self.output_path, "from", "to",
+                                          budget=DiffBudget(max_bytes=1024))
+        self.assertEqual((SUMMARY, True), (summary["strategy"], summary["degraded"]))
+        self.assertIn("1024 bytes", summary["degraded_reason"])
+        self.assertEqual(len(TO_LINES), summary["segments_to"])
+
+
+if __name__ == "__main__":
+    unittest.main()
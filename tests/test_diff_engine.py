@@ -0,0 +1,90 @@
+""" Diff engines: valid opcodes, as difflib.SequenceMatcher would describe the same edit. """
+import difflib
+import random
+import time
+import unittest
+
+from comparecore.diff_engine import ENGINES, DiffTimeout, diff_opcodes
+
+
+def apply_opcodes(a, b, opcodes):
+    """ b rebuilt from a and the opcodes, checking that they cover both sequences in order. """
+    rebuilt = []
+    i = j = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j), (tag, i1, j1, i, j)
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            rebuilt.extend(a[i1:i2])
+        else:
+            rebuilt.extend(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    return rebuilt
+
+
+def matched(opcodes):
+    return sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal")
+
+
+def segment_pairs(count=30, seed=7):
+    """ Random segment sequences with repeated segments and local edits. """
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        a = [f"{rng.choice(['N1', 'REF', 'LIN', 'PO1'])}*{rng.randint(0, 5)}" for _ in range(rng.randint(0, 60))]
+        b = list(a)
+        for _ in range(rng.randint(0, 6)):
+            position = rng.randint(0, len(b))
+            action = rng.choice(["insert", "delete", "replace"])
+            if action == "insert" or not b:
+                b.insert(position, f"DTM*{rng.randint(0, 9)}")
+            elif action == "delete":
+                del b[min(position, len(b) - 1)]
+            else:
+                b[min(position, len(b) - 1)] = f"QTY*{rng.randint(0, 9)}"
+        pairs.append((a, b))
+    return pairs
+
+
+class DiffOpcodesTest(unittest.TestCase):
+
+    def test_difflib_engine_matches_sequence_matcher(self):
+        for a, b in segment_pairs():
+            expected = difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+            self.assertEqual(expected, [tuple(opcode) for opcode in diff_opcodes(a, b, engine="difflib")])
+
+    def test_every_engine_rebuilds_the_second_sequence(self):
+        for engine in ENGINES:
+            for a, b in segment_pairs():
+                with self.subTest(engine=engine, a=a, b=b):
+                    self.assertEqual(b, apply_opcodes(a, b, diff_opcodes(a, b, engine=engine)))
+
+    def test_myers_matches_at_least_as_much_as_difflib(self):
+        # Myers finds a longest common subsequence
+        for a, b in segment_pairs():
+            difflib_opcodes = difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+            self.assertGreaterEqual(matched(diff_opcodes(a, b, engine="myers")), matched(difflib_opcodes))
+
+    def test_one_change_is_one_replace(self):
+        a = [f"LIN*{i}" for i in range(20)]
+        b = list(a)
+        b[10] = "LIN*changed"
+        for engine in ENGINES:
+            self.assertEqual([("equal", 0, 10, 0, 10), ("replace", 10, 11, 10, 11), ("equal", 11, 20, 11, 20)],
+                             diff_opcodes(a, b, engine=engine), engine)
+
+    def test_deadline_raises_diff_timeout(self):
+        a = [str(i % 3) for i in range(200)]
+        b = [str(i % 5) for i in range(200)]
+        for engine in ("myers", "patience", "histogram", "difflib"):
+            with self.assertRaises(DiffTimeout):
+                diff_opcodes(a, b, engine=engine, deadline=time.monotonic() - 1)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            diff_opcodes(["a"], ["b"], engine="nope")
+
+
+if __name__ == "__main__":
+    unittest.main()
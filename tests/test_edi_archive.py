@@ -0,0 +1,57 @@
+""" Zip members as inputs: paired from the central directory and read without extracting them. """
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from comparecore.edi_archive import input_size, is_archive, member_path, open_input, split_member_path
+from comparecore.edi_pairing import build_manifest
+from comparecore.edi_tokenizer import iter_segments, read_delimiters
+
+INTERCHANGE = ("ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECV           *200101*1253*U*00401*000000001*0*P*>~"
+               "ST*850*0001~BEG*00*SA*PO1~SE*3*0001~IEA*1*000000001~")
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.archive_path = os.path.join(self.directory, "from.zip")
+        with zipfile.ZipFile(self.archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("batch/edi_u1.txt", INTERCHANGE)
+            archive.writestr("batch/edi_u2.txt", INTERCHANGE.replace("PO1", "PO2"))
+            archive.writestr("batch/readme.md", "not an interchange")
+        self.to_dir = os.path.join(self.directory, "to")
+        os.mkdir(self.to_dir)
+        for name in ("edibla_u1.txt", "edibla_u3.txt"):
+            with open(os.path.join(self.to_dir, name), "w") as file:
+                file.write(INTERCHANGE)
+
+    def test_member_path(self):
+        path = member_path(self.archive_path, "batch/edi_u1.txt")
+        self.assertEqual((self.archive_path, "batch/edi_u1.txt"), split_member_path(path))
+        self.assertEqual((self.to_dir, None), split_member_path(self.to_dir))
+        self.assertTrue(is_archive(self.archive_path))
+        self.assertFalse(is_archive(self.to_dir))
+
+    def test_member_is_read_like_a_file(self):
+        path = member_path(self.archive_path, "batch/edi_u2.txt")
+        self.assertEqual(len(INTERCHANGE), input_size(path))
+        self.assertEqual("*", read_delimiters(path).element)
+        self.assertIn("BEG*00*SA*PO2", list(iter_segments(path)))
+        with open_input(path) as stream:
+            self.assertEqual(INTERCHANGE.replace("PO1", "PO2").encode(), stream.read())
+
+    def test_members_are_paired_with_files(self):
+        manifest = build_manifest(self.archive_path, self.to_dir)
+        self.assertEqual([{"uuid": "u1", "prefix": "edi", "from_file": member_path(self.archive_path, "batch/edi_u1.txt"),
+                           "to_file": os.path.join(self.to_dir, "edibla_u1.txt")}], manifest["pairs"])
+        self.assertEqual(["edi_u2.txt"], manifest["orphans_from"])
+        self.assertEqual(["edibla_u3.txt"], manifest["orphans_to"])
+        self.assertEqual(["readme.md"], manifest["unmatched"]["from"])
+
+
+if __name__ == "__main__":
+    unittest.main()
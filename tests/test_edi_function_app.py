@@ -0,0 +1,407 @@
+""" Async blob pipeline of the EdiCompare function app, against in-memory aio container clients. """
+import asyncio
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import types
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+try:
+    import azure.functions as func
+    import azure.storage.blob.aio  # noqa: F401
+    from azure.core.exceptions import ResourceModifiedError
+except ImportError:
+    raise unittest.SkipTest("azure-functions and azure-storage-blob are not installed")
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "azurecloudfunction", "function_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("edi_function_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+function_app = load_app()
+
+
+def edi(lines):
+    return ("ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECV           *200101*1253*U*00401*000000001*0*P*>~"
+            + "".join(f"{line}~" for line in lines) + "IEA*1*000000001~").encode()
+
+
+class Gauge:
+    """ Counts calls running at once and remembers the peak. """
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+
+    async def run(self, delay=0.01):
+        self.current += 1
+        self.peak = max(self.peak, self.current)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.current -= 1
+
+
+class FakeDownload:
+    def __init__(self, data, etag=None):
+        self._data = data
+        self.properties = types.SimpleNamespace(etag=etag)
+
+    async def readall(self):
+        return self._data
+
+    async def readinto(self, stream):
+        stream.write(self._data)
+        return len(self._data)
+
+
+class FakeBlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.name = name
+
+    async def download_blob(self, **kwargs):
+        return await self.container.download_blob(self.name, **kwargs)
+
+    async def upload_blob(self, data, overwrite=False, etag=None, match_condition=None, **kwargs):
+        if etag is not None and self.container.on_conditional_write is not None:
+            # another writer gets in between this one's read and write
+            on_conditional_write, self.container.on_conditional_write = self.container.on_conditional_write, None
+            await on_conditional_write()
+        if etag is not None and etag != self.container.etags.get(self.name):
+            raise ResourceModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+        await self.container.upload_blob(self.name, data, overwrite=overwrite)
+
+    async def exists(self):
+        return self.name in self.container.blobs
+
+    async def stage_block(self, block_id, data):
+        await self.container.upload_gauge.run()
+        self.container.staged.setdefault(self.name, {})[block_id] = data
+
+    async def commit_block_list(self, block_list, content_settings=None):
+        staged = self.container.staged.pop(self.name, {})
+        block_ids = [block.id for block in block_list]
+        self.container.committed[self.name] = {"block_ids": block_ids, "content_settings": content_settings}
+        self.container.write(self.name, b"".join(staged[block_id] for block_id in block_ids))
+
+
+class FakeContainer:
+    """ The parts of azure.storage.blob.aio.ContainerClient the pipeline uses. """
+
+    def __init__(self, name, blobs=None, md5=False):
+        self.container_name = name
+        self.blobs = {}
+        self.etags = {}
+        self.writes = []
+        self.md5 = md5
+        self.staged = {}
+        self.committed = {}
+        self.downloads = []
+        self.download_gauge = Gauge()
+        self.upload_gauge = Gauge()
+        self.on_conditional_write = None
+        for blob_name, data in (blobs or {}).items():
+            self.write(blob_name, data)
+
+    def write(self, name, data):
+        self.blobs[name] = data.encode("utf-8") if isinstance(data, str) else data
+        self.etags[name] = f'"{len(self.writes)}"'
+        self.writes.append(name)
+
+    def _properties(self, name):
+        data = self.blobs[name]
+        content_md5 = bytearray(hashlib.md5(data).digest()) if self.md5 else None
+        return types.SimpleNamespace(name=name, size=len(data), etag=f'"{hashlib.md5(data).hexdigest()}"',
+                                     content_settings=types.SimpleNamespace(content_md5=content_md5))
+
+    async def list_blobs(self, name_starts_with=""):
+        for name in sorted(self.blobs):
+            if name.startswith(name_starts_with):
+                yield self._properties(name)
+
+    async def download_blob(self, name, max_concurrency=1, **kwargs):
+        self.downloads.append((name, max_concurrency))
+        await self.download_gauge.run()
+        return FakeDownload(self.blobs[name], self.etags[name])
+
+    async def upload_blob(self, name, data, overwrite=False, **kwargs):
+        assert overwrite or name not in self.blobs, f"{name} already exists"
+        self.write(name, data)
+
+    def get_blob_client(self, name):
+        return FakeBlobClient(self, name)
+
+
+class FakeBlobService:
+    """ azure.storage.blob.aio.BlobServiceClient over fake containers. """
+
+    def __init__(self, *containers):
+        self.containers = {container.container_name: container for container in containers}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def get_container_client(self, name):
+        return self.containers[name]
+
+
+def containers(pairs, md5=False):
+    from_blobs, to_blobs = {}, {}
+    for index, (from_lines, to_lines) in enumerate(pairs):
+        from_blobs[f"edi_u{index}.txt"] = edi(from_lines)
+        to_blobs[f"edibla_u{index}.txt"] = edi(to_lines)
+    return FakeContainer("fromdata", from_blobs, md5), FakeContainer("todata", to_blobs, md5), \
+        FakeContainer("edicompareresults")
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def archive_containers(pairs):
+    from_members = {f"batch/edi_u{index}.txt": edi(from_lines) for index, (from_lines, _) in enumerate(pairs)}
+    to_members = {f"batch/edibla_u{index}.txt": edi(to_lines) for index, (_, to_lines) in enumerate(pairs)}
+    return FakeContainer("fromdata", {"edi_batch.zip": zip_bytes(from_members)}), \
+        FakeContainer("todata", {"edi_batch.zip": zip_bytes(to_members)}), FakeContainer("edicompareresults")
+
+
+def changed_pairs(count, segments=50):
+    return [([f"LIN*{i}*{index}" for i in range(segments)],
+             [f"LIN*{i}*{index + (i % 7 == 0)}" for i in range(segments)]) for index in range(count)]
+
+
+class ProcessAllFilesAzureTest(unittest.TestCase):
+
+    def run_batch(self, from_container, to_container, results_container, **kwargs):
+        return asyncio.run(function_app.process_all_files_azure(from_container, to_container, results_container,
+                                                                **kwargs))
+
+    def test_concurrent_pairs_are_bounded(self):
+        from_container, to_container, results_container = containers(changed_pairs(8))
+        results = self.run_batch(from_container, to_container, results_container, max_concurrent_pairs=3)
+        self.assertEqual(8, len(results))
+        self.assertEqual({"ok"}, {result["status"] for result in results})
+        # one download per pair and container is in flight at a time
+        self.assertEqual(3, from_container.download_gauge.peak)
+        self.assertEqual(3, to_container.download_gauge.peak)
+
+    def test_downloads_pass_blob_max_concurrency(self):
+        from_container, to_container, results_container = containers(changed_pairs(2))
+        self.run_batch(from_container, to_container, results_container, blob_max_concurrency=6)
+        self.assertEqual({("edi_u0.txt", 6), ("edi_u1.txt", 6)}, set(from_container.downloads))
+        self.assertEqual({("edibla_u0.txt", 6), ("edibla_u1.txt", 6)}, set(to_container.downloads))
+
+    def test_concurrent_uploads_are_bounded(self):
+        from_container, to_container, results_container = containers(changed_pairs(6))
+        self.run_batch(from_container, to_container, results_container, max_concurrent_pairs=6,
+                       max_concurrent_uploads=2, report_chunk_size=1024)
+        self.assertEqual(2, results_container.upload_gauge.peak)
+
+    def test_report_is_committed_from_staged_blocks(self):
+        from_container, to_container, results_container = containers(changed_pairs(1, segments=400))
+        results = self.run_batch(from_container, to_container, results_container, report_chunk_size=4096)
+        commit = results_container.committed[results[0]["report"]]
+        report = results_container.blobs[results[0]["report"]]
+        self.assertGreater(len(commit["block_ids"]), 1)
+        self.assertEqual(len(commit["block_ids"]), len(set(commit["block_ids"])))
+        # every block but the last one is full
+        self.assertEqual(-(-len(report) // 4096), len(commit["block_ids"]))
+        self.assertEqual("text/html", commit["content_settings"].content_type)
+        self.assertIsNone(commit["content_settings"].content_encoding)
+        self.assertTrue(report.startswith(b"\n<!DOCTYPE html"))
+        self.assertIn(b"LIN*1*0", report)
+        self.assertEqual({}, results_container.staged)
+
+    def test_gzip_reports(self):
+        from_container, to_container, results_container = containers(changed_pairs(1, segments=400))
+        results = self.run_batch(from_container, to_container, results_container, report_chunk_size=1024,
+                                 gzip_reports=True)
+        commit = results_container.committed[results[0]["report"]]
+        self.assertEqual("gzip", commit["content_settings"].content_encoding)
+        self.assertIn(b"LIN*1*0", gzip.decompress(results_container.blobs[results[0]["report"]]))
+
+    def test_pairs_over_max_bytes_are_not_read_into_memory(self):
+        from_container, to_container, results_container = containers(changed_pairs(2, segments=200))
+        with mock.patch.object(function_app, "download_blob_bytes", side_effect=AssertionError("read into memory")):
+            results = self.run_batch(from_container, to_container, results_container, max_bytes=1000)
+        self.assertEqual(["summary", "summary"], [result["diff"]["strategy"] for result in results])
+        self.assertTrue(all(result["degraded"] for result in results))
+        # 29 of the 200 segments differ, counted from the spooled files
+        self.assertEqual([29, 29], [result["diff"]["added"] for result in results])
+        self.assertIn(b"inputs exceed 1000 bytes", results_container.blobs[results[0]["report"]])
+
+    def test_identical_md5_pairs_are_not_downloaded(self):
+        lines = [f"LIN*{i}" for i in range(20)]
+        from_container, to_container, results_container = containers([(lines, lines)], md5=True)
+        results = self.run_batch(from_container, to_container, results_container)
+        self.assertEqual("identical", results[0]["status"])
+        self.assertEqual([], from_container.downloads + to_container.downloads)
+        self.assertIn(b"No Differences Found", results_container.blobs[results[0]["report"]])
+
+    def test_results_and_summary_are_uploaded(self):
+        from_container, to_container, results_container = containers(changed_pairs(3))
+        from_container.blobs["edi_unmatched.txt"] = edi(["LIN*1"])
+        results = self.run_batch(from_container, to_container, results_container)
+        records = [json.loads(line) for line in results_container.blobs["results.jsonl"].splitlines()]
+        self.assertEqual(sorted(result["from_blob"] for result in results),
+                         sorted(record["from_blob"] for record in records))
+        summary = json.loads(results_container.blobs["summary.json"])
+        self.assertEqual(4, summary["pairs"])
+        self.assertEqual("application/x-ndjson",
+                         results_container.committed["results.jsonl"]["content_settings"].content_type)
+
+
+class ArchivePairsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.containers = {}
+        self.opened = []
+
+        def open_blob_archive(connect_str, container_name, blob_name):
+            self.opened.append((container_name, blob_name))
+            return zipfile.ZipFile(io.BytesIO(self.containers[container_name].blobs[blob_name]))
+
+        patcher = mock.patch.object(function_app, "open_blob_archive", open_blob_archive)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown)
+
+    def run_batch(self, from_container, to_container, results_container):
+        self.containers = {container.container_name: container
+                           for container in (from_container, to_container, results_container)}
+        return asyncio.run(function_app.process_all_files_azure(
+            from_container, to_container, results_container, connect_str="UseDevelopmentStorage=true",
+            max_concurrent_pairs=4, executor=self.executor))
+
+    def test_worker_opens_each_archive_once(self):
+        from_container, to_container, results_container = archive_containers(changed_pairs(5))
+        results = self.run_batch(from_container, to_container, results_container)
+        self.assertEqual(["ok"] * 5, [result["status"] for result in results])
+        self.assertTrue(all(result["diff"]["changed"] for result in results))
+        self.assertIn("edi_batch/edi_u0_report.html", results_container.blobs)
+        # one open to pair the members, one by the worker diffing all five pairs
+        self.assertEqual(2, self.opened.count(("fromdata", "edi_batch.zip")))
+        self.assertEqual(2, self.opened.count(("todata", "edi_batch.zip")))
+
+    def test_replaced_archive_is_reopened(self):
+        from_container, to_container, results_container = archive_containers(changed_pairs(2))
+        self.run_batch(from_container, to_container, results_container)
+        _, replaced_to, _ = archive_containers([(lines, lines) for lines, _ in changed_pairs(2)])
+        to_container.blobs = replaced_to.blobs
+        self.opened.clear()
+        results = self.run_batch(from_container, to_container, results_container)
+        self.assertEqual([0, 0], [result["diff"]["changed"] for result in results])
+        # the worker still has fromdata's archive (same etag) but not the new todata one
+        self.assertEqual([("fromdata", "edi_batch.zip"), ("todata", "edi_batch.zip"), ("todata", "edi_batch.zip")],
+                         sorted(self.opened))
+
+
+compare_shard = function_app.compare_shard._function.get_user_function()
+record_failed_shard = function_app.record_failed_shard._function.get_user_function()
+
+
+class EdiFanOutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = []
+
+        async def send_queue_messages(connect_str, queue_name, messages):
+            self.messages.extend(messages)
+
+        for patcher in (mock.patch.object(function_app, "send_queue_messages", send_queue_messages),
+                        mock.patch("azure.storage.blob.aio.BlobServiceClient.from_connection_string",
+                                   side_effect=lambda connect_str: self.service),
+                        mock.patch.dict(os.environ, {"BlobStorageConnectionString": "UseDevelopmentStorage=true",
+                                                     "FanOutShardSize": "1"})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start_run(self, pairs):
+        self.containers = containers(pairs)
+        self.service = FakeBlobService(*self.containers)
+        return asyncio.run(function_app.start_edi_fan_out("UseDevelopmentStorage=true"))
+
+    def deliver(self, handler, message):
+        return handler(func.QueueMessage(body=message.encode("utf-8")))
+
+    def summary(self, run):
+        results_container = self.containers[2]
+        summary_name = function_app.summary_blob_name(run["run_id"])
+        return json.loads(results_container.blobs[summary_name]), results_container.writes.count(summary_name)
+
+    def test_shards_finishing_together_complete_the_run_once(self):
+        run = self.start_run(changed_pairs(3))
+        self.assertEqual(3, len(self.messages))
+        asyncio.run(self.deliver(compare_shard, self.messages[0]))
+        # shard 2 sets its bit between shard 1 reading and writing the progress blob
+        self.containers[2].on_conditional_write = lambda: self.deliver(compare_shard, self.messages[2])
+        asyncio.run(self.deliver(compare_shard, self.messages[1]))
+        # a retry after completion does not aggregate again
+        asyncio.run(self.deliver(compare_shard, self.messages[1]))
+        summary, writes = self.summary(run)
+        self.assertEqual(1, writes)
+        self.assertEqual(3, summary["pairs"])
+        self.assertEqual(3, summary["with_differences"])
+
+    def test_poison_shard_is_recorded_as_failed(self):
+        run = self.start_run(changed_pairs(2))
+        asyncio.run(self.deliver(record_failed_shard, self.messages[0]))
+        asyncio.run(self.deliver(compare_shard, self.messages[1]))
+        summary, writes = self.summary(run)
+        self.assertEqual(1, writes)
+        self.assertEqual(1, summary["failed"])
+        self.assertEqual({"ok": 1, "error": 1}, summary["outcomes"])
+
+
+class RangeBlobClient:
+    """ A sync BlobClient serving download_blob ranges of data, recording their lengths. """
+
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def download_blob(self, offset, length):
+        self.ranges.append(length)
+        return types.SimpleNamespace(readall=lambda: self.data[offset:offset + length])
+
+
+class BlobRangeFileTest(unittest.TestCase):
+
+    def test_header_probe_reads_small_ranges(self):
+        members = {f"batch/edi_u{index}.txt": edi([f"LIN*{i}*{index}" for i in range(20000)]) for index in range(3)}
+        blob_client = RangeBlobClient(zip_bytes(members))
+        archive = zipfile.ZipFile(function_app.BlobRangeFile(blob_client, len(blob_client.data)))
+        blob_client.ranges.clear()
+        with archive.open("batch/edi_u1.txt") as stream:
+            header = stream.peek(function_app.HEADER_PROBE_SIZE)
+            self.assertTrue(header.startswith(b"ISA*"))
+            self.assertLessEqual(max(blob_client.ranges), 4096)
+            segments = list(function_app.iter_segments_from_stream(
+                stream, delimiters=function_app.detect_delimiters(header.decode()),
+                chunk_size=function_app.ARCHIVE_RANGE_SIZE))
+        self.assertEqual(20002, len(segments))
+        self.assertEqual(segments[1], "LIN*0*1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+""" Loop alignment: repeated loops compared regardless of order. """
+import unittest
+
+from comparecore.edi_loops import align_loops, parse_loops
+
+N1_LOOPS = [["N1*ST*Store", "N3*Main street"], ["N1*BT*Billing", "N3*Side street"], ["N1*SF*Plant"]]
+
+
+def order(*loops):
+    return ["BEG*00*SA*PO1"] + [segment for loop in loops for segment in loop] + ["PO1*1*EA", "CTT*1"]
+
+
+class AlignLoopsTest(unittest.TestCase):
+
+    def test_parse_loops(self):
+        self.assertEqual({"N1": frozenset({"N2", "N3"}), "PO1": None, "REF": frozenset()}, parse_loops("n1:N2|N3,PO1,REF:"))
+        with self.assertRaises(ValueError):
+            parse_loops(" , ")
+
+    def test_reordered_loops_line_up(self):
+        from_lines = order(*N1_LOOPS)
+        to_lines = order(N1_LOOPS[2], N1_LOOPS[0], N1_LOOPS[1])
+        aligned, stats, line_numbers = align_loops(from_lines, to_lines, "*", "N1:N2|N3|N4")
+        self.assertEqual(from_lines, aligned)
+        self.assertEqual({"blocks": 1, "loops": 3, "matched": 3, "moved": 3, "only_from": 0, "only_to": 0}, stats)
+        # aligned segment k is segment line_numbers[k] of the file
+        self.assertEqual(aligned, [to_lines[number - 1] for number in line_numbers])
+
+    def test_changed_loop_is_paired_with_the_one_it_replaces(self):
+        changed = ["N1*BT*Billing", "N3*Other street"]
+        to_lines = order(changed, N1_LOOPS[0], N1_LOOPS[2])
+        aligned, stats, _ = align_loops(order(*N1_LOOPS), to_lines, "*", "N1:N2|N3|N4")
+        self.assertEqual(order(N1_LOOPS[0], changed, N1_LOOPS[2]), aligned)
+        self.assertEqual((2, 1, 1), (stats["matched"], stats["only_from"], stats["only_to"]))
+
+    def test_segments_outside_loops_are_kept(self):
+        from_lines = order(*N1_LOOPS)
+        aligned, stats, line_numbers = align_loops(from_lines, list(from_lines), "*", "REF:")
+        self.assertEqual(from_lines, aligned)
+        self.assertEqual(list(range(1, len(from_lines) + 1)), line_numbers)
+        self.assertEqual(0, stats["blocks"])
+
+
+if __name__ == "__main__":
+    unittest.main()
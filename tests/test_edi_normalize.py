@@ -0,0 +1,61 @@
+""" Normalization rules: masked and dropped envelope elements and segments. """
+import unittest
+
+from comparecore.edi_normalize import DEFAULT_RULES, Normalizer, hash_segments, iter_normalized_text_segments, parse_rules
+
+
+class ParseRulesTest(unittest.TestCase):
+
+    def test_rule_forms(self):
+        self.assertEqual([("ISA", 9, "mask"), ("GS", 4, "drop"), ("SE", None, "drop")],
+                         parse_rules("ISA09, gs04:drop,SE:drop"))
+        self.assertEqual([("ISA", 13, "mask")], parse_rules('["ISA13"]'))
+
+    def test_invalid_rules(self):
+        for rule in ("ISA", "ISA9", "I09", "ISA09:keep"):
+            with self.assertRaises(ValueError, msg=rule):
+                parse_rules(rule)
+
+
+class NormalizerTest(unittest.TestCase):
+
+    def test_mask_keeps_the_element_position(self):
+        self.assertEqual("ST*850*#", Normalizer("ST02").normalize("ST*850*0001", "*"))
+
+    def test_drop_element(self):
+        # several drops of one segment, applied from the right
+        self.assertEqual("GS*PO*RECV", Normalizer("GS02:drop,GS04:drop").normalize("GS*PO*SENDER*RECV*20200101", "*"))
+
+    def test_drop_segment(self):
+        normalizer = Normalizer("SE:drop")
+        self.assertIsNone(normalizer.normalize("SE*3*0001", "*"))
+        self.assertEqual(["ST*850*1", "BEG*00"],
+                         list(normalizer.iter_normalized(["ST*850*1", "SE*3*1", "BEG*00"], "*")))
+
+    def test_other_segments_and_missing_elements_are_kept(self):
+        normalizer = Normalizer("ST05")
+        self.assertEqual("ST*850*0001", normalizer.normalize("ST*850*0001", "*"))
+        self.assertEqual("BEG*00*SA", normalizer.normalize("BEG*00*SA", "*"))
+
+    def test_plain_text_is_not_normalized(self):
+        self.assertEqual(["ST*850*0001"], list(Normalizer("ST02").iter_normalized(["ST*850*0001"], None)))
+
+    def test_spec_is_canonical(self):
+        self.assertEqual(Normalizer("ST02,ISA09").spec, Normalizer(" isa09 , ST02:mask ").spec)
+
+    def test_control_numbers_do_not_change_the_hash(self):
+        interchange = ("ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECV           *{date}*1253*U*00401*{control}*0*P*>~"
+                       "GS*PO*SENDER*RECV*{date}*1253*{control}*X*004010~ST*850*{control}~BEG*00*SA*PO1~SE*3*{control}~"
+                       "GE*1*{control}~IEA*1*{control}~")
+        normalizer = Normalizer(DEFAULT_RULES)
+        first = hash_segments(iter_normalized_text_segments(interchange.format(date="200101", control="000000001"),
+                                                            normalizer))
+        second = hash_segments(iter_normalized_text_segments(interchange.format(date="200102", control="000000002"),
+                                                             normalizer))
+        self.assertEqual(first, second)
+        changed = interchange.replace("PO1", "PO2").format(date="200101", control="000000001")
+        self.assertNotEqual(first, hash_segments(iter_normalized_text_segments(changed, normalizer)))
+
+
+if __name__ == "__main__":
+    unittest.main()
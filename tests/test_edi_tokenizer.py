@@ -0,0 +1,63 @@
+""" EDI tokenizer: segments of one-line and multi-line interchanges, from files, text and streams. """
+import io
+import os
+import tempfile
+import unittest
+
+from comparecore.edi_tokenizer import (LINE_DELIMITERS, detect_delimiters, iter_segments, iter_segments_from_stream,
+                                       iter_segments_from_text, read_delimiters)
+
+ISA = "ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECV           *200101*1253*U*00401*000000001*0*P*>"
+SEGMENTS = [ISA, "GS*PO*SENDER*RECV*20200101*1253*1*X*004010", "ST*850*0001", "BEG*00*SA*PO1**20200101",
+            "SE*3*0001", "GE*1*1", "IEA*1*000000001"]
+
+
+class TokenizerTest(unittest.TestCase):
+
+    def write(self, content):
+        handle, path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(handle, "wb") as file:
+            file.write(content.encode())
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_detect_delimiters(self):
+        delimiters = detect_delimiters("~".join(SEGMENTS))
+        self.assertEqual(("~", "*", ">"), tuple(delimiters))
+        self.assertIs(LINE_DELIMITERS, detect_delimiters("plain text\n"))
+
+    def test_one_line_interchange(self):
+        path = self.write("~".join(SEGMENTS) + "~")
+        self.assertEqual(SEGMENTS, list(iter_segments(path)))
+        self.assertEqual("*", read_delimiters(path).element)
+
+    def test_multi_line_interchange(self):
+        # a line break after each terminator is not part of the segments
+        path = self.write("~\r\n".join(SEGMENTS) + "~\r\n")
+        self.assertEqual(SEGMENTS, list(iter_segments(path)))
+
+    def test_other_delimiters(self):
+        isa = ISA.replace("*", "|").replace(">", "^")
+        content = "\n".join(segment.replace("*", "|") for segment in [isa] + SEGMENTS[1:]) + "\n"
+        path = self.write(content)
+        self.assertEqual("\n", read_delimiters(path).segment)
+        self.assertEqual([isa] + [segment.replace("*", "|") for segment in SEGMENTS[1:]], list(iter_segments(path)))
+
+    def test_plain_text_keeps_physical_lines(self):
+        path = self.write("first\r\n\nthird\n")
+        self.assertEqual(["first", "", "third"], list(iter_segments(path)))
+
+    def test_empty_file(self):
+        self.assertEqual([], list(iter_segments(self.write(""))))
+
+    def test_text_and_stream_split_like_files(self):
+        content = "~\n".join(SEGMENTS) + "~\n"
+        self.assertEqual(SEGMENTS, list(iter_segments_from_text(content)))
+        # tiny chunks make terminators straddle the chunk boundaries
+        for chunk_size in (1, 2, 7, 1024):
+            stream = io.BytesIO(content.encode())
+            self.assertEqual(SEGMENTS, list(iter_segments_from_stream(stream, chunk_size=chunk_size)), chunk_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
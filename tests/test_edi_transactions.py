@@ -0,0 +1,65 @@
+""" ST/SE transaction matching: sets paired by key, diffed one by one, unmatched ones added or removed. """
+import unittest
+
+from comparecore.edi_transactions import parse_key, split_units, transaction_opcodes
+
+
+def transaction(control, po_number, lines=("PO1*1*EA",)):
+    return [f"ST*850*{control}", f"BEG*00*SA*{po_number}", *lines, f"SE*{len(lines) + 3}*{control}"]
+
+
+def interchange(*transactions):
+    segments = ["ISA*00*X", "GS*PO*1"]
+    for segments_of_set in transactions:
+        segments.extend(segments_of_set)
+    return segments + ["GE*1*1", "IEA*1*1"]
+
+
+def changed_segments(from_lines, to_lines, opcodes):
+    return [(from_lines[i1:i2], to_lines[j1:j2]) for tag, i1, i2, j1, j2 in opcodes if tag != "equal"]
+
+
+class TransactionOpcodesTest(unittest.TestCase):
+
+    def test_parse_key(self):
+        self.assertEqual([("BEG", 3), ("ST", 2)], parse_key("beg03, ST02"))
+        for spec in ("", "BEG", "03", "BEGxx"):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_key(spec)
+
+    def test_split_units(self):
+        segments = interchange(transaction("0001", "A"), transaction("0002", "A"))
+        units = split_units(segments, "*", parse_key("BEG03"))
+        self.assertEqual([("envelope", "ISA", 0), ("envelope", "GS", 0), ("transaction", "A", 0),
+                          ("transaction", "A", 1), ("envelope", "GE", 0), ("envelope", "IEA", 0)],
+                         [key for key, _, _ in units])
+        self.assertEqual((2, 6), units[2][1:])
+
+    def test_sets_are_matched_by_key(self):
+        from_lines = interchange(transaction("0001", "A"), transaction("0002", "B"), transaction("0003", "C"))
+        # renumbered sets still match by their PO number, only B's line changed
+        to_lines = interchange(transaction("0101", "A"), transaction("0102", "B", ("PO1*2*EA",)),
+                               transaction("0103", "C"))
+        opcodes, stats = transaction_opcodes(from_lines, to_lines, "*", "*", key="BEG03")
+        self.assertEqual({"from": 3, "to": 3, "matched": 3, "changed": 3, "added": 0, "removed": 0}, stats)
+        self.assertIn((["PO1*1*EA", "SE*4*0002"], ["PO1*2*EA", "SE*4*0102"]),
+                      changed_segments(from_lines, to_lines, opcodes))
+        self.assertNotIn("BEG*00*SA*B", [segment for pair in changed_segments(from_lines, to_lines, opcodes)
+                                        for side in pair for segment in side])
+
+    def test_inserted_set_is_added(self):
+        from_lines = interchange(transaction("0001", "A"), transaction("0002", "B"))
+        to_lines = interchange(transaction("0001", "A"), transaction("0009", "X"), transaction("0002", "B"))
+        opcodes, stats = transaction_opcodes(from_lines, to_lines, "*", "*", key="BEG03")
+        self.assertEqual({"from": 2, "to": 3, "matched": 2, "changed": 0, "added": 1, "removed": 0}, stats)
+        self.assertEqual([([], transaction("0009", "X"))], changed_segments(from_lines, to_lines, opcodes))
+
+    def test_worker_processes_give_the_same_opcodes(self):
+        from_lines = interchange(*[transaction(f"{i:04d}", f"P{i}") for i in range(6)])
+        to_lines = interchange(*[transaction(f"{i:04d}", f"P{i}", (f"PO1*{i % 2}*EA",)) for i in range(6)])
+        self.assertEqual(transaction_opcodes(from_lines, to_lines, "*", "*", key="BEG03"),
+                         transaction_opcodes(from_lines, to_lines, "*", "*", key="BEG03", workers=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
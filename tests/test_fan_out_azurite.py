@@ -0,0 +1,98 @@
+""" Fan-out run of the EdiCompare function app against Azurite: shard queue and poison queue.
+
+Skipped unless AzuriteConnectionString is set, e.g. with Azurite on its
+default ports:
+
+    azurite --silent --location /tmp/azurite &
+    AzuriteConnectionString=UseDevelopmentStorage=true python -m pytest tests/test_fan_out_azurite.py
+
+The fromdata, todata and edicompareresults containers and the shard queues
+of the emulator are used as the app uses them: the test replaces the
+edi* blobs of fromdata / todata and clears both queues.
+"""
+import asyncio
+import json
+import os
+import unittest
+from unittest import mock
+
+CONNECTION_STRING = os.environ.get("AzuriteConnectionString")
+if not CONNECTION_STRING:
+    raise unittest.SkipTest("AzuriteConnectionString is not set")
+
+import azure.functions as func  # noqa: E402
+from azure.core.exceptions import ResourceExistsError  # noqa: E402
+from azure.storage.blob import BlobServiceClient  # noqa: E402
+from azure.storage.queue import QueueClient, TextBase64DecodePolicy, TextBase64EncodePolicy  # noqa: E402
+
+from test_edi_function_app import changed_pairs, edi, function_app  # noqa: E402
+
+record_failed_shard = function_app.record_failed_shard._function.get_user_function()
+
+
+def queue_client(name):
+    client = QueueClient.from_connection_string(CONNECTION_STRING, name,
+                                                message_encode_policy=TextBase64EncodePolicy(),
+                                                message_decode_policy=TextBase64DecodePolicy())
+    try:
+        client.create_queue()
+    except ResourceExistsError:
+        pass
+    return client
+
+
+class AzuriteFanOutTest(unittest.TestCase):
+
+    def setUp(self):
+        blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+        self.containers = {}
+        for name in ("fromdata", "todata", "edicompareresults"):
+            container = blob_service_client.get_container_client(name)
+            try:
+                container.create_container()
+            except ResourceExistsError:
+                pass
+            self.containers[name] = container
+        for name in ("fromdata", "todata"):
+            for blob in self.containers[name].list_blobs(name_starts_with="edi"):
+                self.containers[name].delete_blob(blob.name)
+        for index, (from_lines, to_lines) in enumerate(changed_pairs(3)):
+            self.containers["fromdata"].upload_blob(f"edi_u{index}.txt", edi(from_lines))
+            self.containers["todata"].upload_blob(f"edibla_u{index}.txt", edi(to_lines))
+        self.shard_queue = queue_client(function_app.SHARD_QUEUE_NAME)
+        self.poison_queue = queue_client(function_app.POISON_QUEUE_NAME)
+        self.shard_queue.clear_messages()
+        self.poison_queue.clear_messages()
+        patcher = mock.patch.dict(os.environ, {"BlobStorageConnectionString": CONNECTION_STRING,
+                                               "FanOutShardSize": "1", "DiffWorkers": "1"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_queue_and_poison_queue_complete_the_run(self):
+        run = asyncio.run(function_app.start_edi_fan_out(CONNECTION_STRING))
+        self.assertEqual(3, run["shards"])
+
+        # the host moves a message that kept failing to the poison queue
+        message = next(iter(self.shard_queue.receive_messages(max_messages=1)))
+        self.poison_queue.send_message(message.content)
+        self.shard_queue.delete_message(message)
+
+        asyncio.run(function_app.drain_shard_queue(CONNECTION_STRING))
+        results_container = self.containers["edicompareresults"]
+        summary_client = results_container.get_blob_client(function_app.summary_blob_name(run["run_id"]))
+        self.assertFalse(summary_client.exists())
+
+        for poison_message in self.poison_queue.receive_messages():
+            asyncio.run(record_failed_shard(func.QueueMessage(body=poison_message.content.encode("utf-8"))))
+            self.poison_queue.delete_message(poison_message)
+
+        summary = json.loads(summary_client.download_blob().readall())
+        self.assertEqual(3, summary["pairs"])
+        self.assertEqual(1, summary["failed"])
+        self.assertEqual(2, summary["with_differences"])
+        progress = results_container.download_blob(function_app.progress_blob_name(run["run_id"])).readall()
+        self.assertTrue(function_app.is_complete(run["shards"], progress))
+
+
+if __name__ == "__main__":
+    unittest.main()
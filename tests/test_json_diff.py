@@ -0,0 +1,117 @@
+""" diff_json against dictdiffer.diff, and array alignment. """
+import random
+import unittest
+from unittest import mock
+
+from comparecore import backends
+from comparecore.json_diff import align_lists, diff_json, diff_path_index, parse_key_paths
+
+try:
+    import dictdiffer
+except ImportError:
+    dictdiffer = None
+
+
+def random_value(rng, depth=0):
+    kind = rng.choice(["number", "number", "text", "null", "bool"] + (["dict", "list", "numbers"] if depth < 3 else []))
+    if kind == "number":
+        return rng.choice([rng.randint(0, 3), rng.uniform(0, 10), float("nan")])
+    if kind == "text":
+        return rng.choice(["a", "b", "c"])
+    if kind == "null":
+        return None
+    if kind == "bool":
+        return rng.random() < 0.5
+    if kind == "dict":
+        return {rng.choice("abcdef"): random_value(rng, depth + 1) for _ in range(rng.randint(0, 5))}
+    if kind == "numbers":
+        # long enough for the vectorized numeric compare
+        return [rng.choice([1, 2.5, 10.0]) for _ in range(rng.randint(60, 80))]
+    return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 5))]
+
+
+def mutate(rng, value):
+    if isinstance(value, dict) and value and rng.random() < 0.8:
+        value = dict(value)
+        key = rng.choice(list(value))
+        value[key] = mutate(rng, value[key])
+        return value
+    if isinstance(value, list) and value and rng.random() < 0.8:
+        value = list(value)
+        index = rng.randrange(len(value))
+        value[index] = mutate(rng, value[index])
+        return value
+    if isinstance(value, float) and rng.random() < 0.5:
+        # a change within or just outside the relative tolerance used below
+        return value * rng.choice([1.0000001, 1.01])
+    return random_value(rng)
+
+
+def document_pairs(count=300, seed=3):
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        first = random_value(rng)
+        second = first
+        for _ in range(rng.randint(0, 4)):
+            second = mutate(rng, second)
+        pairs.append((first, second))
+    return pairs
+
+
+@unittest.skipIf(dictdiffer is None, "dictdiffer is not installed")
+class DictdifferParityTest(unittest.TestCase):
+
+    def assert_parity(self, **tolerances):
+        for first, second in document_pairs():
+            with self.subTest(first=first, second=second):
+                expected = list(dictdiffer.diff(first, second, **tolerances))
+                self.assertEqual(repr(expected), repr(list(diff_json(first, second, **tolerances))))
+
+    def test_parity(self):
+        self.assert_parity()
+
+    def test_parity_with_tolerance(self):
+        self.assert_parity(tolerance=1e-3, absolute_tolerance=0.5)
+
+    def test_parity_without_numpy(self):
+        with mock.patch.dict(backends._modules, {"numpy": None}):
+            self.assert_parity(tolerance=1e-3)
+
+
+class AlignListsTest(unittest.TestCase):
+
+    def test_keyed_elements(self):
+        list1 = [{"id": 1, "qty": 1}, {"id": 2, "qty": 1}, {"id": 3, "qty": 1}]
+        list2 = [{"id": 0, "qty": 5}, {"id": 1, "qty": 1}, {"id": 2, "qty": 2}, {"id": 3, "qty": 1}]
+        self.assertEqual([(None, 0), (0, 1), (1, 2), (2, 3)], align_lists(list1, list2, parse_key_paths("id")))
+
+    def test_elements_with_other_keys_are_not_paired(self):
+        self.assertEqual([(0, None), (None, 0)], align_lists([{"id": 1}], [{"id": 2}], [("id",)]))
+
+    def test_unkeyed_elements_are_aligned_by_content(self):
+        list1 = [{"sku": "a"}, {"sku": "b"}, {"sku": "c"}]
+        list2 = [{"sku": "x"}, {"sku": "a"}, {"sku": "b"}, {"sku": "c"}]
+        # "id" is missing from the elements, the LCS pairs them
+        self.assertEqual([(None, 0), (0, 1), (1, 2), (2, 3)], align_lists(list1, list2, [("id",)]))
+
+    def test_numeric_arrays(self):
+        list1 = list(range(100))
+        list2 = [-1] + list(range(100))
+        self.assertEqual([(None, 0)] + [(i, i + 1) for i in range(100)], align_lists(list1, list2))
+
+    def test_inserted_element_is_one_addition(self):
+        first = {"lines": [{"id": i, "qty": i} for i in range(50)]}
+        second = {"lines": [{"id": -1, "qty": 0}] + first["lines"]}
+        # by index every element after the insertion changes
+        self.assertGreater(len(list(diff_json(first, second))), 50)
+        self.assertEqual([("add", "lines", [(0, {"id": -1, "qty": 0})])],
+                         list(diff_json(first, second, align_arrays=True, key_paths=[("id",)])))
+
+    def test_diff_path_index(self):
+        index = diff_path_index([("change", "a.b", (1, 2)), ("add", ["c", 0], [("d", 1)])])
+        self.assertEqual({(), ("a",), ("a", "b"), ("c",), ("c", 0)}, index)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+""" Batch compare of the JsonCompare function app, against in-memory container clients. """
+import hashlib
+import importlib.util
+import json
+import os
+import types
+import unittest
+from unittest import mock
+
+try:
+    import azure.functions as func
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+except ImportError:
+    raise unittest.SkipTest("azure-functions and azure-storage-blob are not installed")
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "streamlit", "function_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("json_function_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+function_app = load_app()
+
+
+class FakeDownload:
+    def __init__(self, container, name, offset=None, length=None):
+        container.downloads.append((name, length))
+        data = container.blobs[name]
+        self._data = data if offset is None else data[offset:offset + length]
+        self.properties = types.SimpleNamespace(etag=container.etags[name])
+
+    def chunks(self):
+        return iter([self._data[offset:offset + 1024] for offset in range(0, len(self._data), 1024)])
+
+    def readall(self):
+        return self._data
+
+
+class FakeBlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.name = name
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        return FakeDownload(self.container, self.name, offset, length)
+
+    def upload_blob(self, data, overwrite=False, etag=None, match_condition=None, **kwargs):
+        if etag is not None and self.container.on_conditional_write is not None:
+            # another writer gets in between this one's read and write
+            on_conditional_write, self.container.on_conditional_write = self.container.on_conditional_write, None
+            on_conditional_write()
+        if etag is not None and etag != self.container.etags.get(self.name):
+            raise ResourceModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+        self.container.upload_blob(self.name, data, overwrite=overwrite)
+
+    def exists(self):
+        return self.name in self.container.blobs
+
+    def stage_block(self, block_id, data):
+        self.container.staged.setdefault(self.name, {})[block_id] = data
+
+    def commit_block_list(self, block_list, content_settings=None):
+        staged = self.container.staged.pop(self.name, {})
+        self.container.write(self.name, b"".join(staged[block.id] for block in block_list), content_settings)
+
+
+class FakeContainer:
+    """ The parts of azure.storage.blob.ContainerClient the app uses. """
+
+    def __init__(self, name, blobs=None, md5=False):
+        self.container_name = name
+        self.blobs = {}
+        self.etags = {}
+        self.writes = []
+        self.md5 = md5
+        self.staged = {}
+        self.content_settings = {}
+        self.downloads = []
+        self.on_conditional_write = None
+        for name, data in (blobs or {}).items():
+            self.write(name, data)
+
+    def write(self, name, data, content_settings=None):
+        self.blobs[name] = data.encode("utf-8") if isinstance(data, str) else data
+        self.content_settings[name] = content_settings
+        self.etags[name] = f'"{len(self.writes)}"'
+        self.writes.append(name)
+
+    def list_blobs(self, name_starts_with=""):
+        for name in sorted(self.blobs):
+            if name.startswith(name_starts_with):
+                data = self.blobs[name]
+                content_md5 = bytearray(hashlib.md5(data).digest()) if self.md5 else None
+                yield types.SimpleNamespace(name=name, size=len(data),
+                                            content_settings=types.SimpleNamespace(content_md5=content_md5))
+
+    def download_blob(self, name, **kwargs):
+        return FakeDownload(self, name)
+
+    def upload_blob(self, name, data, overwrite=False, content_settings=None, **kwargs):
+        if name in self.blobs and not overwrite:
+            raise ResourceExistsError("The specified blob already exists.")
+        self.write(name, data, content_settings)
+
+    def get_blob_client(self, name):
+        return FakeBlobClient(self, name)
+
+
+class FakeQueueClient:
+    def __init__(self):
+        self.messages = []
+
+    def create_queue(self):
+        pass
+
+    def send_message(self, message):
+        self.messages.append(message)
+
+
+def containers(pairs, md5=False):
+    from_blobs = {f"file_{index}.json": json.dumps(first).encode() for index, (first, _) in enumerate(pairs)}
+    to_blobs = {f"filebla_{index}.json": json.dumps(second).encode() for index, (_, second) in enumerate(pairs)}
+    return FakeContainer("fromdata", from_blobs, md5), FakeContainer("todata", to_blobs, md5), \
+        FakeContainer("jsoncompareresults")
+
+
+class ProcessJsonFilesAzureTest(unittest.TestCase):
+
+    def test_rerun_overwrites_reports(self):
+        from_container, to_container, results_container = containers(
+            [({"a": 1}, {"a": 1}), ({"a": 1, "b": [1, 2]}, {"a": 2, "b": [1]})], md5=True)
+        for _ in range(2):
+            results = function_app.process_json_files_azure(from_container, to_container, results_container)
+            self.assertEqual(["identical", "compared"], [result["outcome"] for result in results])
+        self.assertIn(b"No differences found", results_container.blobs["file_0_report.html"])
+        self.assertIn(b"<html", results_container.blobs["file_1_report.html"])
+
+    def test_blobs_have_content_types(self):
+        from_container, to_container, results_container = containers(
+            [({"a": 1}, {"a": 1}), ({"a": 1}, {"a": 2})], md5=True)
+        function_app.process_json_files_azure(from_container, to_container, results_container)
+        content_types = {name: settings.content_type for name, settings in results_container.content_settings.items()}
+        self.assertEqual({"file_0_report.html": "text/html", "file_1_report.html": "text/html",
+                          "results.jsonl": "application/x-ndjson", "summary.json": "application/json"}, content_types)
+
+    def test_pairs_over_max_bytes_are_not_downloaded(self):
+        document = {"orders": [{"id": i, "qty": i} for i in range(100)]}
+        from_container, to_container, results_container = containers([(document, dict(document, total=1))])
+        with mock.patch.dict(os.environ, {"DiffMaxBytes": "1000"}):
+            results = function_app.process_json_files_azure(from_container, to_container, results_container)
+        self.assertEqual("too_large", results[0]["outcome"])
+        self.assertTrue(results[0]["diff"]["degraded"])
+        self.assertIn(b"inputs exceed 1000 bytes", results_container.blobs["file_0_report.html"])
+        # only the first bytes were read, to look for a top level array
+        probes = from_container.downloads + to_container.downloads
+        self.assertEqual({function_app.ARRAY_PROBE_BYTES}, {length for _, length in probes})
+
+    def test_arrays_over_max_bytes_are_streamed(self):
+        items = [{"id": i, "qty": i} for i in range(100)]
+        from_container, to_container, results_container = containers([(items, items[:50] + [{"id": 50}] + items[51:])])
+        with mock.patch.dict(os.environ, {"DiffMaxBytes": "1000"}):
+            results = function_app.process_json_files_azure(from_container, to_container, results_container)
+        self.assertEqual("compared", results[0]["outcome"])
+        self.assertTrue(results[0]["streamed"])
+        self.assertEqual(1, results[0]["diff"]["removed"])
+
+
+main = function_app.main._function.get_user_function()
+compare_shard = function_app.compare_shard._function.get_user_function()
+record_failed_shard = function_app.record_failed_shard._function.get_user_function()
+
+
+class JsonFanOutTest(unittest.TestCase):
+
+    def start_run(self, pairs):
+        self.containers = containers(pairs)
+        queue_client = FakeQueueClient()
+        with mock.patch("azure.storage.queue.QueueClient.from_connection_string", return_value=queue_client), \
+                mock.patch.dict(os.environ, {"FanOutShardSize": "1"}):
+            run = function_app.start_json_fan_out("UseDevelopmentStorage=true", *self.containers)
+        return run, queue_client.messages
+
+    def deliver(self, handler, message):
+        with mock.patch.object(function_app, "_containers", return_value=self.containers), \
+                mock.patch.dict(os.environ, {"BlobStorageConnectionString": "UseDevelopmentStorage=true"}):
+            handler(func.QueueMessage(body=message.encode("utf-8")))
+
+    def summary(self, run):
+        results_container = self.containers[2]
+        summary_name = function_app.summary_blob_name(run["run_id"])
+        return json.loads(results_container.blobs[summary_name]), results_container.writes.count(summary_name)
+
+    def test_retried_shards_complete_the_run_once(self):
+        run, messages = self.start_run([({"a": 1}, {"a": 2}), ({"b": 1}, {"b": 1}), ({"c": [1]}, {"c": []})])
+        self.assertEqual(3, len(messages))
+        for message in [messages[0], messages[1], messages[0], messages[2], messages[2]]:
+            self.deliver(compare_shard, message)
+        summary, writes = self.summary(run)
+        self.assertEqual(1, writes)
+        self.assertEqual(3, summary["pairs"])
+        self.assertEqual(2, summary["with_differences"])
+
+    def test_shards_finishing_together_complete_the_run_once(self):
+        run, messages = self.start_run([({"a": 1}, {"a": 2}), ({"b": 1}, {"b": 2})])
+        # shard 1 sets its bit between shard 0 reading and writing the progress blob
+        self.containers[2].on_conditional_write = lambda: self.deliver(compare_shard, messages[1])
+        self.deliver(compare_shard, messages[0])
+        summary, writes = self.summary(run)
+        self.assertEqual(1, writes)
+        self.assertEqual(2, summary["pairs"])
+
+    def test_poison_shard_is_recorded_as_failed(self):
+        run, messages = self.start_run([({"a": 1}, {"a": 2}), ({"b": 1}, {"b": 2})])
+        self.deliver(compare_shard, messages[0])
+        self.deliver(record_failed_shard, messages[1])
+        summary, writes = self.summary(run)
+        self.assertEqual(1, writes)
+        self.assertEqual(1, summary["failed"])
+        self.assertEqual({"compared": 1, "error": 1}, summary["outcomes"])
+
+    def test_fan_out_setting_starts_a_run(self):
+        self.containers = containers([({"a": 1}, {"a": 2})])
+        request = func.HttpRequest("GET", "/api/compare_json", body=b"")
+        for setting, status_code in (("true", 202), ("no", 200)):
+            with mock.patch("azure.storage.queue.QueueClient.from_connection_string", return_value=FakeQueueClient()), \
+                    mock.patch.object(function_app, "_containers", return_value=self.containers), \
+                    mock.patch.dict(os.environ, {"BlobStorageConnectionString": "UseDevelopmentStorage=true",
+                                                 "FanOut": setting}):
+                self.assertEqual(status_code, main(request).status_code, setting)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+""" Color coded JSON report: each side shows its own values. """
+import unittest
+
+from comparecore.json_report import color_diff_pretty
+
+
+class ToleranceRenderingTest(unittest.TestCase):
+
+    def test_value_within_tolerance_shows_each_side(self):
+        html1, html2 = color_diff_pretty({"price": 10.0}, {"price": 10.004}, [], tolerance=1e-3)
+        self.assertIn("10.0", html1)
+        self.assertNotIn("10.004", html1)
+        self.assertIn("10.004", html2)
+        self.assertNotIn("lightyellow", html2)
+
+    def test_subtree_within_tolerance_shows_each_side(self):
+        first = {"order": {"lines": [{"price": 10.0}]}, "id": 1}
+        second = {"order": {"lines": [{"price": 10.004}]}, "id": 1}
+        html1, html2 = color_diff_pretty(first, second, [], tolerance=1e-3)
+        self.assertNotIn("10.004", html1)
+        self.assertIn("10.004", html2)
+
+    def test_numeric_array_within_tolerance_shows_each_side(self):
+        html1, html2 = color_diff_pretty([1.0, 10.0, 3.0], [1.0, 10.004, 3.0], [], tolerance=1e-3)
+        self.assertNotIn("10.004", html1)
+        self.assertIn("10.004", html2)
+
+    def test_equal_subtree_is_rendered_once_for_both(self):
+        html1, html2 = color_diff_pretty({"a": {"b": [1, 2]}}, {"a": {"b": [1, 2]}}, [])
+        self.assertEqual(html1, html2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+""" Streaming JSON compare: array elements and NDJSON records read one at a time, same report as the whole documents. """
+import io
+import json
+import unittest
+from unittest import mock
+
+from comparecore import backends
+from comparecore.json_diff import diff_json, diff_path
+from comparecore.json_report import iter_json_report
+from comparecore.json_stream import iter_array_items, iter_ndjson, iter_stream_report, open_chunks, starts_with_array
+
+DOCUMENT1 = [{"id": i, "price": i * 1.5, "tags": ["a", "b"][: i % 3], "note": None} for i in range(40)]
+DOCUMENT2 = [dict(item, price=item["price"] + (item["id"] % 9 == 0)) for item in DOCUMENT1[:38]]
+
+
+class ArrayItemsTest(unittest.TestCase):
+
+    def items(self, data, chunk_size):
+        return list(iter_array_items(io.BytesIO(data), chunk_size=chunk_size))
+
+    def test_items_across_chunk_boundaries(self):
+        data = json.dumps([1.25, -3e5, "x,]", {"a": [1, {"b": None}]}, [], 12345678901234567890, True]).encode()
+        expected = json.loads(data)
+        for chunk_size in (1, 3, 16, 1 << 20):
+            with mock.patch.dict(backends._modules, {"ijson": None}):
+                self.assertEqual(expected, self.items(data, chunk_size), chunk_size)
+
+    def test_ijson_backend(self):
+        if backends.ijson() is None:
+            self.skipTest("ijson is not installed")
+        self.assertEqual(DOCUMENT1, self.items(json.dumps(DOCUMENT1).encode(), 1024))
+
+    def test_invalid_input(self):
+        with mock.patch.dict(backends._modules, {"ijson": None}):
+            for data in (b'{"a": 1}', b"[1, 2", b"[1 2]"):
+                with self.assertRaises(ValueError, msg=data):
+                    self.items(data, 4)
+
+    def test_ndjson_and_chunks(self):
+        data = b"".join(json.dumps(item).encode() + b"\n\n" for item in DOCUMENT1)
+        stream = open_chunks(iter([data[offset:offset + 100] for offset in range(0, len(data), 100)]))
+        self.assertFalse(starts_with_array(stream))
+        self.assertEqual(DOCUMENT1, list(iter_ndjson(stream)))
+        self.assertTrue(starts_with_array(open_chunks(iter([b" \n [1, ", b"2]"]))))
+
+
+class StreamReportTest(unittest.TestCase):
+
+    def test_same_report_and_differences_as_whole_documents(self):
+        differences = []
+        streamed = "".join(iter_stream_report(iter(DOCUMENT1), iter(DOCUMENT2), differences.append))
+        self.assertEqual("".join(iter_json_report(DOCUMENT1, DOCUMENT2)), streamed)
+        # the elements missing from DOCUMENT2 come as one remove record each
+        removed = [record for record in differences if record[0] == "remove"]
+        self.assertEqual([("remove", "", [(38, DOCUMENT1[38])]), ("remove", "", [(39, DOCUMENT1[39])])], removed)
+        changes = [(kind, list(diff_path(d_path)), detail) for kind, d_path, detail in diff_json(DOCUMENT1, DOCUMENT2)
+                   if kind == "change"]
+        self.assertEqual(changes, [record for record in differences if record[0] == "change"])
+
+
+if __name__ == "__main__":
+    unittest.main()